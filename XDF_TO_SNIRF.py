@@ -1,12 +1,67 @@
 import pyxdf
 import snirf
+import h5py
 from utils import *
 from xdf_formatter import *
+from xdf_reader import XdfChunkReader, XdfStreamSelection, header_only_stream, load_selected_xdf
+from snirf_writer import SnirfTimeSeriesWriter, SnirfChunkBuffer, SnirfStorage, write_stim_groups
+from probe_cache import ProbeCache
+from aux_alignment import align_time_series, common_time_base, link_shared_time
+from markers import is_marker_stream, group_markers
+from instrumentation import instrumentation
+from validation import TIERS, validate_file
+from xdf_timing import XdfTimingOptions, timing_report
 import os
-from mne.io import read_raw_snirf
+import json
+import hashlib
 import argparse
 import shutil
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+class XdfChannelRecord():
+    """
+    This class reads the fields of an XDF channel once and classifies its data type, so the probe and the
+    measurement list element are built from plain attributes instead of repeated metadata lookups.
+    Time domain and DCS delays and widths are converted from picoseconds to seconds.
+    """
+    def __init__(self, xdf_channel):
+        """
+        Initialize the class with an XDF channel.
+        :param xdf_channel: A dictionary-like object containing channel-specific data from the XDF file. Formated
+        accoring to https://github.com/sccn/xdf/wiki/NIRS-Meta-Data
+        """
+        self.xdf_channel = xdf_channel #Store the XDF channel.
+        self.source = get(xdf_channel, "source") #Label of the source optode.
+        self.detector = get(xdf_channel, "detector") #Label of the detector optode.
+        self.wavelen = get(xdf_channel, "wavelen") #Nominal wavelength.
+        self.wavelen_measured = get(xdf_channel, "wavelen_measured") #Actual measured wavelength.
+        self.fluorescence_wavelen = get(xdf_channel, "fluorescence.wavelen") #Nominal fluorescence emission wavelength.
+        self.fluorescence_wavelen_measured = get(xdf_channel, "fluorescence.wavelen_measured") #Actual fluorescence emission wavelength.
+        self.type = get(xdf_channel, "type") #Data type label.
+        self.unit = get(xdf_channel, "unit") #Data unit.
+        self.power = get(xdf_channel, "power") #Source power.
+        self.gain = get(xdf_channel, "gain") #Detector gain.
+        self.dataType = Get_DataType(get(xdf_channel, "measure")) #SNIRF data type of the measurement.
+
+        #Read the parameters of the measurement type only.
+        self.fd_frequency = None
+        self.td_order = None
+        self.td_delay = None
+        self.td_width = None
+        self.dcs_delay = None
+        self.dcs_width = None
+        if Is_DCS(self.dataType):
+            self.dcs_delay = convert("ps", "s", get(xdf_channel, "dcs.delay"))
+            self.dcs_width = convert("ps", "s", get(xdf_channel, "dcs.width"))
+        elif Is_Frequency_Domain(self.dataType):
+            self.fd_frequency = get(xdf_channel, "fd.frequency")
+        elif Is_Moment_Time_Domain(self.dataType):
+            self.td_order = get(xdf_channel, "td.order")
+        elif Is_Gated_Time_Domain(self.dataType):
+            self.td_delay = convert("ps", "s", get(xdf_channel, "td.delay"))
+            self.td_width = convert("ps", "s", get(xdf_channel, "td.width"))
 
 
 class XdfToSnirfMeasurmentListElement():
@@ -15,16 +70,22 @@ class XdfToSnirfMeasurmentListElement():
     Each measurement list element contains information about a NIRS channel, such as source/detector indices, 
     wavelength information, data type, and other relevant data.
     """
-    def __init__(self, xdf_channel, probe: snirf.Probe):
+    def __init__(self, xdf_channel, probe: snirf.Probe, probe_index = None):
         """
         Initialize the class with an XDF channel and a SNIRF probe object.
         :param xdf_channel: A dictionary-like object containing channel-specific data from the XDF file. Formated
-        accoring to https://github.com/sccn/xdf/wiki/NIRS-Meta-Data
+        accoring to https://github.com/sccn/xdf/wiki/NIRS-Meta-Data, or the XdfChannelRecord of such a channel.
         :param probe: A pysnirf2.Probe object containing information about the probe configuration.
+        :param probe_index: Optional XdfToSnirfProbeIndex of the probe. Built from the probe if not given, pass it
+        when converting many channels so it is only built once.
         """
         
-        self.xdf_channel = xdf_channel #Store the XDF channel.
+        if not isinstance(xdf_channel, XdfChannelRecord):
+            xdf_channel = XdfChannelRecord(xdf_channel)
+        self.channel_record = xdf_channel #Store the classified XDF channel.
+        self.xdf_channel = xdf_channel.xdf_channel #Store the XDF channel.
         self.snirf_probe = probe #Store the pysnirf2 probe.
+        self.probe_index = probe_index if probe_index is not None else XdfToSnirfProbeIndex(probe) #Store the lookup indexes of the probe.
         self.measurmentListElement = snirf.MeasurementListElement('', conf) # Populate the pysnirf2 MeasurementListElement with the relevant data from the XDF channel.
         self.populate_measurment_list_element()
 
@@ -34,7 +95,7 @@ class XdfToSnirfMeasurmentListElement():
         The source index refers to the index of the source optode in the pysnirf2 probe.
         """
         # Get the source label from the XDF channel, find its index in the pysnirf2 probe, and set it as the source index.
-        self.measurmentListElement.sourceIndex =  get_index(self.snirf_probe.sourceLabels, get(self.xdf_channel, "source")) + 1
+        self.measurmentListElement.sourceIndex =  self.probe_index.sourceLabels.get(self.channel_record.source) + 1
 
     def PopulateDetectorIndex(self):
         """
@@ -42,7 +103,7 @@ class XdfToSnirfMeasurmentListElement():
         The detector index refers to the index of the detector optode in the pysnirf2 probe.
         """
         # Get the detector label from the XDF channel, find its index in the pysnirf2 probe, and set it as the detector index.
-        self.measurmentListElement.detectorIndex =  get_index(self.snirf_probe.detectorLabels, get(self.xdf_channel, "detector")) + 1
+        self.measurmentListElement.detectorIndex =  self.probe_index.detectorLabels.get(self.channel_record.detector) + 1
 
     def PopulateWavelengthIndex(self):
         """
@@ -50,29 +111,29 @@ class XdfToSnirfMeasurmentListElement():
         The wavelength index refers to the Index of the "nominal" wavelength (in probe.wavelengths).
         """
         # Get the wavelength from the XDF channel, find its index in the pysnirf2 probe, and set it as the wavelength index.
-        self.measurmentListElement.wavelengthIndex = get_index(self.snirf_probe.wavelengths, get(self.xdf_channel, "wavelen")) + 1
+        self.measurmentListElement.wavelengthIndex = self.probe_index.wavelengths.get(self.channel_record.wavelen) + 1
 
     def PopulateWavelegnthActual(self):
         """
         Populate the actual measured wavelength for the measurement list element.
         """
         # Get the actual measured wavelength from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.wavelengthActual = get(self.xdf_channel, "wavelen_measured")
+        self.measurmentListElement.wavelengthActual = self.channel_record.wavelen_measured
         
     def PopulateWavelengthEmissionActual(self):
         """
         Populate the actual measured wavelength for fluorescence emission, if available.
         """
         # Get the fluorescence emission wavelength from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.wavelengthEmissionActual = get(self.xdf_channel, "fluorescence.wavelen_measured")
+        self.measurmentListElement.wavelengthEmissionActual = self.channel_record.fluorescence_wavelen_measured
 
     def PopulateDataType(self):
         """
         Populate the data type for the measurement list element.
         The data type describes the type of measurement, such as continuous wave, frequency domain, etc.
         """
-        # Get the data type from the XDF channel, convert it, and set it in the measurement list element.
-        self.measurmentListElement.dataType =  Get_DataType(get(self.xdf_channel, "measure"))
+        # Get the data type classified from the XDF channel and set it in the measurement list element.
+        self.measurmentListElement.dataType =  self.channel_record.dataType
 
     def PopulateDataUnit(self):
         """
@@ -80,7 +141,7 @@ class XdfToSnirfMeasurmentListElement():
         The data unit specifies the SI units identifier for the given channel such as V/us.
         """
         # Get the data unit from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.dataUnit = get(self.xdf_channel, "unit")
+        self.measurmentListElement.dataUnit = self.channel_record.unit
 
     
     def PopulateDataTypeLabel(self):
@@ -89,7 +150,7 @@ class XdfToSnirfMeasurmentListElement():
         The data type label provides a descriptive label for the type of data being measured.
         """
         # Get the data type label from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.dataTypeLabel = get(self.xdf_channel, "type")
+        self.measurmentListElement.dataTypeLabel = self.channel_record.type
 
     
     def PopulateDataTypeIndex(self):
@@ -98,38 +159,8 @@ class XdfToSnirfMeasurmentListElement():
         The data type index is used to reference additional properties specific to certain types of measurements,
         such as delay and width for gated time-domain measurements.
         """
-        data_type_index = 0
-        # Check if the channel is of type DCS (Diffuse Correlation Spectroscopy).
-        if Is_DCS(self.measurmentListElement.dataType):
-            # Convert delay and width from picoseconds to seconds and find their indices.
-            delay = convert("ps", "s", get(self.xdf_channel, "dcs.delay"))
-            width = convert("ps", "s", get(self.xdf_channel, "dcs.width"))
-            delay_indexes = {i for i, x in enumerate(self.snirf_probe.correlationTimeDelays) if x == delay}
-            width_indexes = {i for i, x in enumerate(self.snirf_probe.correlationTimeDelayWidths) if x == width}
-            # Find the intersection of delay and width indices to get the data type index.
-            data_type_index = delay_indexes.intersection(width_indexes).pop() + 1
-        
-        # Check if the channel is of type Frequency Domain.
-        elif Is_Frequency_Domain(self.measurmentListElement.dataType):
-            # Get the frequency from the XDF channel, find its index in the pysnirf2 probe, and set it as the data type index.
-            data_type_index = get_index(self.snirf_probe.frequencies, get(self.xdf_channel, "fd.frequency")) + 1
-        
-        # Check if the measurement is of type Moment Time Domain.
-        elif Is_Moment_Time_Domain(self.measurmentListElement.dataType):
-            # Get the order from the XDF channel, find its index in the pysnirf2 probe, and set it as the data type index.
-            data_type_index = get_index(self.snirf_probe.momentOrders, get(self.xdf_channel, "td.order")) + 1           
-        
-        # Check if the measurement is of type Gated Time Domain.
-        elif Is_Gated_Time_Domain(self.measurmentListElement.dataType):
-            # Convert delay and width from picoseconds to seconds and find their indices.
-            delay = convert("ps", "s", get(self.xdf_channel, "td.delay"))
-            width = convert("ps", "s", get(self.xdf_channel, "td.width"))
-            delay_indexes = {i for i, x in enumerate(self.snirf_probe.timeDelays) if x == delay}
-            width_indexes = {i for i, x in enumerate(self.snirf_probe.timeDelayWidths) if x == width}
-            # Find the intersection of delay and width indices to get the data type index.
-            data_type_index = delay_indexes.intersection(width_indexes).pop() + 1
         # Set the data type index in the measurement list element.
-        self.measurmentListElement.dataTypeIndex = data_type_index
+        self.measurmentListElement.dataTypeIndex = data_type_index(self.channel_record, self.probe_index)
 
 
     def PopulateSourcePower(self):
@@ -138,7 +169,7 @@ class XdfToSnirfMeasurmentListElement():
         The source power represents the power emitted by the source optode.
         """
         # Get the source power from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.sourcePower = get(self.xdf_channel, "power")
+        self.measurmentListElement.sourcePower = self.channel_record.power
 
     def PopulateDetectorGain(self):
         """
@@ -146,7 +177,7 @@ class XdfToSnirfMeasurmentListElement():
         The detector gain represents the amplification factor applied to the signal detected by the detector optode.
         """
         # Get the detector gain from the XDF channel and set it in the measurement list element.
-        self.measurmentListElement.detectorGain = get(self.xdf_channel, "gain")
+        self.measurmentListElement.detectorGain = self.channel_record.gain
 
     def populate_measurment_list_element(self):
         """
@@ -165,6 +196,56 @@ class XdfToSnirfMeasurmentListElement():
         self.PopulateDetectorGain()
 
 
+def data_type_index(channel_record: XdfChannelRecord, probe_index):
+    """
+    :param channel_record: The XdfChannelRecord of the channel.
+    :param probe_index: The XdfToSnirfProbeIndex of the probe.
+    :return: The 1-based index of the channel's data type parameters in the probe, or 0 for continuous wave channels.
+    """
+    # Check if the channel is of type DCS (Diffuse Correlation Spectroscopy).
+    if Is_DCS(channel_record.dataType):
+        # Find the index of the (delay, width) pair.
+        return probe_index.correlationTimeDelays[(channel_record.dcs_delay, channel_record.dcs_width)] + 1
+
+    # Check if the channel is of type Frequency Domain.
+    elif Is_Frequency_Domain(channel_record.dataType):
+        # Find the index of the frequency in the pysnirf2 probe.
+        return probe_index.frequencies.get(channel_record.fd_frequency) + 1
+
+    # Check if the measurement is of type Moment Time Domain.
+    elif Is_Moment_Time_Domain(channel_record.dataType):
+        # Find the index of the order in the pysnirf2 probe.
+        return probe_index.momentOrders.get(channel_record.td_order) + 1
+
+    # Check if the measurement is of type Gated Time Domain.
+    elif Is_Gated_Time_Domain(channel_record.dataType):
+        # Find the index of the (delay, width) pair.
+        return probe_index.timeDelays[(channel_record.td_delay, channel_record.td_width)] + 1
+    return 0
+
+
+class XdfToSnirfProbeIndex():
+    """
+    This class holds hash indexes from the labels, wavelengths and data type parameters of a pysnirf2 probe
+    to their (0-based) positions in the probe, so each measurement list element is resolved in constant time
+    instead of searching the probe lists.
+    """
+    def __init__(self, probe: snirf.Probe):
+        """
+        Initialize the class by indexing a populated pysnirf2 probe.
+
+        :param probe: A pysnirf2.Probe object containing information about the probe configuration.
+        """
+        self.sourceLabels = build_index(optional_list(probe.sourceLabels)) #Index of the source labels.
+        self.detectorLabels = build_index(optional_list(probe.detectorLabels)) #Index of the detector labels.
+        self.wavelengths = build_index(optional_list(probe.wavelengths)) #Index of the nominal wavelengths.
+        self.frequencies = build_index(optional_list(probe.frequencies)) #Index of the modulation frequencies.
+        self.momentOrders = build_index(optional_list(probe.momentOrders)) #Index of the moment orders.
+        #Index of the (delay, width) pairs of gated time domain and DCS measurements.
+        self.timeDelays = build_index(zip(optional_list(probe.timeDelays), optional_list(probe.timeDelayWidths)))
+        self.correlationTimeDelays = build_index(zip(optional_list(probe.correlationTimeDelays), optional_list(probe.correlationTimeDelayWidths)))
+
+
 class XdfToSnirfProbe():
     """
     This class converts XDF NIRS channel and optode information into a corresponding probe object 
@@ -180,6 +261,7 @@ class XdfToSnirfProbe():
         :param xdf_nirs_fiducials: Optional list of fiducial points from the XDF file.
         """
         self.xdf_channels = xdf_nirs_channels #Store the XDF channel data.
+        self.channelRecords = [XdfChannelRecord(channel) for channel in xdf_nirs_channels] #Classify every XDF channel once.
         self.xdf_optodes = xdf_nirs_optodes #Store the XDF optode data.
         self.xdf_source_optodes = [] #List to hold source optodes from the XDF data.
         self.xdf_detector_optodes = [] #List to hold detector optodes from the XDF data.
@@ -190,6 +272,8 @@ class XdfToSnirfProbe():
         self.SeperateXdfOptodes()
         # Populate the probe with the relevant data.
         self.PopulateProbe()
+        # Index the populated probe for the measurement list elements.
+        self.probeIndex = XdfToSnirfProbeIndex(self.probe)
 
 
     def PopulateProbe(self):
@@ -320,10 +404,8 @@ class XdfToSnirfProbe():
         Populate the nominal wavelengths and, if applicable, nominal fluorescence emission wavelengths.
         """
         s = set() #Set to store unique wavelength and fluorescence wavelength pairs.
-        for channel in self.xdf_channels:
-            wavelen = get(channel, "wavelen")
-            fluorescence_wavelen = get(channel, "fluorescence.wavelen")
-            s.add((wavelen, fluorescence_wavelen))
+        for record in self.channelRecords:
+            s.add((record.wavelen, record.fluorescence_wavelen))
 
         wavelengths = [] #List to hold wavelengths.
         wavelengthsEmissions = [] #List to hold fluorescence emission wavelengths.
@@ -340,12 +422,9 @@ class XdfToSnirfProbe():
         This includes delays and widths of time windows for correlating light intensity fluctuations.
         """
         dcs = set() #Set to store unique delay and width pairs.
-        for channel in self.xdf_channels:
-            data_type = Get_DataType(get(channel, "measure"))
-            if  Is_DCS(data_type):
-                delay = convert("ps", "s", get(channel, "dcs.delay"))
-                width = convert("ps", "s", get(channel, "dcs.width"))
-                dcs.add((delay, width))
+        for record in self.channelRecords:
+            if  Is_DCS(record.dataType):
+                dcs.add((record.dcs_delay, record.dcs_width))
 
         delays = []  #List to hold delays.
         widths = []  #List to hold widths.
@@ -363,12 +442,9 @@ class XdfToSnirfProbe():
         """
         td = set()  #Set to store unique delay and width pairs for gated time domain measurements.
 
-        for channel in self.xdf_channels:
-            data_type = Get_DataType(get(channel, "measure"))
-            if  Is_Gated_Time_Domain(data_type):
-                delay =  convert("ps", "s" ,get(channel, "td.delay"))
-                width = convert("ps", "s" ,get(channel, "td.width"))
-                td.add((delay, width))
+        for record in self.channelRecords:
+            if  Is_Gated_Time_Domain(record.dataType):
+                td.add((record.td_delay, record.td_width))
         
         delays = [] #List to hold delays.
         widths = [] #List to hold widths.
@@ -385,11 +461,9 @@ class XdfToSnirfProbe():
         Populate the moment time domain data for measurements involving moment time-domain spectroscopy.
         """
         td = set() # Set to store unique moment orders.
-        for channel in self.xdf_channels:
-            data_type = Get_DataType(get(channel, "measure"))
-            if  Is_Moment_Time_Domain(data_type):
-                order = get(channel,"td.order")  #Extract the order of the moment from the channel data.
-                td.add(order)
+        for record in self.channelRecords:
+            if  Is_Moment_Time_Domain(record.dataType):
+                td.add(record.td_order)
         
         orders = [] #List to hold moment orders.
         for order in td:
@@ -404,10 +478,9 @@ class XdfToSnirfProbe():
         Populate the frequency domain data for measurements involving frequency domain spectroscopy (FDS).
         """
         frequencies = [] #List to hold frequencies.
-        for channel in self.xdf_channels:
-            data_type = Get_DataType(get(channel, "measure"))
-            if Is_Frequency_Domain(data_type):
-                try_append(frequencies, get(channel, "fd.frequencies"))
+        for record in self.channelRecords:
+            if Is_Frequency_Domain(record.dataType):
+                try_append(frequencies, record.fd_frequency)
         
         #Store the frequencies in the probe object.
         self.probe.frequencies = frequencies
@@ -420,22 +493,98 @@ class XdfToSnirfMeasurmentList():
     This class initializes a pysnirf2 MeasurementList object and populates it with MeasurementListElement objects
     created from XDF NIRS channel data.
     """
-    def __init__(self, xdf_nirs_stream, snirf_file, probe: snirf.Probe):
+    def __init__(self, xdf_nirs_stream, snirf_file, probe: snirf.Probe, probe_index = None, channel_records = None):
         """
         Initialize the XdfToSnirfMeasurmentList class.
         
         :param xdf_nirs_stream: XDF stream containing NIRS channels.
         :param snirf_file: Path to the SNIRF file where the MeasurementList will be saved.
         :param probe: pysnirf2.Probe object containing information about sources, detectors, and other probe details.
+        :param probe_index: Optional XdfToSnirfProbeIndex of the probe, built once here if not given.
+        :param channel_records: Optional XdfChannelRecord of each channel, classified from the stream if not given.
         """
         # Initialize the MeasurementList object from pysnirf2 using the provided SNIRF file and configuration.
         self.measurementList = snirf.MeasurementList(snirf_file, conf)
 
-        # Retrieve channels from the XDF stream.
-        channels = get(xdf_nirs_stream, "info.desc.channels.channel")
+        # Index the probe once for all channels.
+        if probe_index is None:
+            probe_index = XdfToSnirfProbeIndex(probe)
+
+        # Retrieve and classify the channels from the XDF stream.
+        if channel_records is None:
+            channel_records = [XdfChannelRecord(channel) for channel in get(xdf_nirs_stream, "info.desc.channels.channel")]
         # Convert each channel to MeasurementListElement and append to pysnir2 measurementList object.
-        for channel in channels:
-            self.measurementList.append(XdfToSnirfMeasurmentListElement(channel, probe).measurmentListElement)
+        for record in channel_records:
+            self.measurementList.append(XdfToSnirfMeasurmentListElement(record, probe, probe_index).measurmentListElement)
+
+
+MEASUREMENT_LIST_LAYOUTS = ["groups", "arrays"]
+
+class XdfToSnirfMeasurementLists():
+    """
+    Class to convert a list of XDF NIRS channels into the SNIRF 1.1 measurementLists layout, with one array per
+    field (sourceIndex, detectorIndex, ...) instead of one measurementList{i} group per channel.
+
+    pysnirf2 does not support this layout, so the data element is saved with an empty measurement list and the
+    arrays are written into its group with h5py afterwards, see Write.
+    """
+    def __init__(self, xdf_nirs_stream, probe: snirf.Probe, probe_index = None, channel_records = None, columns = None):
+        """
+        Initialize the XdfToSnirfMeasurementLists class.
+
+        :param xdf_nirs_stream: XDF stream containing NIRS channels.
+        :param probe: pysnirf2.Probe object containing information about sources, detectors, and other probe details.
+        :param probe_index: Optional XdfToSnirfProbeIndex of the probe, built once here if not given.
+        :param channel_records: Optional XdfChannelRecord of each channel, classified from the stream if not given.
+        :param columns: Optional columns, e.g. from the probe cache, in which case nothing is converted.
+        """
+        if columns is None:
+            if probe_index is None:
+                probe_index = XdfToSnirfProbeIndex(probe)
+            if channel_records is None:
+                channel_records = [XdfChannelRecord(channel) for channel in get(xdf_nirs_stream, "info.desc.channels.channel")]
+            columns = {"sourceIndex": [probe_index.sourceLabels.get(record.source) + 1 for record in channel_records],
+                       "detectorIndex": [probe_index.detectorLabels.get(record.detector) + 1 for record in channel_records],
+                       "wavelengthIndex": [probe_index.wavelengths.get(record.wavelen) + 1 for record in channel_records],
+                       "wavelengthActual": [record.wavelen_measured for record in channel_records],
+                       "wavelengthEmissionActual": [record.fluorescence_wavelen_measured for record in channel_records],
+                       "dataType": [record.dataType for record in channel_records],
+                       "dataUnit": [record.unit for record in channel_records],
+                       "dataTypeLabel": [record.type for record in channel_records],
+                       "dataTypeIndex": [data_type_index(record, probe_index) for record in channel_records],
+                       "sourcePower": [record.power for record in channel_records],
+                       "detectorGain": [record.gain for record in channel_records]}
+        self.columns = columns #The values of each field as a list, one entry per channel, None where missing.
+
+    def Arrays(self):
+        """
+        :return: A dictionary of the NumPy array of each field with a value for at least one channel. Index and
+        data type fields are integers, labels and units strings (empty where missing) and the rest floats (NaN where missing).
+        """
+        arrays = {}
+        for field, values in self.columns.items():
+            if all(value is None for value in values):
+                continue
+            if field in ("sourceIndex", "detectorIndex", "wavelengthIndex", "dataType", "dataTypeIndex"):
+                arrays[field] = numpy.asarray(values, dtype=numpy.int32)
+            elif field in ("dataUnit", "dataTypeLabel"):
+                arrays[field] = numpy.asarray(["" if value is None else str(value) for value in values], dtype=object)
+            else:
+                arrays[field] = numpy.asarray([numpy.nan if value is None else value for value in values], dtype=numpy.float64)
+        return arrays
+
+    def Write(self, data_group: h5py.Group):
+        """
+        Write the arrays into the measurementLists group of a saved data group.
+
+        :param data_group: The HDF5 data group, e.g. /nirs/data1.
+        """
+        measurement_lists = data_group.require_group("measurementLists")
+        for field, values in self.Arrays().items():
+            if values.dtype == object:
+                measurement_lists.create_dataset(field, data=values, dtype=h5py.string_dtype(encoding="ascii"))
+            else:
+                measurement_lists.create_dataset(field, data=values)
 
 
 
@@ -444,12 +593,21 @@ class XdfToSnirfAuxElement():
     Initialize the XdfToSnirfAuxElement class.
     
     :param xdf_aux_stream: XDF stream containing auxiliary data (e.g., accelerometer, gyroscope).
+    :param time_base: Optional time stamps to interpolate the stream onto. The stream is stored as recorded if None.
+    :param time_origin: Time stamp the aligned time is relative to, usually the first NIRS time stamp.
     """
-    def __init__(self, xdf_aux_stream) -> None:
+    def __init__(self, xdf_aux_stream, time_base = None, time_origin = 0) -> None:
         self.auxElement = snirf.AuxElement("", conf) #Initialize the AuxElement object from pysnirf2 with an empty name and configuration.
         xdf_time_Stamps = get(xdf_aux_stream, "time_stamps") #Retrieve the time stamps from the XDF auxiliary stream.
-        self.auxElement.time = numpy.array(xdf_time_Stamps) - xdf_time_Stamps[0] #Normalize time stamps relative to the start time and assign them to the AuxElement.
-        self.auxElement.dataTimeSeries = get(xdf_aux_stream, "time_series") #Populate the AuxElement with the time series data from the XDF auxiliary stream.
+        xdf_time_series = get(xdf_aux_stream, "time_series")
+        if time_base is not None and numpy.asarray(xdf_time_series).dtype.kind in "biuf":
+            #Put the stream on the shared time base, relative to the NIRS start.
+            self.auxElement.time = time_base - time_origin
+            self.auxElement.dataTimeSeries = align_time_series(xdf_time_Stamps, xdf_time_series, time_base)
+        else:
+            xdf_time_Stamps = numpy.asarray(xdf_time_Stamps, dtype=numpy.float64)
+            self.auxElement.time = xdf_time_Stamps - (xdf_time_Stamps[0] if len(xdf_time_Stamps) else 0) #Normalize time stamps relative to the start time and assign them to the AuxElement.
+            self.auxElement.dataTimeSeries = xdf_time_series #Populate the AuxElement with the time series data from the XDF auxiliary stream.
         self.auxElement.name = get(xdf_aux_stream, "info.name") #Set the name of the AuxElement based on the name provided in the XDF auxiliary stream.
 
 
@@ -458,42 +616,52 @@ class XdfToSnirfAux():
     """
     Class to convert XDF auxiliary streams into SNIRF Aux objects.
     """
-    def __init__(self, snirf_file, xdf_aux_streams) -> None:
+    def __init__(self, snirf_file, xdf_aux_streams, time_base = None, time_origin = 0) -> None:
         """
         Initialize the XdfToSnirfAux class.
 
         :param snirf_file: The target SNIRF file to which auxiliary data will be added.
         :param xdf_aux_streams: A list of XDF streams containing auxiliary data.
+        :param time_base: Optional time stamps every numeric aux stream is interpolated onto.
+        :param time_origin: Time stamp the aligned time is relative to.
         """
         #Initialize the SNIRF Aux object using the specified SNIRF file and configuration.
         self.aux = snirf.Aux(snirf_file, conf)
         #Loop through each XDF auxiliary stream and convert it to a SNIRF AuxElement.
         for aux_stream in xdf_aux_streams:
-            self.aux.append(XdfToSnirfAuxElement(aux_stream).auxElement)
+            self.aux.append(XdfToSnirfAuxElement(aux_stream, time_base, time_origin).auxElement)
 
 
 class XdfToSnirfDataElement():
     """
     Class to convert an XDF NIRS stream into a SNIRF DataElement.
     """
-    def __init__(self, xdf_nirs_stream, snirf_file, probe: snirf.Probe):
+    def __init__(self, xdf_nirs_stream, snirf_file, probe: snirf.Probe, probe_index = None, channel_records = None, measurement_list = None):
         """
         Initialize the XdfToSnirfDataElement class.
 
         :param xdf_nirs_stream: The XDF stream containing NIRS data.
         :param snirf_file: The target SNIRF file to which the data element will be added.
         :param probe: The SNIRF probe object that corresponds to this data element.
+        :param probe_index: Optional XdfToSnirfProbeIndex of the probe.
+        :param channel_records: Optional XdfChannelRecord of each channel of the stream.
+        :param measurement_list: Optional pysnirf2 MeasurementList (e.g. from the probe cache), converted from the stream if not given.
         """
         self.dataElement = snirf.DataElement("", conf) #Initialize the SNIRF DataElement object using the specified configuration.
         
-        #Retrieve the time stamps from the XDF NIRS stream.
-        xdf_time_Stamps = get(xdf_nirs_stream, "time_stamps") 
-        self.dataElement.time = numpy.array(xdf_time_Stamps) - xdf_time_Stamps[0]
+        #Retrieve the time stamps from the XDF NIRS stream and make them relative to the first one. The offset is
+        #subtracted in place on pyxdf's float64 array rather than on a copy, so the stream's time stamps are shifted.
+        xdf_time_Stamps = numpy.asarray(get(xdf_nirs_stream, "time_stamps"), dtype=numpy.float64)
+        if len(xdf_time_Stamps):
+            xdf_time_Stamps -= xdf_time_Stamps[0]
+        self.dataElement.time = xdf_time_Stamps
 
         #Populate the time series data into the DataElement.
         self.dataElement.dataTimeSeries = get(xdf_nirs_stream, "time_series")
         #Create and assign the MeasurementList to the DataElement.
-        self.dataElement.measurementList = XdfToSnirfMeasurmentList(xdf_nirs_stream, snirf_file, probe).measurementList
+        if measurement_list is None:
+            measurement_list = XdfToSnirfMeasurmentList(xdf_nirs_stream, snirf_file, probe, probe_index, channel_records).measurementList
+        self.dataElement.measurementList = measurement_list
 
 
 
@@ -501,51 +669,108 @@ class XdfToSnirfData():
     """
     Class to convert XDF NIRS streams into SNIRF Data object.
     """
-    def __init__(self, probe: snirf.Probe, xdf_nirs_stream, snirf_file):
+    def __init__(self, probe: snirf.Probe, xdf_nirs_stream, snirf_file, probe_index = None, channel_records = None, measurement_list = None):
         """
         Initialize the XdfToSnirfData class.
 
         :param probe: The SNIRF probe object that corresponds to the data.
         :param xdf_nirs_stream: The XDF stream containing NIRS data.
         :param snirf_file: The target SNIRF file to which the data will be added.
+        :param probe_index: Optional XdfToSnirfProbeIndex of the probe.
+        :param channel_records: Optional XdfChannelRecord of each channel of the stream.
+        :param measurement_list: Optional pysnirf2 MeasurementList of the stream.
         """
         #Convert the XDF NIRS stream to a SNIRF DataElement.
-        snirf_data_elemtent =  XdfToSnirfDataElement(xdf_nirs_stream, snirf_file, probe)
+        snirf_data_elemtent =  XdfToSnirfDataElement(xdf_nirs_stream, snirf_file, probe, probe_index, channel_records, measurement_list)
         self.data = snirf.Data(snirf_file, conf) #Initialize the SNIRF Data object using the specified configuration.
         self.data.append(snirf_data_elemtent.dataElement) #Append the converted DataElement to the SNIRF Data object.
 
 
+class XdfToSnirfStim():
+    """
+    Class to convert XDF marker streams into a SNIRF Stim object, with one stim group per distinct marker value.
+    """
+    def __init__(self, snirf_file, xdf_marker_streams, time_origin = 0) -> None:
+        """
+        Initialize the XdfToSnirfStim class.
+
+        :param snirf_file: The target SNIRF file to which the stim groups will be added.
+        :param xdf_marker_streams: A list of XDF streams with string markers.
+        :param time_origin: Time stamp the onsets are relative to, usually the first NIRS time stamp.
+        """
+        self.stim = snirf.Stim(snirf_file, conf) #Initialize the SNIRF Stim object using the specified configuration.
+
+        #Pool the markers of every non-empty stream, then group them by value.
+        xdf_marker_streams = [stream for stream in xdf_marker_streams if len(get(stream, "time_stamps"))]
+        if not xdf_marker_streams:
+            return
+        time_stamps = [numpy.asarray(get(stream, "time_stamps"), dtype=numpy.float64) for stream in xdf_marker_streams]
+        markers = [numpy.asarray(get(stream, "time_series"), dtype=object).reshape(len(stamps), -1)[:, :1]
+                   for stream, stamps in zip(xdf_marker_streams, time_stamps)]
+        for name, data in group_markers(numpy.concatenate(time_stamps), numpy.concatenate(markers), time_origin):
+            stim_element = snirf.StimElement("", conf)
+            stim_element.name = name
+            stim_element.data = data
+            self.stim.append(stim_element)
+
+
 class XdfToSnirfNirsElement():
     """
     Class to convert XDF streams into a SNIRF NirsElement.
     """
-    def __init__(self, xdf_streams, xdf_file_header, snirf_file):
+    def __init__(self, xdf_streams, xdf_file_header, snirf_file, probe_cache: ProbeCache = None, align_aux = None,
+                 measurement_list_layout = "groups"):
         """
         Initialize the XdfToSnirfNirsElement class.
 
         :param xdf_streams: A list of XDF streams, including fNIRS and auxiliary data.
         :param xdf_file_header: Header information from the XDF file.
         :param snirf_file: The target SNIRF file to which the NirsElement will be added.
+        :param probe_cache: Optional ProbeCache the probe and measurement list are loaded from and stored to.
+        :param align_aux: "nirs" to interpolate the aux streams onto the NIRS time stamps, a rate in Hz to interpolate
+        them onto a common rate from the NIRS start, or None to store them as recorded.
+        :param measurement_list_layout: "groups" for one measurementList{i} group per channel, or "arrays" for the
+        measurementLists arrays, stored in self.measurementLists and written after saving (see write_measurement_lists).
         """
         xdf_nirs_stream = None
         xdf_aux_streams = []
+        xdf_marker_streams = []
         #xdf_date, xdf_time = get(xdf_file_header, "info.datetime", "").split("T")
         
-        #Loop through streams to separate NIRS and auxiliary data streams.
+        #Loop through streams to separate NIRS, marker and auxiliary data streams.
         for stream in xdf_streams:
             if get(stream, "info.type") == "NIRS":
-                #Handle any special cases for specific devices (e.g., LUMO device).
-                if get(stream, "info.name") == 'LUMO HA00030/GA00324':
-                    stream = LumoxdfToStandardXdf(stream).stream
-                xdf_nirs_stream = stream  #Assume only one NIRS stream per XDF file.
+                #Normalize the metadata of devices with their own desc() layout (e.g., LUMO), see xdf_formatter.DEVICE_ADAPTERS.
+                normalize_xdf_stream(stream)
+                xdf_nirs_stream = stream  #Assume only one NIRS stream per nirs group, see XdfToSnirfNirs.
+            elif is_marker_stream(stream):
+                xdf_marker_streams.append(stream)
             else:
                 xdf_aux_streams.append(stream)
 
+        self.xdf_nirs_stream = xdf_nirs_stream #Store the XDF NIRS stream converted into the data group.
+        self.xdf_aux_streams = xdf_aux_streams #Store the XDF aux streams, in the order of the aux groups.
+        self.xdf_marker_streams = xdf_marker_streams #Store the XDF marker streams converted into the stim groups.
+
         #Initialize the SNIRF NirsElement object.
         self.NirsElement = snirf.NirsElement("" , conf)
 
-        #Convert and assign auxiliary data to the NirsElement.
-        self.NirsElement.aux = XdfToSnirfAux(snirf_file, xdf_aux_streams).aux
+        #The NIRS start, which stim onsets and aligned aux time are relative to.
+        nirs_time_stamps = numpy.zeros((0,))
+        if xdf_nirs_stream is not None:
+            nirs_time_stamps = numpy.asarray(get(xdf_nirs_stream, "time_stamps"), dtype=numpy.float64)
+        time_origin = nirs_time_stamps[0] if len(nirs_time_stamps) else 0
+
+        #Convert and assign auxiliary data to the NirsElement, on a shared time base if requested.
+        time_base = None
+        if align_aux is not None and xdf_nirs_stream is not None:
+            time_base = nirs_time_stamps if align_aux == "nirs" else common_time_base(nirs_time_stamps, float(align_aux))
+        with instrumentation.Stage("aux"):
+            self.NirsElement.aux = XdfToSnirfAux(snirf_file, xdf_aux_streams, time_base, time_origin).aux
+
+        #Convert and assign the markers to the NirsElement.
+        with instrumentation.Stage("stim"):
+            self.NirsElement.stim = XdfToSnirfStim(snirf_file, xdf_marker_streams, time_origin).stim
 
 
         #Populate the metaDataTags for units and subject information.
@@ -562,44 +787,506 @@ class XdfToSnirfNirsElement():
         self.xdf_optodes = get(xdf_nirs_stream, "info.desc.optodes.optode")
         self.xdf_fiducials = get(xdf_nirs_stream, "info.desc.fiducials.fiducial")
 
-        #Convert and assign the probe and data to the NirsElement.
-        self.NirsElement.probe = XdfToSnirfProbe(self.xdf_channels, self.xdf_optodes, self.xdf_fiducials).probe
-        self.NirsElement.data = XdfToSnirfData(self.NirsElement.probe, xdf_nirs_stream, snirf_file).data
+        #Load the probe and measurement list from the cache, or convert them and store them in the cache.
+        cached = None
+        if probe_cache is not None:
+            with instrumentation.Stage("probe_cache"):
+                cache_key = probe_cache.Key(xdf_nirs_stream)
+                cached = probe_cache.Load(cache_key, snirf_file, measurement_list_layout == "arrays")
+        if cached is not None:
+            probe, measurement_list = cached
+        else:
+            with instrumentation.Stage("probe"):
+                xdf_to_snirf_probe = XdfToSnirfProbe(self.xdf_channels, self.xdf_optodes, self.xdf_fiducials)
+                probe = xdf_to_snirf_probe.probe
+            with instrumentation.Stage("measurement_list"):
+                if measurement_list_layout == "arrays":
+                    measurement_list = XdfToSnirfMeasurementLists(xdf_nirs_stream, probe, xdf_to_snirf_probe.probeIndex,
+                                                                  xdf_to_snirf_probe.channelRecords).columns
+                else:
+                    measurement_list = XdfToSnirfMeasurmentList(xdf_nirs_stream, snirf_file, probe, xdf_to_snirf_probe.probeIndex,
+                                                                xdf_to_snirf_probe.channelRecords).measurementList
+            if probe_cache is not None:
+                with instrumentation.Stage("probe_cache"):
+                    probe_cache.Store(cache_key, probe, measurement_list)
+
+        #With the arrays layout the data element is saved without a measurement list, the arrays are written afterwards.
+        self.measurementLists = None #XdfToSnirfMeasurementLists of the arrays layout.
+        if measurement_list_layout == "arrays":
+            self.measurementLists = XdfToSnirfMeasurementLists(xdf_nirs_stream, probe, columns=measurement_list)
+            measurement_list = snirf.MeasurementList(snirf_file, conf)
+
+        #Assign the probe and data to the NirsElement. This shifts the NIRS time stamps in place, so it comes after
+        #everything relative to time_origin above.
+        self.NirsElement.probe = probe
+        with instrumentation.Stage("data_copy"):
+            self.NirsElement.data = XdfToSnirfData(probe, xdf_nirs_stream, snirf_file, measurement_list=measurement_list).data
 
 
 class XdfToSnirfNirs():
     """
     Class to manage the conversion of XDF streams to SNIRF Nirs objects.
+
+    Every NIRS stream is converted into its own nirs group (e.g. one per device in hyperscanning recordings),
+    in the order the streams appear in the XDF file. The groups are built concurrently in a thread pool.
     """
-    def __init__(self, xdf_streams, xdf_file_header, snirf_file): 
+    def __init__(self, xdf_streams, xdf_file_header, snirf_file, probe_cache: ProbeCache = None, aux_rule = "first", workers = None, align_aux = None,
+                 measurement_list_layout = "groups"):
         """
         Initialize the XdfToSnirfNirs class.
 
         :param xdf_streams: A list of XDF streams, including NIRS and auxiliary data.
         :param xdf_file_header: Header information from the XDF file.
         :param snirf_file: The target SNIRF file to which the Nirs object will be added.
-        """
+        :param probe_cache: Optional ProbeCache of converted probes and measurement lists.
+        :param aux_rule: Rule attaching aux streams to the nirs groups, one of AUX_RULES (see assign_aux_streams).
+        :param workers: Number of threads building the nirs groups. Defaults to one per NIRS stream.
+        :param align_aux: Optional time base of the aux streams, "nirs" or a rate in Hz (see XdfToSnirfNirsElement).
+        :param measurement_list_layout: "groups" or "arrays", one of MEASUREMENT_LIST_LAYOUTS (see XdfToSnirfNirsElement).
+        """
+        if measurement_list_layout not in MEASUREMENT_LIST_LAYOUTS:
+            raise ValueError(f"unknown measurement list layout {measurement_list_layout!r}, expected one of {MEASUREMENT_LIST_LAYOUTS}")
         self.nirs = snirf.Nirs(snirf_file, conf) #Initialize the SNIRF Nirs object using the specified configuration.
-        self.nirs.append(XdfToSnirfNirsElement(xdf_streams, xdf_file_header, snirf_file).NirsElement) #Convert the XDF streams to a SNIRF NirsElement and append it to the Nirs object.
+
+        #Split the streams into one list per nirs group: its NIRS stream followed by its aux streams.
+        #The markers describe the whole session, so every nirs group gets the marker streams.
+        xdf_nirs_streams = [stream for stream in xdf_streams if get(stream, "info.type") == "NIRS"]
+        xdf_marker_streams = [stream for stream in xdf_streams if get(stream, "info.type") != "NIRS" and is_marker_stream(stream)]
+        xdf_aux_streams = [stream for stream in xdf_streams if get(stream, "info.type") != "NIRS" and not is_marker_stream(stream)]
+        if xdf_nirs_streams:
+            group_streams = [[nirs_stream] + aux_streams + xdf_marker_streams for nirs_stream, aux_streams
+                             in zip(xdf_nirs_streams, assign_aux_streams(xdf_nirs_streams, xdf_aux_streams, aux_rule))]
+        else:
+            group_streams = [xdf_streams]
+
+        #Convert the streams of each group to a SNIRF NirsElement.
+        with ThreadPoolExecutor(max_workers=workers or len(group_streams)) as executor:
+            self.nirsElements = list(executor.map(lambda streams: XdfToSnirfNirsElement(streams, xdf_file_header, snirf_file, probe_cache, align_aux,
+                                                                                                measurement_list_layout),
+                                                  group_streams))
+        self.nirsElement = self.nirsElements[0] #The first NirsElement, for recordings with a single NIRS stream.
+        for nirs_element in self.nirsElements:
+            self.nirs.append(nirs_element.NirsElement) #Append the NirsElement to the Nirs object.
+
+
+AUX_RULES = ["first", "all", "hostname"]
+
+def assign_aux_streams(xdf_nirs_streams, xdf_aux_streams, rule = "first"):
+    """
+    Attach aux streams to NIRS streams.
+
+    :param xdf_nirs_streams: The NIRS streams, one per nirs group.
+    :param xdf_aux_streams: The aux streams.
+    :param rule: "first" attaches every aux stream to the first NIRS stream, "all" attaches every aux stream to
+    every NIRS stream, and "hostname" attaches each aux stream to the first NIRS stream recorded on the same host,
+    falling back to the first NIRS stream.
+    :return: A list with the aux streams of each NIRS stream.
+    """
+    if rule not in AUX_RULES:
+        raise ValueError(f"unknown aux rule {rule!r}, expected one of {AUX_RULES}")
+    nirs_hostnames = [get(stream, "info.hostname", report=False) for stream in xdf_nirs_streams]
+    assigned = [[] for _ in xdf_nirs_streams]
+    for aux_stream in xdf_aux_streams:
+        if rule == "all":
+            for aux_streams in assigned:
+                aux_streams.append(aux_stream)
+        elif rule == "hostname":
+            hostname = get(aux_stream, "info.hostname", report=False)
+            assigned[nirs_hostnames.index(hostname) if hostname in nirs_hostnames else 0].append(aux_stream)
+        else:
+            assigned[0].append(aux_stream)
+    return assigned
 
 
 class XdfToSnirf():
     """
     Main class for converting an XDF file containing NIRS data into a SNIRF file.
     """
-    def __init__(self, path_to_snirf, path_to_xdf, validate) -> None:
+    def __init__(self, path_to_snirf, path_to_xdf, validate, probe_cache: ProbeCache = None, aux_rule = "first", align_aux = None,
+                 storage: SnirfStorage = None, measurement_list_layout = "groups", selection: XdfStreamSelection = None,
+                 timing: XdfTimingOptions = None) -> None:
         self.snirf = snirf.Snirf(path_to_snirf)     #Initialize the SNIRF object using the specified path.
         self.snirf.formatVersion = 1.1              #Set the SNIRF format version to 1.1
-        xdf_streams, xdf_file_header = pyxdf.load_xdf(path_to_xdf)      #Load the XDF file, retrieving both the streams and file header information.
-        self.snirf.nirs = XdfToSnirfNirs(xdf_streams, xdf_file_header, self.snirf).nirs #Convert the XDF streams to a SNIRF Nirs object and assign it to the SNIRF file.
-        self.snirf.save() #Save the SNIRF file to disk.
+        load_kwargs = timing.LoadKwargs() if timing is not None else {} #pyxdf's clock synchronization and dejittering settings.
+        with instrumentation.Stage("load"):
+            if selection is None:
+                xdf_streams, xdf_file_header = pyxdf.load_xdf(path_to_xdf, **load_kwargs)      #Load the XDF file, retrieving both the streams and file header information.
+            else:
+                xdf_streams, xdf_file_header = load_selected_xdf(path_to_xdf, selection, **load_kwargs) #Decode only the selected streams and channels.
+        with instrumentation.Stage("timing"):
+            self.timing = timing_report(xdf_streams, timing) #Diagnose the time stamps before they are made relative to the NIRS start.
+        with instrumentation.Stage("convert"):
+            xdf_to_snirf_nirs = XdfToSnirfNirs(xdf_streams, xdf_file_header, self.snirf, probe_cache, aux_rule, align_aux=align_aux,
+                                               measurement_list_layout=measurement_list_layout)
+            self.snirf.nirs = xdf_to_snirf_nirs.nirs #Convert the XDF streams to a SNIRF Nirs object and assign it to the SNIRF file.
+
+        with instrumentation.Stage("save"):
+            #pysnirf2 copies the time series before writing them and has no storage options, so they are saved empty
+            #and the pyxdf arrays are written with h5py afterwards.
+            time_series = detach_time_series(xdf_to_snirf_nirs)
+            self.snirf.save() #Save the SNIRF file to disk.
+            self.snirf.close() #Close it, so it can be opened by h5py below or by a validation process.
+
+            with h5py.File(path_to_snirf, "r+") as h5_file:
+                for group_path, time, values, channel_format in time_series:
+                    dtype = storage.Dtype(channel_format) if storage is not None else numpy.float64
+                    writer = SnirfTimeSeriesWriter(h5_file, group_path, values.shape[1], 0, dtype, storage=storage, sample_count=len(time))
+                    writer.Append(time, values, in_place=True)
+                del time_series
+                write_measurement_lists(h5_file, xdf_to_snirf_nirs)
+
+            #Store the time base shared by the aligned aux streams once.
+            if align_aux is not None:
+                link_shared_time(path_to_snirf)
         
         #Validate the SNIRF file if requested.
         if validate:
-            print("validating ", path_to_snirf)
-            self.result = snirf.validateSnirf(path_to_snirf)
-            print(self.result.display())
-            read_raw_snirf(path_to_snirf)
+            self.result = validate_snirf_file(path_to_snirf)
+
+
+class XdfToSnirfStreaming():
+    """
+    Converts an XDF file containing NIRS data into a SNIRF file without holding the recording in memory.
+    The metadata is converted from the stream headers first, then the sample chunks are decoded one at a time
+    and appended to chunked, resizable HDF5 datasets. Time stamps are written as recorded, without pyxdf's
+    clock synchronization and dejittering. Marker streams are collected while reading and written as stim groups at the end.
+    """
+    def __init__(self, path_to_snirf, path_to_xdf, validate, chunk_budget_mb = 64, probe_cache: ProbeCache = None, aux_rule = "first",
+                 storage: SnirfStorage = None, measurement_list_layout = "groups", selection: XdfStreamSelection = None) -> None:
+        """
+        Initialize the XdfToSnirfStreaming class and run the conversion.
+
+        :param path_to_snirf: Path to save the SNIRF file.
+        :param path_to_xdf: Path to the XDF file to convert.
+        :param validate: Whether to validate the SNIRF file once written.
+        :param chunk_budget_mb: Memory budget, in MiB, for samples buffered before they are written to disk.
+        :param probe_cache: Optional ProbeCache of converted probes and measurement lists.
+        :param aux_rule: Rule attaching aux streams to the nirs groups, one of AUX_RULES.
+        :param storage: Optional SnirfStorage with the chunk shape, filters and dtype of the dataTimeSeries datasets.
+        :param measurement_list_layout: "groups" or "arrays", one of MEASUREMENT_LIST_LAYOUTS.
+        :param selection: Optional XdfStreamSelection of the streams and NIRS channels to convert.
+        """
+        self.xdf_reader = XdfChunkReader(path_to_xdf) #Initialize the chunk reader for the XDF file.
+        with instrumentation.Stage("load"):
+            stream_headers = self.xdf_reader.ReadHeaders() #Read the stream headers without decoding any samples.
+
+        #Drop the unselected streams, and describe the selected NIRS streams by their kept channels only.
+        #The reader keeps the full headers, which the samples are decoded with.
+        channel_indices = {}
+        if selection is not None:
+            stream_headers = {stream_id: stream_headers[stream_id] for stream_id in selection.StreamIds(stream_headers)}
+            for stream_id, header in stream_headers.items():
+                indices = selection.ChannelIndices(header)
+                if indices is not None:
+                    channel_indices[stream_id] = indices
+                    stream_headers[stream_id] = selection.SubsetHeader(header, indices)
+        if not stream_headers:
+            raise ValueError(f"no stream to convert in {path_to_xdf}, a recording may not have written its stream headers yet")
+        xdf_streams = [header_only_stream(header) for header in stream_headers.values()]
+
+        #Convert the metadata and save the SNIRF file with empty time series.
+        self.snirf = snirf.Snirf(path_to_snirf)
+        self.snirf.formatVersion = 1.1
+        with instrumentation.Stage("convert"):
+            xdf_to_snirf_nirs = XdfToSnirfNirs(xdf_streams, self.xdf_reader.file_header, self.snirf, probe_cache, aux_rule,
+                                               measurement_list_layout=measurement_list_layout)
+            self.snirf.nirs = xdf_to_snirf_nirs.nirs
+        with instrumentation.Stage("save"):
+            self.snirf.save()
+            self.snirf.close()
+
+        #Map each XDF stream to the SNIRF groups its samples are written to. An aux stream attached to
+        #several nirs groups is written to each of them.
+        nirs_elements = xdf_to_snirf_nirs.nirsElements
+        self.nirs_streams = [] #(nirs_path, stream_id) of the NIRS stream of every nirs group.
+        group_paths = {}
+        for n, nirs_element in enumerate(nirs_elements):
+            nirs_path = nirs_group_path(n, len(nirs_elements))
+            self.nirs_streams.append((nirs_path, nirs_element.xdf_nirs_stream["info"]["stream_id"]))
+            group_paths.setdefault(nirs_element.xdf_nirs_stream["info"]["stream_id"], []).append(nirs_path + "/data1")
+            for i, aux_stream in enumerate(nirs_element.xdf_aux_streams):
+                group_paths.setdefault(aux_stream["info"]["stream_id"], []).append(f"{nirs_path}/aux{i + 1}")
+
+        #Markers are few enough to be collected in memory and grouped once every chunk has been read.
+        self.marker_stream_ids = [stream_id for stream_id, header in stream_headers.items() if is_marker_stream(header)]
+        self.channel_indices = channel_indices #Kept channels of the NIRS streams subset by the selection.
+
+        #Decode the sample chunks one at a time and append them to the SNIRF file.
+        with instrumentation.Stage("samples"), h5py.File(path_to_snirf, "r+") as h5_file:
+            write_measurement_lists(h5_file, xdf_to_snirf_nirs)
+            self.writers = {} #Writers of every converted stream, indexed by stream id.
+            for stream_id, paths in group_paths.items():
+                channel_count = int(get(stream_headers[stream_id], "info.channel_count"))
+                dtype = storage.Dtype(get(stream_headers[stream_id], "info.channel_format")) if storage is not None else numpy.float64
+                self.writers[stream_id] = [SnirfTimeSeriesWriter(h5_file, group_path, channel_count, dtype=dtype, storage=storage) for group_path in paths]
+            markers = append_xdf_samples(self.xdf_reader, self.writers, self.marker_stream_ids, channel_indices, chunk_budget_mb)
+            if markers is not None:
+                write_marker_stims(h5_file, self.nirs_streams, self.writers, markers)
+
+        #Validate the SNIRF file if requested.
+        if validate:
+            self.result = validate_snirf_file(path_to_snirf)
+
+
+class XdfToSnirfIncremental():
+    """
+    Converts an XDF file that is still growing, e.g. one LabRecorder is writing, into a SNIRF file extended in place on every run.
+    The first run converts the file like XdfToSnirfStreaming and stores the conversion state in a JSON sidecar next to the
+    SNIRF file: the byte offset after the last complete chunk read, and the last time stamp and sample count of every stream.
+    Later runs decode only the chunks after that offset and append their samples to the resizable datasets.
+    The file is converted again from the start if the sidecar does not match the XDF file, the SNIRF file or the options,
+    or if a stream started after the first run. Until a NIRS stream header has been written, runs write neither
+    the SNIRF file nor the sidecar, and the next run starts from the beginning.
+    """
+    STATE_VERSION = 1
+
+    def __init__(self, path_to_snirf, path_to_xdf, chunk_budget_mb = 64, probe_cache: ProbeCache = None, aux_rule = "first",
+                 storage: SnirfStorage = None, measurement_list_layout = "groups", selection: XdfStreamSelection = None) -> None:
+        """
+        Initialize the XdfToSnirfIncremental class and convert the chunks added since the last run.
+
+        :param path_to_snirf: Path of the SNIRF file to create or extend.
+        :param path_to_xdf: Path to the XDF file to convert.
+        :param chunk_budget_mb: Memory budget, in MiB, for samples buffered before they are written to disk.
+        :param probe_cache: Optional ProbeCache of converted probes and measurement lists.
+        :param aux_rule: Rule attaching aux streams to the nirs groups, one of AUX_RULES.
+        :param storage: Optional SnirfStorage with the chunk shape, filters and dtype of the dataTimeSeries datasets.
+        :param measurement_list_layout: "groups" or "arrays", one of MEASUREMENT_LIST_LAYOUTS.
+        :param selection: Optional XdfStreamSelection of the streams and NIRS channels to convert.
+        """
+        self.state_path = path_to_snirf + ".xdfstate.json" #Path of the sidecar holding the conversion state.
+        options = incremental_options(aux_rule, storage, measurement_list_layout, selection)
+        state = read_incremental_state(self.state_path, path_to_snirf, path_to_xdf, options)
+        self.resumed = state is not None #Whether the run extended the SNIRF file of an earlier run.
+        self.start_offset = state["offset"] if state is not None else 0 #Byte offset the run started reading from.
+
+        self.converted = True #Whether a NIRS stream header had been written, so the SNIRF file was written.
+        if state is None and not has_nirs_stream_header(path_to_xdf, selection):
+            #There is no probe to convert yet, e.g. only a marker stream has started.
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            self.converted, self.appended, self.offset = False, {}, 0
+            return
+
+        if state is None:
+            backup_existing_snirf(path_to_snirf)
+            converted = XdfToSnirfStreaming(path_to_snirf, path_to_xdf, False, chunk_budget_mb, probe_cache, aux_rule, storage,
+                                            measurement_list_layout, selection)
+            xdf_reader, writers = converted.xdf_reader, converted.writers
+            state = {"version": self.STATE_VERSION, "xdf": os.path.abspath(path_to_xdf), "options": options,
+                     "headers": {str(stream_id): xml_string for stream_id, xml_string in xdf_reader.header_xml.items()},
+                     "channel_indices": {str(stream_id): indices.tolist() for stream_id, indices in converted.channel_indices.items()},
+                     "markers": converted.marker_stream_ids, "nirs": [list(nirs_stream) for nirs_stream in converted.nirs_streams]}
+            self.appended = {stream_id: stream_writers[0].samples_written for stream_id, stream_writers in writers.items()}
+        else:
+            xdf_reader = XdfChunkReader(path_to_xdf)
+            xdf_reader.LoadHeaders(state["headers"])
+            channel_indices = {int(stream_id): numpy.asarray(indices, dtype=numpy.intp) for stream_id, indices in state["channel_indices"].items()}
+            nirs_streams = [(nirs_path, stream_id) for nirs_path, stream_id in state["nirs"]]
+            with instrumentation.Stage("samples"), h5py.File(path_to_snirf, "r+") as h5_file:
+                writers = {int(stream_id): [SnirfTimeSeriesWriter(h5_file, record["path"], h5_file[record["path"]]["dataTimeSeries"].shape[1],
+                                                                  record["time_offset"], resume=True) for record in records]
+                           for stream_id, records in state["writers"].items()}
+                markers = append_xdf_samples(xdf_reader, writers, state["markers"], channel_indices, chunk_budget_mb,
+                                             state["offset"], state["last_stamps"])
+                if markers is not None:
+                    write_marker_stims(h5_file, nirs_streams, writers, markers, append=True)
+            self.appended = {stream_id: stream_writers[0].samples_written - state["writers"][str(stream_id)][0]["samples"]
+                             for stream_id, stream_writers in writers.items()}
+
+        self.offset = xdf_reader.offset #Byte offset the next run starts reading from.
+        if xdf_reader.unknown_stream_ids:
+            #A stream started after its header was read, so the next run converts the file again from the start to include it.
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            return
+        last_stamps = dict(state.get("last_stamps", {}))
+        last_stamps.update({str(stream_id): float(stamp) for stream_id, stamp in xdf_reader.last_stamps.items()})
+        state.update({"offset": xdf_reader.offset, "head_digest": xdf_head_digest(path_to_xdf, xdf_reader.offset), "last_stamps": last_stamps,
+                      "writers": {str(stream_id): [{"path": writer.group_path, "time_offset": None if writer.time_offset is None else float(writer.time_offset),
+                                                    "samples": writer.samples_written} for writer in stream_writers]
+                                  for stream_id, stream_writers in writers.items()}})
+        with open(self.state_path, "w") as state_file:
+            json.dump(state, state_file, indent=2)
+
+
+def has_nirs_stream_header(path_to_xdf, selection: XdfStreamSelection = None):
+    """
+    :return: Whether the XDF file holds the header of a NIRS stream, among the streams of the selection if given.
+    """
+    stream_headers = XdfChunkReader(path_to_xdf).ReadHeaders()
+    stream_ids = selection.StreamIds(stream_headers) if selection is not None else stream_headers.keys()
+    return any(get(stream_headers[stream_id], "info.type", report=False) == "NIRS" for stream_id in stream_ids)
+
+
+def incremental_options(aux_rule, storage: SnirfStorage, measurement_list_layout, selection: XdfStreamSelection):
+    """
+    :return: The conversion options shaping the SNIRF file, as stored in the incremental state. A later run with other
+    options converts the file again from the start.
+    """
+    return json.loads(json.dumps({"aux_rule": aux_rule, "measurement_list_layout": measurement_list_layout,
+                                  "storage": vars(storage) if storage is not None else None,
+                                  "selection": {name: sorted(value) if isinstance(value, set) else value for name, value in vars(selection).items()}
+                                               if selection is not None else None}))
+
+
+def xdf_head_digest(path_to_xdf, offset, size = 2**16):
+    """
+    :return: The SHA-1 digest of the first bytes of the XDF file, up to offset, identifying the recording.
+    """
+    with open(path_to_xdf, "rb") as xdf_file:
+        return hashlib.sha1(xdf_file.read(min(offset, size))).hexdigest()
+
+
+def read_incremental_state(state_path, path_to_snirf, path_to_xdf, options):
+    """
+    Read the sidecar of an earlier incremental conversion, if it can be resumed.
+
+    :return: The state dictionary, or None if there is none or it does not match the XDF file, the SNIRF file or the options.
+    """
+    if not os.path.exists(state_path) or not os.path.exists(path_to_snirf):
+        return None
+    try:
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+        if state.get("version") != XdfToSnirfIncremental.STATE_VERSION or state["xdf"] != os.path.abspath(path_to_xdf) \
+           or state["options"] != options or os.path.getsize(path_to_xdf) < state["offset"] \
+           or xdf_head_digest(path_to_xdf, state["offset"]) != state["head_digest"]:
+            return None
+        #The datasets must hold exactly the samples written by the last run.
+        with h5py.File(path_to_snirf, "r") as h5_file:
+            for records in state["writers"].values():
+                for record in records:
+                    if record["path"] not in h5_file or len(h5_file[record["path"]]["time"]) != record["samples"]:
+                        return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return state
+
+
+def append_xdf_samples(xdf_reader: XdfChunkReader, writers, marker_stream_ids, channel_indices, chunk_budget_mb = 64,
+                       start_offset = None, last_stamps = None):
+    """
+    Decode the sample chunks of an XDF file one at a time and append them to the SNIRF datasets of their streams.
+
+    :param xdf_reader: The XdfChunkReader of the XDF file, with its stream headers read.
+    :param writers: Lists of SnirfTimeSeriesWriter indexed by the id of the stream they write.
+    :param marker_stream_ids: Ids of the marker streams, whose chunks are collected in memory.
+    :param channel_indices: Kept channels indexed by stream id, for the NIRS streams subset by an XdfStreamSelection.
+    :param chunk_budget_mb: Memory budget, in MiB, for samples buffered before they are written to disk.
+    :param start_offset: Optional byte offset to resume reading from, see XdfChunkReader.IterSamples.
+    :param last_stamps: Last time stamp decoded per stream before start_offset.
+    :return: A tuple of the concatenated time stamps and values of the markers read, or None if there were none.
+    """
+    marker_stamps, marker_values = [], []
+    chunk_buffer = SnirfChunkBuffer(chunk_budget_mb * 2**20)
+    for stream_id, time_stamps, time_series in xdf_reader.IterSamples(list(writers.keys()) + marker_stream_ids, start_offset, last_stamps):
+        if stream_id in channel_indices:
+            time_series = time_series[:, channel_indices[stream_id]]
+        if stream_id in writers:
+            for writer in writers[stream_id]:
+                chunk_buffer.Add(writer, time_stamps, time_series)
+        else:
+            marker_stamps.append(time_stamps)
+            marker_values.append(time_series.reshape(len(time_stamps), -1)[:, :1])
+    chunk_buffer.Flush()
+    if not marker_stamps:
+        return None
+    return numpy.concatenate(marker_stamps), numpy.concatenate(marker_values)
+
+
+def write_marker_stims(h5_file: h5py.File, nirs_streams, writers, markers, append = False):
+    """
+    Write the markers as the stim groups of every nirs group, relative to the first time stamp of its NIRS stream.
+
+    :param h5_file: The SNIRF file, opened for writing with h5py.
+    :param nirs_streams: A list of (nirs_path, stream_id) tuples, one per nirs group.
+    :param writers: Lists of SnirfTimeSeriesWriter indexed by stream id, holding the time offset of each NIRS stream.
+    :param markers: The marker time stamps and values returned by append_xdf_samples.
+    :param append: Add the events to the existing stim groups, see write_stim_groups.
+    """
+    marker_stamps, marker_values = markers
+    for nirs_path, stream_id in nirs_streams:
+        data_writer = writers[stream_id][0]
+        write_stim_groups(h5_file[nirs_path], group_markers(marker_stamps, marker_values, data_writer.time_offset or 0), append)
+
+
+def nirs_group_path(n, nirs_count):
+    """
+    :param n: Zero-based index of the nirs group.
+    :param nirs_count: Number of nirs groups in the file.
+    :return: The HDF5 path pysnirf2 saves the group to, "/nirs" for a single group and "/nirs1", "/nirs2", ... otherwise.
+    """
+    return "/nirs" if nirs_count == 1 else f"/nirs{n + 1}"
+
+
+def write_measurement_lists(h5_file: h5py.File, xdf_to_snirf_nirs: XdfToSnirfNirs):
+    """
+    Write the measurementLists arrays of every nirs group converted with the arrays layout into the saved file.
+
+    :param h5_file: The saved SNIRF file, opened for writing with h5py.
+    :param xdf_to_snirf_nirs: The converted XdfToSnirfNirs.
+    """
+    nirs_elements = xdf_to_snirf_nirs.nirsElements
+    for n, nirs_element in enumerate(nirs_elements):
+        if nirs_element.measurementLists is not None:
+            nirs_element.measurementLists.Write(h5_file[nirs_group_path(n, len(nirs_elements)) + "/data1"])
+
+
+def detach_time_series(xdf_to_snirf_nirs: XdfToSnirfNirs):
+    """
+    Replace the time series of every data and aux element with empty arrays, so they can be written after saving.
+    The arrays are handed over as they are, without copies: the data time series are those returned by pyxdf.
+
+    :param xdf_to_snirf_nirs: The converted XdfToSnirfNirs.
+    :return: A list of (group_path, time, dataTimeSeries, channel_format) tuples, one per data and aux group.
+    """
+    detached = []
+    nirs_elements = xdf_to_snirf_nirs.nirsElements
+    for n, nirs_element in enumerate(nirs_elements):
+        nirs_path = nirs_group_path(n, len(nirs_elements))
+        #pysnirf2 appends copies of the elements, so detach those held by the Nirs object that is saved.
+        saved_element = xdf_to_snirf_nirs.nirs[n]
+        groups = [(f"{nirs_path}/data1", saved_element.data[0], nirs_element.xdf_nirs_stream)]
+        groups += [(f"{nirs_path}/aux{i + 1}", saved_element.aux[i], aux_stream)
+                   for i, aux_stream in enumerate(nirs_element.xdf_aux_streams)]
+        for group_path, element, xdf_stream in groups:
+            values = numpy.asarray(element.dataTimeSeries)
+            if values.ndim != 2:
+                values = values.reshape(len(values), -1)
+            detached.append((group_path, numpy.asarray(element.time), values, get(xdf_stream, "info.channel_format")))
+            element.time = numpy.zeros((0,))
+            element.dataTimeSeries = numpy.zeros((0, values.shape[1]))
+    return detached
+
+
+def backup_existing_snirf(path_to_snirf):
+    """
+    Backup an existing SNIRF file to <path>.old and remove it, so the conversion starts from an empty file.
+
+    :param path_to_snirf: Path the SNIRF file will be saved to.
+    """
+    if os.path.exists(path_to_snirf):
+        shutil.copy2(path_to_snirf, path_to_snirf + ".old")
+        os.remove(path_to_snirf)
+
+
+def validate_snirf_file(path_to_snirf):
+    """
+    Validate a SNIRF file with pysnirf2 and check that MNE can read it.
+
+    :param path_to_snirf: Path to the SNIRF file to validate.
+    :return: The pysnirf2 ValidationResult.
+    """
+    from mne.io import read_raw_snirf #Imported here, as importing mne takes longer than most conversions.
+
+    print("validating ", path_to_snirf)
+    with instrumentation.Stage("validate"):
+        result = snirf.validateSnirf(path_to_snirf)
+    print(result.display())
+    with instrumentation.Stage("mne_read"):
+        read_raw_snirf(path_to_snirf)
+    return result
 
 
 conf = snirf.SnirfConfig()
@@ -614,11 +1301,73 @@ if __name__ == "__main__":
     parser.add_argument("xdf_file_path", help="Path to the input XDF file.")
     parser.add_argument("save_snirf_path", help="Path to save the output SNIRF file.")
     parser.add_argument("-v", help="validate the created SNIRF file", action="store_true")
+    parser.add_argument("--validate-tier", help="validation with -v: fast (HDF5 structure and shapes only) or full (pysnirf2 and an MNE read)",
+                        choices=TIERS, default="full")
     parser.add_argument("-q", help="The will output minimal text to terminal", action="store_true")
+    parser.add_argument("--stream", help="convert chunk by chunk without loading the whole XDF file into memory", action="store_true")
+    parser.add_argument("--incremental", help="convert an XDF file that is still being recorded: the first run converts it chunk by chunk "
+                        "like --stream and stores its progress in <save_snirf_path>.xdfstate.json, later runs only append the new chunks",
+                        action="store_true")
+    parser.add_argument("--chunk-budget-mb", help="memory budget in MiB for samples buffered in --stream mode", type=float, default=64)
+    parser.add_argument("--cache-dir", help="directory of the probe cache, reused across recordings with the same montage")
+    parser.add_argument("--cache-max-mb", help="size in MiB above which least recently used cache entries are evicted", type=float, default=256)
+    parser.add_argument("--clear-cache", help="remove every entry of the probe cache before converting", action="store_true")
+    parser.add_argument("--aux-rule", help="how aux streams are attached to the nirs groups when there are several NIRS streams: "
+                        "first (all to the first), all (copied into every group) or hostname (to the NIRS stream of the same host)",
+                        choices=AUX_RULES, default="first")
+    parser.add_argument("--align-aux", help="interpolate the aux streams onto the NIRS time stamps (\"nirs\") or onto a common rate in Hz "
+                        "from the NIRS start, leaving gaps as NaN. Not available with --stream")
+    parser.add_argument("--chunk-rows", help="samples per HDF5 chunk of dataTimeSeries", type=int)
+    parser.add_argument("--chunk-channels", help="channels per HDF5 chunk of dataTimeSeries", type=int)
+    parser.add_argument("--compression", help="HDF5 compression filter of dataTimeSeries", choices=["gzip", "lzf"])
+    parser.add_argument("--compression-level", help="gzip compression level, 0 to 9", type=int)
+    parser.add_argument("--shuffle", help="apply the HDF5 byte shuffle filter before compression", action="store_true")
+    parser.add_argument("--float32", help="store dataTimeSeries as float32 when the XDF channel_format is float32", action="store_true")
+    parser.add_argument("--measurement-lists", help="layout of the measurement list: groups (one measurementList{i} group per channel) "
+                        "or arrays (SNIRF 1.1 measurementLists, one array per field, faster for many channels)",
+                        choices=MEASUREMENT_LIST_LAYOUTS, default="groups")
+    parser.add_argument("--list-streams", help="list the streams of the XDF file from their headers, without decoding any sample, and exit",
+                        action="store_true")
+    parser.add_argument("--nirs-streams", help="regular expressions matching the name or type of the NIRS streams to convert, defaults to every NIRS stream",
+                        nargs="+")
+    parser.add_argument("--aux-streams", help="regular expressions matching the name or type of the aux and marker streams to convert, "
+                        "defaults to every stream, none if given without patterns", nargs="*")
+    parser.add_argument("--sources", help="labels of the sources whose NIRS channels are converted", nargs="+")
+    parser.add_argument("--detectors", help="labels of the detectors whose NIRS channels are converted", nargs="+")
+    parser.add_argument("--wavelengths", help="nominal wavelengths of the NIRS channels converted", type=float, nargs="+")
+    parser.add_argument("--no-clock-sync", help="keep each stream's time stamps on its own clock instead of synchronizing them with the clock offsets",
+                        action="store_true")
+    parser.add_argument("--no-clock-resets", help="do not detect clock resets when synchronizing clocks", action="store_true")
+    parser.add_argument("--no-dejitter", help="keep the recorded time stamps instead of fitting a regular rate per segment, faster on long recordings",
+                        action="store_true")
+    parser.add_argument("--jitter-break-seconds", help="gap in seconds that starts a new dejittering segment", type=float, default=1.0)
+    parser.add_argument("--jitter-break-samples", help="gap in samples that starts a new dejittering segment", type=int, default=500)
+    parser.add_argument("--clock-reset-seconds", help="time jump in seconds considered a clock reset", type=float, default=5.0)
+    parser.add_argument("--clock-reset-stds", help="time jump in standard deviations considered a clock reset", type=float, default=5.0)
+    parser.add_argument("--clock-reset-offset-seconds", help="offset jump in seconds considered a clock reset", type=float, default=1.0)
+    parser.add_argument("--clock-reset-offset-stds", help="offset jump in standard deviations considered a clock reset", type=float, default=10.0)
+    parser.add_argument("--winsor-threshold", help="error in seconds above which clock offsets are winsorized", type=float, default=0.0001)
+    parser.add_argument("--timing-report", help="write the effective rate, gaps, jitter and clock drift of each stream to <save_snirf_path>.timing.json. "
+                        "Not available with --stream", action="store_true")
+    parser.add_argument("--instrument", help="record the time, peak RSS and get lookups of each stage to <save_snirf_path>.instrumentation.json",
+                        action="store_true")
+    parser.add_argument("--profile", help="stages to capture with cProfile in --instrument mode, or all", nargs="+", default=[])
+    parser.add_argument("--tracemalloc", help="stages to capture with tracemalloc in --instrument mode, or all", nargs="+", default=[])
 
     args = parser.parse_args()
     path_to_xdf = args.xdf_file_path
     save_location = args.save_snirf_path
+
+    if args.list_streams:
+        for stream_id, header in XdfChunkReader(path_to_xdf).ReadHeaders().items():
+            print(f"{stream_id}: {get(header, 'info.name', report=False)!r} type {get(header, 'info.type', report=False)!r}, "
+                  f"{get(header, 'info.channel_count', report=False)} {get(header, 'info.channel_format', report=False)} channels "
+                  f"at {get(header, 'info.nominal_srate', report=False)} Hz")
+        raise SystemExit(0)
+
+    selection = None
+    if any(option is not None for option in [args.nirs_streams, args.aux_streams, args.sources, args.detectors, args.wavelengths]):
+        selection = XdfStreamSelection(args.nirs_streams, args.aux_streams, args.sources, args.detectors, args.wavelengths)
  
     validate = True if args.v else False
     quiet = True if args.q else False
@@ -626,13 +1375,73 @@ if __name__ == "__main__":
 
     if quiet:
         # If the quiet mode is enabled (i.e. the user passed the `-q` flag),
-        # modify the `get` function to always use `report=False`. Hence reducing logging
+        # modify the `get` function to always use `report=False`, so misses are not counted or reported.
         get = partial(get, report=False)
 
-    #Backup the existing SNIRF file if it exists, then remove it.
-    if os.path.exists(save_location):
-        shutil.copy2(save_location, save_location + ".old")
-        os.remove(save_location)
-  
-    # Convert the XDF file to SNIRF and validate if requested.
-    converted_snirf = XdfToSnirf(save_location, path_to_xdf, validate)
+    storage = None
+    if args.chunk_rows or args.chunk_channels or args.compression or args.shuffle or args.float32:
+        storage = SnirfStorage(args.chunk_rows, args.chunk_channels, args.compression, args.compression_level, args.shuffle, args.float32)
+
+    if args.align_aux is not None and (args.stream or args.incremental):
+        parser.error("--align-aux is not available with --stream or --incremental")
+
+    timing = XdfTimingOptions(not args.no_clock_sync, not args.no_clock_resets, not args.no_dejitter,
+                              args.jitter_break_seconds, args.jitter_break_samples, args.clock_reset_seconds, args.clock_reset_stds,
+                              args.clock_reset_offset_seconds, args.clock_reset_offset_stds, args.winsor_threshold)
+    if (args.stream or args.incremental) and (args.timing_report or vars(timing) != vars(XdfTimingOptions())):
+        parser.error("the timing options are not available with --stream or --incremental, which keep the recorded time stamps")
+
+    probe_cache = None
+    if args.cache_dir:
+        probe_cache = ProbeCache(args.cache_dir, int(args.cache_max_mb * 2**20))
+        if args.clear_cache:
+            probe_cache.Invalidate()
+
+    if args.instrument:
+        instrumentation.Enable(args.profile, args.tracemalloc)
+
+    # Convert the XDF file to SNIRF.
+    if args.incremental:
+        #The SNIRF file is extended in place, or backed up and converted again if it cannot be resumed.
+        converted_snirf = XdfToSnirfIncremental(save_location, path_to_xdf, args.chunk_budget_mb, probe_cache, args.aux_rule, storage,
+                                                args.measurement_lists, selection)
+        if not converted_snirf.converted:
+            parser.exit(message=f"no NIRS stream header in {path_to_xdf} yet, nothing was written\n")
+        if not quiet:
+            print(f"{'resumed from byte ' + str(converted_snirf.start_offset) if converted_snirf.resumed else 'converted from the start'}, "
+                  f"{sum(converted_snirf.appended.values())} samples appended, next run starts at byte {converted_snirf.offset}")
+    elif args.stream:
+        backup_existing_snirf(save_location) #Backup the existing SNIRF file if it exists, then remove it.
+        converted_snirf = XdfToSnirfStreaming(save_location, path_to_xdf, False, args.chunk_budget_mb, probe_cache, args.aux_rule, storage,
+                                              args.measurement_lists, selection)
+    else:
+        backup_existing_snirf(save_location) #Backup the existing SNIRF file if it exists, then remove it.
+        converted_snirf = XdfToSnirf(save_location, path_to_xdf, False, probe_cache, args.aux_rule, args.align_aux, storage,
+                                     args.measurement_lists, selection, timing)
+
+    #Write the timing diagnostics of each stream next to the SNIRF file.
+    if args.timing_report:
+        with open(save_location + ".timing.json", "w") as timing_file:
+            json.dump(converted_snirf.timing, timing_file, indent=2)
+        if not quiet:
+            for name, stream_timing in converted_snirf.timing["streams"].items():
+                print(f"{name}: {stream_timing['samples']} samples, effective rate {stream_timing['effective_srate']} Hz "
+                      f"(nominal {stream_timing['nominal_srate']}), {stream_timing['segments']} segments, "
+                      f"clock drift {stream_timing['drift_ppm']} ppm")
+
+    #Validate the SNIRF file if requested.
+    if validate:
+        with instrumentation.Stage("validate"):
+            validation_result = validate_file(save_location, args.validate_tier)
+        print(f"{args.validate_tier} validation of {save_location}: {'valid' if validation_result['valid'] else 'invalid'} "
+              f"({validation_result['seconds']:.2f}s)")
+        for error in validation_result["errors"]:
+            print("   ", error)
+
+    #Report the metadata that was not found in the XDF file.
+    if not quiet:
+        print(lookup_diagnostics.Report())
+
+    #Write the stage timings next to the SNIRF file.
+    if args.instrument:
+        instrumentation.WriteJson(save_location + ".instrumentation.json")
@@ -0,0 +1,84 @@
+import numpy
+import h5py
+
+
+def common_time_base(nirs_time_stamps, rate):
+    """
+    :param nirs_time_stamps: Time stamps of the NIRS stream.
+    :param rate: Sample rate of the time base in Hz.
+    :return: Time stamps at the given rate, spanning the NIRS stream from its first sample.
+    """
+    if len(nirs_time_stamps) == 0:
+        return numpy.zeros((0,))
+    sample_count = int(numpy.floor((nirs_time_stamps[-1] - nirs_time_stamps[0]) * rate)) + 1
+    return nirs_time_stamps[0] + numpy.arange(sample_count) / rate
+
+
+def align_time_series(time_stamps, time_series, target_time_stamps, max_gap = None):
+    """
+    Linearly interpolate a time series onto other time stamps, all channels at once.
+    Target time stamps outside the recorded range, or inside a gap of the recording, are set to NaN.
+
+    :param time_stamps: The increasing time stamps of the time series.
+    :param time_series: A [#Samples x #Channels] (or [#Samples]) array of values.
+    :param target_time_stamps: The increasing time stamps to interpolate onto.
+    :param max_gap: Longest interval between two samples, in seconds, interpolated across.
+    Defaults to twice the median sample interval.
+    :return: A [#Targets x #Channels] (or [#Targets]) float array.
+    """
+    time_stamps = numpy.asarray(time_stamps, dtype=numpy.float64)
+    target_time_stamps = numpy.asarray(target_time_stamps, dtype=numpy.float64)
+    time_series = numpy.asarray(time_series, dtype=numpy.float64)
+    values = time_series.reshape(len(time_series), -1)
+    aligned = numpy.full((len(target_time_stamps), values.shape[1]), numpy.nan)
+    if len(time_stamps) < 2:
+        return aligned.reshape((len(target_time_stamps),) + time_series.shape[1:])
+
+    intervals = numpy.diff(time_stamps)
+    if max_gap is None:
+        max_gap = 2 * numpy.median(intervals)
+
+    #Index of the last sample at or before each target, so a target on repeated time stamps takes the last of them,
+    #and the interpolation weight of the sample after it. Zero intervals are masked out rather than divided by.
+    after = numpy.clip(numpy.searchsorted(time_stamps, target_time_stamps, side="right"), 1, len(time_stamps) - 1)
+    before = after - 1
+    in_range = (target_time_stamps >= time_stamps[0]) & (target_time_stamps <= time_stamps[-1]) & (intervals[before] > 0)
+    weights = numpy.zeros(len(target_time_stamps))
+    weights[in_range] = (target_time_stamps[in_range] - time_stamps[before[in_range]]) / intervals[before[in_range]]
+    #A target on a recorded sample is kept even when the next sample is beyond a gap.
+    valid = in_range & ((intervals[before] <= max_gap) | (weights == 0))
+
+    weights = weights[valid, numpy.newaxis]
+    aligned[valid] = values[before[valid]] * (1 - weights) + values[after[valid]] * weights
+    return aligned.reshape((len(target_time_stamps),) + time_series.shape[1:])
+
+
+def link_shared_time(path_to_snirf):
+    """
+    Replace every aux "time" dataset equal to the data "time" dataset, or to an earlier aux "time" dataset,
+    with an HDF5 hard link to it, so a time base shared by the aligned aux streams is stored once.
+
+    :param path_to_snirf: Path of the SNIRF file.
+    :return: The number of datasets replaced by links.
+    """
+    linked = 0
+    with h5py.File(path_to_snirf, "r+") as h5_file:
+        for nirs_name in h5_file:
+            nirs_group = h5_file[nirs_name]
+            if not isinstance(nirs_group, h5py.Group) or not nirs_name.startswith("nirs"):
+                continue
+            time_bases = [nirs_group[name]["time"] for name in nirs_group if name.startswith("data") and "time" in nirs_group[name]]
+            for name in sorted((name for name in nirs_group if name.startswith("aux")), key=lambda name: int(name[3:] or 0)):
+                time = nirs_group[name].get("time")
+                if time is None:
+                    continue
+                values = time[()]
+                for time_base in time_bases:
+                    if time_base.shape == time.shape and numpy.array_equal(time_base[()], values):
+                        del nirs_group[name]["time"]
+                        nirs_group[name]["time"] = time_base
+                        linked += 1
+                        break
+                else:
+                    time_bases.append(time)
+    return linked
@@ -0,0 +1,302 @@
+"""
+Batch conversion of XDF files to SNIRF.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from validation import TIERS, ValidationPipeline
+
+xdf_to_snirf = None #The converter module, imported once per worker process.
+
+
+def find_xdf_files(inputs):
+    """
+    Expand directories, glob patterns and file paths into the list of XDF files to convert.
+
+    :param inputs: Directories (searched recursively), glob patterns or paths of XDF files.
+    :return: A sorted list of (xdf_path, relative_path) tuples, where relative_path is the path of the
+    file relative to the directory it was found in, used to mirror the directory layout in the output.
+    """
+    xdf_files = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            for xdf_path in glob.glob(os.path.join(path, "**", "*.xdf"), recursive=True):
+                xdf_files.setdefault(os.path.abspath(xdf_path), os.path.relpath(xdf_path, path))
+        else:
+            for xdf_path in glob.glob(path, recursive=True) if glob.has_magic(path) else [path]:
+                xdf_files.setdefault(os.path.abspath(xdf_path), os.path.basename(xdf_path))
+    return sorted(xdf_files.items())
+
+
+def snirf_path_for(xdf_path, relative_path, output_dir = None):
+    """
+    :param xdf_path: Path of the XDF file.
+    :param relative_path: Path of the XDF file relative to the input directory it was found in.
+    :param output_dir: Directory to write SNIRF files to. SNIRF files are written next to the XDF files if None.
+    :return: The path of the SNIRF file for the XDF file.
+    """
+    if output_dir is None:
+        return os.path.splitext(xdf_path)[0] + ".snirf"
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + ".snirf")
+
+
+def is_up_to_date(xdf_path, snirf_path):
+    """
+    :return: True if the SNIRF file exists and is newer than the XDF file.
+    """
+    return os.path.exists(snirf_path) and os.path.getmtime(snirf_path) >= os.path.getmtime(xdf_path)
+
+
+def init_worker():
+    """
+    Import the converter once in each worker process.
+    """
+    global xdf_to_snirf
+    import XDF_TO_SNIRF
+    xdf_to_snirf = XDF_TO_SNIRF
+
+
+def convert_file(xdf_path, snirf_path, validate = False, stream = False, chunk_budget_mb = 64, cache_dir = None, cache_max_bytes = 256 * 2**20,
+                 aux_rule = "first", align_aux = None, storage = None, instrument = False, measurement_list_layout = "groups",
+                 selection = None, timing = None, timing_report = False):
+    """
+    Convert one XDF file in a worker process.
+    With instrument, the stage timings are written to <snirf_path>.instrumentation.json.
+    The probe cache directory is shared by every worker, so a montage converted by one worker is reused by the others.
+    An optional xdf_reader.XdfStreamSelection restricts the conversion to the selected streams and NIRS channels.
+    An optional xdf_timing.XdfTimingOptions sets pyxdf's clock synchronization and dejittering. With timing_report,
+    the timing diagnostics of the streams are written to <snirf_path>.timing.json.
+
+    :return: A dictionary describing the outcome, with "xdf", "snirf", "status" ("converted" or "failed"),
+    "seconds", "lookups_missed" and, for failures, "error" keys.
+    """
+    if xdf_to_snirf is None:
+        init_worker()
+    result = {"xdf": xdf_path, "snirf": snirf_path}
+    start = time.perf_counter()
+    xdf_to_snirf.lookup_diagnostics.Reset()
+    if instrument:
+        xdf_to_snirf.instrumentation.Enable()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(snirf_path)), exist_ok=True)
+        xdf_to_snirf.backup_existing_snirf(snirf_path)
+        probe_cache = xdf_to_snirf.ProbeCache(cache_dir, cache_max_bytes) if cache_dir else None
+        if stream:
+            xdf_to_snirf.XdfToSnirfStreaming(snirf_path, xdf_path, validate, chunk_budget_mb, probe_cache, aux_rule, storage, measurement_list_layout, selection)
+        else:
+            converted = xdf_to_snirf.XdfToSnirf(snirf_path, xdf_path, validate, probe_cache, aux_rule, align_aux, storage, measurement_list_layout,
+                                                selection, timing)
+            if timing_report:
+                with open(snirf_path + ".timing.json", "w") as timing_file:
+                    json.dump(converted.timing, timing_file, indent=2)
+        result["status"] = "converted"
+        if instrument:
+            xdf_to_snirf.instrumentation.WriteJson(snirf_path + ".instrumentation.json")
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+        #Remove the partially written SNIRF file, so it is not mistaken for an up to date one.
+        if os.path.exists(snirf_path):
+            os.remove(snirf_path)
+    result["seconds"] = time.perf_counter() - start
+    result["lookups_missed"] = xdf_to_snirf.lookup_diagnostics.Counts()[1]
+    return result
+
+
+class BatchConversion():
+    """
+    Converts a list of XDF files to SNIRF over a pool of worker processes and collects the outcome of each file.
+    """
+    def __init__(self, xdf_files, output_dir = None, workers = None, skip_existing = False, validate = False,
+                 stream = False, chunk_budget_mb = 64, quiet = False, cache_dir = None, cache_max_bytes = 256 * 2**20,
+                 aux_rule = "first", align_aux = None, storage = None, instrument = False, validate_tier = "full", validate_workers = 1,
+                 measurement_list_layout = "groups", selection = None, timing = None, timing_report = False):
+        """
+        Initialize the class and run the conversions.
+        Validation runs in its own pool of worker processes: each SNIRF file is validated as soon as it is converted,
+        while the conversion workers carry on with the next files.
+
+        :param xdf_files: A list of (xdf_path, relative_path) tuples as returned by find_xdf_files.
+        :param output_dir: Directory to write SNIRF files to. SNIRF files are written next to the XDF files if None.
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param skip_existing: Skip XDF files whose SNIRF file is already newer than them.
+        :param validate: Validate each SNIRF file once written.
+        :param stream: Convert chunk by chunk without loading whole XDF files into memory.
+        :param chunk_budget_mb: Memory budget in MiB for samples buffered in stream mode.
+        :param quiet: Do not print the outcome of each file as it completes.
+        :param cache_dir: Directory of the probe cache shared by the workers. No cache is used if None.
+        :param cache_max_bytes: Size above which least recently used cache entries are evicted.
+        :param aux_rule: Rule attaching aux streams to the nirs groups of recordings with several NIRS streams.
+        :param align_aux: Optional time base of the aux streams, "nirs" or a rate in Hz. Ignored in stream mode.
+        :param storage: Optional snirf_writer.SnirfStorage with the HDF5 options of the dataTimeSeries datasets.
+        :param instrument: Write the stage timings of each conversion next to its SNIRF file.
+        :param validate_tier: "fast" (HDF5 structure and shapes only) or "full" (pysnirf2 and an MNE read).
+        :param validate_workers: Number of validation worker processes.
+        :param measurement_list_layout: "groups" or "arrays", the layout of the measurement lists (see XDF_TO_SNIRF.MEASUREMENT_LIST_LAYOUTS).
+        :param selection: Optional xdf_reader.XdfStreamSelection of the streams and NIRS channels to convert in every file.
+        :param timing: Optional xdf_timing.XdfTimingOptions of pyxdf's clock synchronization and dejittering. Ignored in stream mode.
+        :param timing_report: Write the timing diagnostics of each file next to its SNIRF file. Ignored in stream mode.
+        """
+        self.results = [] #Outcome of every file, in the order they completed.
+        self.validation = None #Aggregated validation report, see validation.ValidationPipeline.Report.
+        pipeline = ValidationPipeline(validate_tier, validate_workers) if validate else None
+        start = time.perf_counter()
+
+        jobs = []
+        for xdf_path, relative_path in xdf_files:
+            snirf_path = snirf_path_for(xdf_path, relative_path, output_dir)
+            if skip_existing and is_up_to_date(xdf_path, snirf_path):
+                self.AddResult({"xdf": xdf_path, "snirf": snirf_path, "status": "skipped", "seconds": 0.0}, quiet)
+            else:
+                jobs.append((xdf_path, snirf_path))
+
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                futures = {executor.submit(convert_file, xdf_path, snirf_path, False, stream, chunk_budget_mb,
+                                           cache_dir, cache_max_bytes, aux_rule, align_aux, storage, instrument, measurement_list_layout, selection,
+                                           timing, timing_report): (xdf_path, snirf_path)
+                           for xdf_path, snirf_path in jobs}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception:
+                        #A worker died (e.g. a crash in HDF5 or out of memory), which fails its file and every file
+                        #still queued with BrokenProcessPool. The batch carries on to its summary.
+                        xdf_path, snirf_path = futures[future]
+                        result = {"xdf": xdf_path, "snirf": snirf_path, "status": "failed", "seconds": 0.0, "lookups_missed": 0,
+                                  "error": traceback.format_exc()}
+                    self.AddResult(result, quiet)
+                    if pipeline is not None and result["status"] == "converted":
+                        pipeline.Submit(result["snirf"])
+
+        if pipeline is not None:
+            self.validation = pipeline.Report()
+            if not quiet:
+                for result in self.validation["results"]:
+                    print(f"{'valid' if result['valid'] else 'invalid':>9}  {result['seconds']:8.2f}s  {result['snirf']}")
+                    for error in result["errors"]:
+                        print("          ", error)
+
+        self.wall_seconds = time.perf_counter() - start #Wall time of the whole batch.
+
+    def AddResult(self, result, quiet):
+        """
+        Store the outcome of a file and print it unless quiet.
+        """
+        self.results.append(result)
+        if not quiet:
+            print(f"{result['status']:>9}  {result['seconds']:8.2f}s  {result['xdf']} -> {result['snirf']}")
+            if result["status"] == "failed":
+                print(result["error"])
+
+    def Summary(self):
+        """
+        :return: A dictionary with the number of files per status, the total conversion time summed over
+        the workers, the wall time of the batch, the outcome of every file and, if validating, the validation report.
+        """
+        counts = {status: 0 for status in ["converted", "skipped", "failed"]}
+        for result in self.results:
+            counts[result["status"]] += 1
+        return {"files": len(self.results), **counts,
+                "conversion_seconds": sum(result["seconds"] for result in self.results),
+                "wall_seconds": self.wall_seconds,
+                "results": self.results,
+                "validation": self.validation}
+
+
+if __name__ == "__main__":
+    """
+    Command-line interface for batch XDF to SNIRF conversion.
+    """
+    from XDF_TO_SNIRF import AUX_RULES, MEASUREMENT_LIST_LAYOUTS
+    parser = argparse.ArgumentParser("XDF to SNIRF Batch Converter",
+    """This program converts every XDF file found in the given directories, glob patterns
+                    or paths into SNIRF files, using a pool of worker processes.""")
+    parser.add_argument("inputs", nargs="+", help="Directories (searched recursively), glob patterns or paths of XDF files.")
+    parser.add_argument("-o", "--output-dir", help="Directory to write SNIRF files to, mirroring the input layout. Defaults to next to each XDF file.")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--skip-existing", help="skip XDF files whose SNIRF file is already newer", action="store_true")
+    parser.add_argument("--report", help="Path to write the JSON summary of the batch to.")
+    parser.add_argument("-v", help="validate the created SNIRF files", action="store_true")
+    parser.add_argument("--validate-tier", help="validation with -v: fast (HDF5 structure and shapes only) or full (pysnirf2 and an MNE read)",
+                        choices=TIERS, default="full")
+    parser.add_argument("--validate-workers", help="number of processes validating with -v, alongside the conversion workers", type=int, default=1)
+    parser.add_argument("-q", help="The will output minimal text to terminal", action="store_true")
+    parser.add_argument("--stream", help="convert chunk by chunk without loading whole XDF files into memory", action="store_true")
+    parser.add_argument("--chunk-budget-mb", help="memory budget in MiB for samples buffered in --stream mode", type=float, default=64)
+    parser.add_argument("--cache-dir", help="directory of the probe cache, reused across recordings with the same montage")
+    parser.add_argument("--cache-max-mb", help="size in MiB above which least recently used cache entries are evicted", type=float, default=256)
+    parser.add_argument("--clear-cache", help="remove every entry of the probe cache before converting", action="store_true")
+    parser.add_argument("--aux-rule", help="how aux streams are attached to the nirs groups when there are several NIRS streams",
+                        choices=AUX_RULES, default="first")
+    parser.add_argument("--align-aux", help="interpolate the aux streams onto the NIRS time stamps (\"nirs\") or a common rate in Hz")
+    parser.add_argument("--chunk-rows", help="samples per HDF5 chunk of dataTimeSeries", type=int)
+    parser.add_argument("--chunk-channels", help="channels per HDF5 chunk of dataTimeSeries", type=int)
+    parser.add_argument("--compression", help="HDF5 compression filter of dataTimeSeries", choices=["gzip", "lzf"])
+    parser.add_argument("--compression-level", help="gzip compression level, 0 to 9", type=int)
+    parser.add_argument("--shuffle", help="apply the HDF5 byte shuffle filter before compression", action="store_true")
+    parser.add_argument("--float32", help="store dataTimeSeries as float32 when the XDF channel_format is float32", action="store_true")
+    parser.add_argument("--measurement-lists", help="layout of the measurement lists: groups (one group per channel) or arrays (one array per field)",
+                        choices=MEASUREMENT_LIST_LAYOUTS, default="groups")
+    parser.add_argument("--nirs-streams", help="regular expressions matching the name or type of the NIRS streams to convert", nargs="+")
+    parser.add_argument("--aux-streams", help="regular expressions matching the name or type of the aux and marker streams to convert, "
+                        "none if given without patterns", nargs="*")
+    parser.add_argument("--sources", help="labels of the sources whose NIRS channels are converted", nargs="+")
+    parser.add_argument("--detectors", help="labels of the detectors whose NIRS channels are converted", nargs="+")
+    parser.add_argument("--wavelengths", help="nominal wavelengths of the NIRS channels converted", type=float, nargs="+")
+    parser.add_argument("--no-clock-sync", help="keep each stream's time stamps on its own clock", action="store_true")
+    parser.add_argument("--no-clock-resets", help="do not detect clock resets when synchronizing clocks", action="store_true")
+    parser.add_argument("--no-dejitter", help="keep the recorded time stamps instead of fitting a regular rate per segment", action="store_true")
+    parser.add_argument("--jitter-break-seconds", help="gap in seconds that starts a new dejittering segment", type=float, default=1.0)
+    parser.add_argument("--jitter-break-samples", help="gap in samples that starts a new dejittering segment", type=int, default=500)
+    parser.add_argument("--clock-reset-seconds", help="time jump in seconds considered a clock reset", type=float, default=5.0)
+    parser.add_argument("--clock-reset-stds", help="time jump in standard deviations considered a clock reset", type=float, default=5.0)
+    parser.add_argument("--clock-reset-offset-seconds", help="offset jump in seconds considered a clock reset", type=float, default=1.0)
+    parser.add_argument("--clock-reset-offset-stds", help="offset jump in standard deviations considered a clock reset", type=float, default=10.0)
+    parser.add_argument("--winsor-threshold", help="error in seconds above which clock offsets are winsorized", type=float, default=0.0001)
+    parser.add_argument("--timing-report", help="write the timing diagnostics of the streams of each file to <snirf>.timing.json", action="store_true")
+    parser.add_argument("--instrument", help="write the stage timings of each conversion to <snirf>.instrumentation.json", action="store_true")
+    args = parser.parse_args()
+    if args.align_aux is not None and args.stream:
+        parser.error("--align-aux is not available with --stream")
+
+    if args.cache_dir and args.clear_cache:
+        from probe_cache import ProbeCache
+        ProbeCache(args.cache_dir).Invalidate()
+
+    storage = None
+    if args.chunk_rows or args.chunk_channels or args.compression or args.shuffle or args.float32:
+        from snirf_writer import SnirfStorage
+        storage = SnirfStorage(args.chunk_rows, args.chunk_channels, args.compression, args.compression_level, args.shuffle, args.float32)
+
+    selection = None
+    if any(option is not None for option in [args.nirs_streams, args.aux_streams, args.sources, args.detectors, args.wavelengths]):
+        from xdf_reader import XdfStreamSelection
+        selection = XdfStreamSelection(args.nirs_streams, args.aux_streams, args.sources, args.detectors, args.wavelengths)
+
+    from xdf_timing import XdfTimingOptions
+    timing = XdfTimingOptions(not args.no_clock_sync, not args.no_clock_resets, not args.no_dejitter,
+                              args.jitter_break_seconds, args.jitter_break_samples, args.clock_reset_seconds, args.clock_reset_stds,
+                              args.clock_reset_offset_seconds, args.clock_reset_offset_stds, args.winsor_threshold)
+    if args.stream and (args.timing_report or vars(timing) != vars(XdfTimingOptions())):
+        parser.error("the timing options are not available with --stream, which keeps the recorded time stamps")
+
+    batch = BatchConversion(find_xdf_files(args.inputs), args.output_dir, args.workers, args.skip_existing,
+                            args.v, args.stream, args.chunk_budget_mb, args.q, args.cache_dir, int(args.cache_max_mb * 2**20),
+                            args.aux_rule, args.align_aux, storage, args.instrument, args.validate_tier, args.validate_workers,
+                            args.measurement_lists, selection, timing, args.timing_report)
+    summary = batch.Summary()
+    print(f"{summary['files']} files: {summary['converted']} converted, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {summary['wall_seconds']:.2f}s "
+          f"({summary['conversion_seconds']:.2f}s of conversion)")
+    if summary["validation"] is not None:
+        print(f"{summary['validation']['files']} files validated ({summary['validation']['tier']}): {summary['validation']['valid']} valid, "
+              f"{summary['validation']['invalid']} invalid ({summary['validation']['seconds']:.2f}s of validation)")
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(summary, report_file, indent=2)
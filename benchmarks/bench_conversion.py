@@ -0,0 +1,199 @@
+"""
+Benchmark suite of the XDF to SNIRF conversion on synthetic recordings.
+
+Generates XDF files with test_utils.Generate_Generic_XDF_Data over a grid of montage sizes
+(sources x detectors x wavelengths), data type variants (CW, TD, DCS, FD), durations and measurement list layouts
+(groups or arrays), then times each stage of the conversion separately: load, probe build, measurement list,
+data copy, save, reload of the measurement list and validate.
+Every case runs in a fresh worker process, so the peak RSS recorded after each stage belongs to that case only.
+Results are printed as a table and optionally written as JSON to track regressions.
+
+usage: python benchmarks/bench_conversion.py --sources 4 16 --detectors 4 16 --variants CW TD --durations 60 600 --layouts groups arrays -o results.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "features", "steps"))
+
+STAGES = ["load", "probe", "measurement_list", "data_copy", "save", "reload", "validate"]
+
+
+def peak_rss_mb():
+    """
+    :return: The peak resident set size of this process in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class StageTimer():
+    """
+    Times named stages and records the peak RSS, and optionally the peak traced allocations, after each one.
+    """
+    def __init__(self, trace_allocations = False):
+        self.trace_allocations = trace_allocations
+        self.seconds = {}
+        self.peak_rss_mb = {}
+        self.peak_traced_mb = {}
+
+    @contextlib.contextmanager
+    def Stage(self, name):
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+        self.peak_rss_mb[name] = peak_rss_mb()
+        if self.trace_allocations:
+            self.peak_traced_mb[name] = tracemalloc.get_traced_memory()[1] / 2**20
+
+
+def run_case(case):
+    """
+    Generate, convert and validate one synthetic recording. Runs in a worker process.
+
+    :param case: Dictionary with the "sources", "detectors", "wavelengths", "variant", "duration", "rate", "layout",
+    "validate" and "trace_allocations" of the case.
+    :return: The case dictionary extended with "channels", "samples", "seconds", "peak_rss_mb", "file_mb" and,
+    if enabled, "peak_traced_mb" and "validate_error".
+    """
+    import h5py
+    import pyxdf
+    import snirf
+    import test_utils
+    import XDF_TO_SNIRF
+    import validation
+    from utils import get
+
+    samples = int(case["duration"] * case["rate"])
+    stream = test_utils.Generate_Generic_XDF_Data(case["sources"], case["detectors"], case["wavelengths"], samples,
+                                                  case["variant"], case["rate"])
+    result = dict(case, channels=stream["time_series"].shape[1], samples=samples)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path_to_xdf = os.path.join(directory, "bench.xdf")
+        path_to_snirf = os.path.join(directory, "bench.snirf")
+        test_utils.Write_XDF_File(path_to_xdf, [stream], chunk_samples=max(1, int(case["rate"])))
+        del stream
+
+        if case["trace_allocations"]:
+            tracemalloc.start()
+        timer = StageTimer(case["trace_allocations"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            with timer.Stage("load"):
+                xdf_streams, _ = pyxdf.load_xdf(path_to_xdf)
+                xdf_nirs_stream = xdf_streams[0]
+
+            with timer.Stage("probe"):
+                xdf_to_snirf_probe = XDF_TO_SNIRF.XdfToSnirfProbe(get(xdf_nirs_stream, "info.desc.channels.channel"),
+                                                                  get(xdf_nirs_stream, "info.desc.optodes.optode"),
+                                                                  get(xdf_nirs_stream, "info.desc.fiducials.fiducial"))
+
+            snirf_file = snirf.Snirf(path_to_snirf)
+            snirf_file.formatVersion = 1.1
+            with timer.Stage("measurement_list"):
+                if case["layout"] == "arrays":
+                    measurement_lists = XDF_TO_SNIRF.XdfToSnirfMeasurementLists(xdf_nirs_stream, xdf_to_snirf_probe.probe,
+                                                                                xdf_to_snirf_probe.probeIndex,
+                                                                                xdf_to_snirf_probe.channelRecords)
+                    measurement_list = snirf.MeasurementList(snirf_file, XDF_TO_SNIRF.conf)
+                else:
+                    measurement_list = XDF_TO_SNIRF.XdfToSnirfMeasurmentList(xdf_nirs_stream, snirf_file, xdf_to_snirf_probe.probe,
+                                                                             xdf_to_snirf_probe.probeIndex,
+                                                                             xdf_to_snirf_probe.channelRecords).measurementList
+
+            with timer.Stage("data_copy"):
+                nirs_element = snirf.NirsElement("", XDF_TO_SNIRF.conf)
+                nirs_element.metaDataTags.FrequencyUnit = "Hz"
+                nirs_element.metaDataTags.TimeUnit = "s"
+                nirs_element.metaDataTags.LengthUnit = "mm"
+                nirs_element.metaDataTags.SubjectID = get(xdf_nirs_stream, "info.name")
+                nirs_element.probe = xdf_to_snirf_probe.probe
+                nirs_element.data = XDF_TO_SNIRF.XdfToSnirfData(xdf_to_snirf_probe.probe, xdf_nirs_stream, snirf_file,
+                                                                measurement_list=measurement_list).data
+                snirf_file.nirs.append(nirs_element)
+
+            with timer.Stage("save"):
+                snirf_file.save()
+                snirf_file.close()
+                if case["layout"] == "arrays":
+                    with h5py.File(path_to_snirf, "r+") as h5_file:
+                        measurement_lists.Write(h5_file["/nirs/data1"])
+
+            with timer.Stage("reload"):
+                with h5py.File(path_to_snirf, "r") as h5_file:
+                    validation.measurement_list_columns(h5_file["/nirs/data1"])
+
+            if case["validate"]:
+                with timer.Stage("validate"):
+                    try:
+                        XDF_TO_SNIRF.validate_snirf_file(path_to_snirf)
+                    except Exception as e:
+                        result["validate_error"] = f"{type(e).__name__}: {e}"
+
+        result["file_mb"] = os.path.getsize(path_to_snirf) / 2**20
+    result["seconds"] = timer.seconds
+    result["peak_rss_mb"] = timer.peak_rss_mb
+    if case["trace_allocations"]:
+        result["peak_traced_mb"] = timer.peak_traced_mb
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("XDF to SNIRF conversion benchmark suite")
+    parser.add_argument("--sources", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--detectors", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--wavelengths", type=float, nargs="+", default=[735, 850])
+    parser.add_argument("--variants", nargs="+", choices=["CW", "TD", "DCS", "FD"], default=["CW"])
+    parser.add_argument("--durations", type=float, nargs="+", default=[60, 600], help="Durations of the recordings in seconds.")
+    parser.add_argument("--layouts", nargs="+", choices=["groups", "arrays"], default=["groups"], help="Measurement list layouts.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Sample rate of the recordings in Hz.")
+    parser.add_argument("--no-validate", help="skip the validate stage", action="store_true")
+    parser.add_argument("--tracemalloc", help="also record the peak traced Python allocations of each stage (slower)", action="store_true")
+    parser.add_argument("-o", "--output", help="Path to write the JSON results to.")
+    args = parser.parse_args()
+
+    cases = [{"sources": sources, "detectors": detectors, "wavelengths": args.wavelengths, "variant": variant,
+              "duration": duration, "rate": args.rate, "layout": layout, "validate": not args.no_validate, "trace_allocations": args.tracemalloc}
+             for sources, detectors, variant, duration, layout
+             in itertools.product(args.sources, args.detectors, args.variants, args.durations, args.layouts)]
+
+    stages = [stage for stage in STAGES if stage != "validate" or not args.no_validate]
+    print(f"{'case':<36}{'channels':>9}{'samples':>9}" + "".join(f"{stage:>17}" for stage in stages) + f"{'peak MiB':>10}")
+    results = []
+    #A fresh process per case, so the peak RSS of one case does not carry over into the next.
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+            name = f"{result['sources']}x{result['detectors']}x{len(result['wavelengths'])} {result['variant']} {result['duration']:g}s {result['layout']}"
+            print(f"{name:<36}{result['channels']:>9}{result['samples']:>9}"
+                  + "".join(f"{result['seconds'][stage]:17.3f}" for stage in stages)
+                  + f"{max(result['peak_rss_mb'].values()):10.1f}")
+            if "validate_error" in result:
+                print(f"  validate failed: {result['validate_error']}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                       "stages": stages, "results": results}, output_file, indent=2)
@@ -0,0 +1,113 @@
+"""
+Microbenchmark of utils.get against the pydash based implementation it replaced.
+
+Runs both implementations over the metadata lookups made while converting a synthetic probe,
+checks that they return the same values and prints the time per lookup.
+
+usage: python benchmarks/bench_get.py [--sources 16] [--detectors 16] [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import timeit
+import pydash
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "features", "steps"))
+import utils
+import test_utils
+
+
+def pydash_get(dict_to_search: dict, path: str):
+    """
+    The pydash based utils.get, kept here as the benchmark baseline.
+    """
+    try:
+        value = pydash.get(dict_to_search, path)
+        if value is None:
+            raise
+        if isinstance(value, dict) or isinstance(value, numpy.ndarray):
+            return value
+        if isinstance(value, list):
+            if len(value) == 1:
+                value = value[0]
+            else:
+                return value
+        if isinstance(value, str) and value.lstrip('-+').replace('.','', 1).isnumeric():
+            value = float(value)
+            if value.is_integer():
+                value = int(value) 
+        return value              
+    except:
+        try:
+            location, remaining_path  = path.split(".", 1)
+            if not remaining_path:
+                return None
+            value = pydash_get(dict_to_search, location)
+            if value:
+                return pydash_get(value, remaining_path)
+        except:
+            pass
+        print(f"{path} not founds")
+
+
+CHANNEL_PATHS = ["source", "detector", "wavelen", "wavelen_measured", "fluorescence.wavelen", "fluorescence.wavelen_measured",
+                 "measure", "unit", "type", "power", "gain", "td.delay", "td.width", "dcs.delay", "dcs.width", "fd.frequency"]
+OPTODE_PATHS = ["function", "label", "location.X", "location.Y", "location.Z"]
+STREAM_PATHS = ["info.name", "info.type", "info.channel_count", "info.desc.channels.channel", "info.desc.optodes.optode",
+                "info.desc.fiducials.fiducial"]
+
+
+def lookups(num_sources, num_detectors):
+    """
+    Build the (dictionary, path) pairs looked up while converting a synthetic probe.
+    """
+    channels = []
+    optodes = []
+    for i in range(num_sources):
+        optodes.append(test_utils.mimic_xdf_meta_data_optode(f"S/{i}", "M", "Source"))
+        for j in range(num_detectors):
+            for wavelen in ["735", "850"]:
+                channels.append(test_utils.mimic_xdf_meta_data_channel(f"C/{i}/{j}", "Intensity", "TD_Gated_Amplitude",
+                                                                       f"S/{i}", f"D/{j}", wavelen, td_delay="100", td_width="50"))
+    for j in range(num_detectors):
+        optodes.append(test_utils.mimic_xdf_meta_data_optode(f"D/{j}", "M", "Detector"))
+    stream = {"info": test_utils.mimic_xdf_meta_data(channels=channels, optodes=optodes,
+                                                      fiducials=[test_utils.mimic_xdf_meta_data_fiducial()] * 3)}
+
+    pairs = [(stream, path) for path in STREAM_PATHS]
+    pairs += [(channel, path) for channel in channels for path in CHANNEL_PATHS]
+    pairs += [(optode, path) for optode in optodes for path in OPTODE_PATHS]
+    return pairs
+
+
+def run(get_function, pairs):
+    for dict_to_search, path in pairs:
+        get_function(dict_to_search, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("utils.get microbenchmark")
+    parser.add_argument("--sources", type=int, default=16)
+    parser.add_argument("--detectors", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pairs = lookups(args.sources, args.detectors)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for dict_to_search, path in pairs:
+            expected = pydash_get(dict_to_search, path)
+            actual = utils.get(dict_to_search, path)
+            assert (expected is actual) or (expected == actual), f"{path}: {expected!r} != {actual!r}"
+
+        baseline = min(timeit.repeat(lambda: run(pydash_get, pairs), number=1, repeat=args.repeat))
+    compiled = min(timeit.repeat(lambda: run(utils.get, pairs), number=1, repeat=args.repeat))
+
+    print(f"{len(pairs)} lookups")
+    print(f"pydash get:   {baseline / len(pairs) * 1e6:8.3f} us/lookup")
+    print(f"compiled get: {compiled / len(pairs) * 1e6:8.3f} us/lookup ({baseline / compiled:.1f}x)")
+    utils.lookup_diagnostics.Reset()
@@ -0,0 +1,73 @@
+"""
+Import time benchmark of the converter modules.
+
+Runs each target in a fresh interpreter with `python -X importtime`, then reports the total import time, the
+slowest top-level imports and whether mne or astropy were loaded. Neither should be loaded unless validating,
+or converting units that are not SI prefixed.
+
+usage: python benchmarks/bench_import.py [--repeat 5] [-o import_times.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TARGETS = {
+    "import XDF_TO_SNIRF": ["-c", "import XDF_TO_SNIRF"],
+    "import batch_convert": ["-c", "import batch_convert"],
+    "import stream_snirf": ["-c", "import stream_snirf"],
+    "XDF_TO_SNIRF.py --help": ["XDF_TO_SNIRF.py", "--help"],
+}
+
+HEAVY_MODULES = ["mne", "astropy", "scipy"]
+
+
+def import_times(arguments):
+    """
+    :return: A dictionary of the cumulative import time in seconds of every module imported by the interpreter.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime"] + arguments, cwd=ROOT, capture_output=True, text=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name[1:].rstrip()] = int(cumulative) / 1e6 #Nested imports keep two spaces of indentation per level.
+    return times
+
+
+def top_level(times):
+    """
+    :return: The import times of the modules imported directly by the target, excluding their dependencies.
+    """
+    return {name.strip(): seconds for name, seconds in times.items() if len(name) - len(name.lstrip()) <= 2}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Import time benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="Path to write the JSON results to.")
+    args = parser.parse_args()
+
+    results = {}
+    for target, arguments in TARGETS.items():
+        runs = [import_times(arguments) for _ in range(args.repeat)]
+        totals = [sum(seconds for name, seconds in run.items() if name == name.lstrip()) for run in runs]
+        fastest = runs[totals.index(min(totals))]
+        loaded = {module: any(name.strip() == module for name in fastest) for module in HEAVY_MODULES}
+        slowest = sorted(top_level(fastest).items(), key=lambda item: item[1], reverse=True)[:8]
+        results[target] = {"median_seconds": statistics.median(totals), "min_seconds": min(totals),
+                           "loaded": loaded, "slowest_imports": dict(slowest)}
+
+        print(f"{target:<28} median {statistics.median(totals):6.3f}s  min {min(totals):6.3f}s  "
+              + "  ".join(f"{module} {'loaded' if is_loaded else 'not loaded'}" for module, is_loaded in loaded.items()))
+        for name, seconds in slowest:
+            print(f"    {name:<40}{seconds:8.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,88 @@
+"""
+Benchmark of the HDF5 storage options of dataTimeSeries.
+
+Writes a synthetic 3456-channel float32 recording (the channel count of a LUMO cap) with each storage
+configuration, then reports the write time, the time to read it back whole and the file size.
+
+usage: python benchmarks/bench_storage.py [--channels 3456] [--samples 2000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import h5py
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from snirf_writer import SnirfStorage, SnirfTimeSeriesWriter
+
+
+CONFIGURATIONS = {
+    "contiguous float64 (pysnirf2)": None,
+    "chunked float64": SnirfStorage(),
+    "chunked float32": SnirfStorage(float32=True),
+    "gzip 4 float64": SnirfStorage(compression="gzip", compression_level=4),
+    "gzip 4 + shuffle float64": SnirfStorage(compression="gzip", compression_level=4, shuffle=True),
+    "gzip 4 + shuffle float32": SnirfStorage(compression="gzip", compression_level=4, shuffle=True, float32=True),
+    "lzf + shuffle float32": SnirfStorage(compression="lzf", shuffle=True, float32=True),
+    "lzf + shuffle float32, 256 channel chunks": SnirfStorage(chunk_channels=256, compression="lzf", shuffle=True, float32=True),
+}
+
+
+def synthetic_recording(channel_count, sample_count, rate = 6.25):
+    """
+    :return: Time stamps and a float32 [#Samples x #Channels] series of slowly varying, noisy intensities.
+    """
+    rng = numpy.random.default_rng(0)
+    time_stamps = numpy.arange(sample_count) / rate
+    baseline = rng.uniform(1e-3, 1.0, channel_count)
+    drift = numpy.sin(2 * numpy.pi * 0.1 * time_stamps)[:, numpy.newaxis] * 0.05
+    noise = rng.normal(0, 0.01, (sample_count, channel_count))
+    return time_stamps, (baseline * (1 + drift + noise)).astype(numpy.float32)
+
+
+def write(path, storage, time_stamps, time_series):
+    with h5py.File(path, "w") as h5_file:
+        h5_file.create_group("/nirs/data1")
+        if storage is None:
+            h5_file["/nirs/data1/time"] = time_stamps
+            h5_file["/nirs/data1/dataTimeSeries"] = time_series.astype(numpy.float64)
+        else:
+            writer = SnirfTimeSeriesWriter(h5_file, "/nirs/data1", time_series.shape[1], 0, storage.Dtype("float32"), storage=storage,
+                                           sample_count=len(time_stamps))
+            writer.Append(time_stamps, time_series)
+
+
+def read(path):
+    with h5py.File(path, "r") as h5_file:
+        return h5_file["/nirs/data1/dataTimeSeries"][()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("dataTimeSeries storage benchmark")
+    parser.add_argument("--channels", type=int, default=3456)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    time_stamps, time_series = synthetic_recording(args.channels, args.samples)
+    print(f"{args.samples} samples x {args.channels} channels ({time_series.nbytes / 2**20:.1f} MiB as float32)")
+    print(f"{'configuration':<44}{'write s':>9}{'read s':>9}{'MiB':>9}{'ratio':>7}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.snirf")
+        baseline_size = None
+        for name, storage in CONFIGURATIONS.items():
+            write_times, read_times = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                write(path, storage, time_stamps, time_series)
+                write_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                values = read(path)
+                read_times.append(time.perf_counter() - start)
+            assert numpy.array_equal(values.astype(numpy.float32), time_series)
+            size = os.path.getsize(path)
+            baseline_size = baseline_size or size
+            print(f"{name:<44}{min(write_times):9.3f}{min(read_times):9.3f}{size / 2**20:9.1f}{baseline_size / size:7.2f}")
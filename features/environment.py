@@ -0,0 +1,8 @@
+import tempfile
+
+def before_scenario(context, scenario):
+    #Every scenario writes its files to its own temporary directory, removed even if a step fails.
+    context.directory = tempfile.TemporaryDirectory()
+
+def after_scenario(context, scenario):
+    context.directory.cleanup()
@@ -1,8 +1,27 @@
 from behave import *
 import test_utils
 import XDF_TO_SNIRF
+import xdf_formatter
+import xdf_reader
+import xdf_timing
+import probe_cache
+import aux_alignment
+import warnings
+import batch_convert
+import stream_snirf
+import lsl_recorder
+import xdf_replay
+import pylsl
+import threading
+import time
+import snirf_writer
+import snirf
+import numpy
 import utils
 import random
+import os
+import h5py
+import pyxdf
 
 @given("xdf channels populated with the following DCS data")
 def step_impl(context):
@@ -26,13 +45,24 @@ def step_impl(context):
         context.optodes.append(detector_optode)
         context.channels.append(channel)
 
+@given("xdf channels populated with the following Frequency Domain data")
+def step_impl(context):
+    context.channels = []
+    context.optodes = []
+    for i, row in enumerate(context.table):
+        channel = test_utils.mimic_xdf_meta_data_channel(label=f"C/{i}", type="Intensity", measure=row["measure"], source=f"S/{i}", detector=f"D/{i}", wavelen=row["wavelen"], fd_frequency=row["fd_frequency"])
+        source_optode,  detector_optode = test_utils.mimic_corresponding_optodes(channel)
+        context.optodes.append(source_optode)
+        context.optodes.append(detector_optode)
+        context.channels.append(channel)
 
 @When("we convert the channels into snirf measumentLists and probe")
 def step_impl(context):
-    context.snirf_probe =  XDF_TO_SNIRF.XdfToSnirfProbe(context.channels, context.optodes).probe
+    xdf_to_snirf_probe = XDF_TO_SNIRF.XdfToSnirfProbe(context.channels, context.optodes)
+    context.snirf_probe = xdf_to_snirf_probe.probe
     context.snirf_channels = []
     for channel in context.channels:
-        context.snirf_channels.append(XDF_TO_SNIRF.XdfToSnirfMeasurmentListElement(channel, context.snirf_probe).measurmentListElement)
+        context.snirf_channels.append(XDF_TO_SNIRF.XdfToSnirfMeasurmentListElement(channel, context.snirf_probe, xdf_to_snirf_probe.probeIndex).measurmentListElement)
 
 @Then("the probe and the measumentLists will contain corresponding DCS data")
 def step_impl(context):
@@ -50,5 +80,573 @@ def step_impl(context):
         assert context.snirf_probe.wavelengths[measurmentList.wavelengthIndex - 1] == float(row["wavelen"])
         assert context.snirf_probe.timeDelayWidths[measurmentList.dataTypeIndex - 1] == utils.convert("ps", "s", float(row["td_width"]))
 
+@Then("the probe and the measumentLists will contain corresponding Frequency Domain data")
+def step_impl(context):
+    for row, measurmentList in zip(context.table, context.snirf_channels):
+        assert measurmentList.dataType == int(row["datatype"])
+        assert context.snirf_probe.frequencies[measurmentList.dataTypeIndex - 1] == float(row["fd_frequency"])
+        assert context.snirf_probe.wavelengths[measurmentList.wavelengthIndex - 1] == float(row["wavelen"])
+
+@given("xdf streams recorded on the following hosts")
+def step_impl(context):
+    context.streams = []
+    for row in context.table:
+        info = test_utils.mimic_xdf_meta_data_info(name=row["name"], type=row["type"], source_id=row["name"], hostname=row["hostname"])
+        context.streams.append({"info": info})
+
+@When("we attach the aux streams to the NIRS streams with the hostname rule")
+def step_impl(context):
+    context.nirs_streams = [stream for stream in context.streams if utils.get(stream, "info.type") == "NIRS"]
+    aux_streams = [stream for stream in context.streams if utils.get(stream, "info.type") != "NIRS"]
+    context.assigned = XDF_TO_SNIRF.assign_aux_streams(context.nirs_streams, aux_streams, "hostname")
+
+@Then("each NIRS stream will have the following aux streams")
+def step_impl(context):
+    for row, nirs_stream, aux_streams in zip(context.table, context.nirs_streams, context.assigned):
+        assert utils.get(nirs_stream, "info.name") == row["nirs"]
+        assert [utils.get(stream, "info.name") for stream in aux_streams] == row["aux"].split(",")
+
+@given("xdf NIRS streams with the following names and optode layouts")
+def step_impl(context):
+    context.streams = []
+    context.optodes = []
+    for row in context.table:
+        channel = test_utils.mimic_xdf_meta_data_channel()
+        optodes = list(test_utils.mimic_corresponding_optodes(channel))
+        info = test_utils.mimic_xdf_meta_data(test_utils.mimic_xdf_meta_data_info(name=row["name"]), [channel],
+                                              [test_utils.mimic_xdf_meta_data_fiducial()], [dict(optode) for optode in optodes])
+        if row["layout"] == "lumo":
+            desc = info["desc"][0]
+            desc["fiducial"] = desc.pop("fiducials")
+            lumo_optodes = desc.pop("optodes")[0]["optode"]
+            desc["probes"] = [{"probe": lumo_optodes, "location": [optode.pop("location") for optode in lumo_optodes]}]
+        context.streams.append({"info": info})
+        context.optodes.append(optodes)
+
+@When("we normalize the streams with the device adapters")
+def step_impl(context):
+    for stream in context.streams:
+        xdf_formatter.normalize_xdf_stream(stream)
+
+@Then("every stream will have optodes with locations and fiducials")
+def step_impl(context):
+    for stream, optodes in zip(context.streams, context.optodes):
+        normalized = utils.get(stream, "info.desc.optodes.optode")
+        assert [utils.get(optode, "label") for optode in normalized] == [utils.get(optode, "label") for optode in optodes]
+        assert [utils.get(optode, "location.X") for optode in normalized] == [utils.get(optode, "location.X") for optode in optodes]
+        assert utils.get(stream, "info.desc.fiducials.fiducial.label") == "Nasion"
+
+@given("xdf stream headers with the following streams")
+def step_impl(context):
+    context.stream_headers = {}
+    for stream_id, row in enumerate(context.table, 1):
+        channels = [test_utils.mimic_xdf_meta_data_channel(label=f"{source}-{detector}-{wavelen}", source=source, detector=detector, wavelen=wavelen)
+                    for source in ["S1", "S2"] for detector in ["D1", "D2"] for wavelen in ["735", "850"]] if row["type"] == "NIRS" else []
+        info = test_utils.mimic_xdf_meta_data(test_utils.mimic_xdf_meta_data_info(name=row["name"], type=row["type"], channel_count=str(len(channels) or 3)), channels)
+        info["stream_id"] = stream_id
+        context.stream_headers[stream_id] = {"info": info}
+
+@When('we select the NIRS streams "{nirs}" and the aux streams "{aux}" keeping source "{source}" at wavelength {wavelength:d}')
+def step_impl(context, nirs, aux, source, wavelength):
+    selection = xdf_reader.XdfStreamSelection([nirs], [aux], sources=[source], wavelengths=[wavelength])
+    context.selected = [selection.SubsetHeader(context.stream_headers[stream_id], indices) if indices is not None else context.stream_headers[stream_id]
+                        for stream_id, indices in ((stream_id, selection.ChannelIndices(context.stream_headers[stream_id]))
+                                                   for stream_id in selection.StreamIds(context.stream_headers))]
+
+@Then('the selected streams will be "{names}" and the NIRS channels kept will be "{labels}"')
+def step_impl(context, names, labels):
+    assert [utils.get(stream, "info.name") for stream in context.selected] == names.split(",")
+    nirs_stream = context.selected[0]
+    assert [utils.get(channel, "label") for channel in utils.get(nirs_stream, "info.desc.channels.channel")] == labels.split(",")
+    assert utils.get(nirs_stream, "info.channel_count") == len(labels.split(","))
+    assert len(utils.get(context.stream_headers[1], "info.desc.channels.channel")) == 8
+
+@given("a {rate:d} Hz stream of {samples:d} samples with a {gap:d} second gap after sample {after:d} and a clock drifting by {drift:d} ppm")
+def step_impl(context, rate, samples, gap, after, drift):
+    time_stamps = numpy.arange(samples) / rate
+    time_stamps[after:] += gap
+    clock_times = numpy.arange(0, time_stamps[-1], 5.0)
+    context.stream = {"info": test_utils.mimic_xdf_meta_data_info(name="Timing", nominal_srate=str(rate)), "time_stamps": time_stamps,
+                      "clock_times": clock_times, "clock_values": 0.5 + clock_times * drift * 1e-6}
 
+@When("we report its timing with a jitter break threshold of {samples:d} samples")
+def step_impl(context, samples):
+    context.timing = xdf_timing.stream_timing(context.stream, xdf_timing.XdfTimingOptions(jitter_break_threshold_samples=samples))
+
+@Then("the timing report will show {segments:d} segments, an effective rate of {rate:d} Hz and a clock drift of {drift:d} ppm")
+def step_impl(context, segments, rate, drift):
+    assert context.timing["segments"] == segments
+    assert len(context.timing["gaps"]) == segments - 1
+    assert abs(context.timing["effective_srate"] - rate) < 1e-6
+    assert abs(context.timing["drift_ppm"] - drift) < 1e-6
+
+use_step_matcher("re")
+
+@given(r"an XDF recording of (?P<samples>\d+)(?: (?P<variant>CW|TD|DCS|FD))? samples"
+       r"(?: from (?P<sources>\d+) sources and (?P<detectors>\d+) detectors)?(?: in chunks of (?P<chunk_samples>\d+) samples)?")
+def step_impl(context, samples, variant, sources, detectors, chunk_samples):
+    context.path_to_xdf = os.path.join(context.directory.name, "recording.xdf")
+    context.streams = [test_utils.Generate_Generic_XDF_Data(int(sources or 2), int(detectors or 2), [735, 850], int(samples), variant or "CW")]
+    context.chunk_samples = int(chunk_samples or 32)
+    test_utils.Write_XDF_File(context.path_to_xdf, context.streams, context.chunk_samples)
+
+use_step_matcher("parse")
+
+@When("we convert it incrementally after {percents} percent of its bytes are written")
+def step_impl(context, percents):
+    with open(context.path_to_xdf, "rb") as xdf_file:
+        context.xdf_bytes = xdf_file.read()
+    context.path_to_snirf = os.path.join(context.directory.name, "recording.snirf")
+    context.growing_xdf = os.path.join(context.directory.name, "growing.xdf")
+    context.runs = []
+    for percent in percents.replace(" and ", ", ").split(", "):
+        with open(context.growing_xdf, "wb") as xdf_file:
+            xdf_file.write(context.xdf_bytes[:len(context.xdf_bytes) * int(percent) // 100])
+        context.runs.append(XDF_TO_SNIRF.XdfToSnirfIncremental(context.path_to_snirf, context.growing_xdf))
+
+@Then("every run after the first will resume where the previous one stopped")
+def step_impl(context):
+    assert not context.runs[0].resumed
+    for previous, run in zip(context.runs, context.runs[1:]):
+        assert run.resumed and run.start_offset == previous.offset
+    assert context.runs[-1].offset == len(context.xdf_bytes)
+
+@Then("the SNIRF file will hold the same samples as a conversion of the finished recording")
+def step_impl(context):
+    path_to_full_snirf = os.path.join(context.directory.name, "full.snirf")
+    XDF_TO_SNIRF.XdfToSnirfStreaming(path_to_full_snirf, context.path_to_xdf, False)
+    with h5py.File(context.path_to_snirf, "r") as incremental, h5py.File(path_to_full_snirf, "r") as full:
+        for name in ["time", "dataTimeSeries"]:
+            assert numpy.array_equal(incremental["/nirs/data1/" + name][()], full["/nirs/data1/" + name][()])
+
+@given("a marker stream that starts before its NIRS stream")
+def step_impl(context):
+    context.streams.insert(0, test_utils.Generate_Marker_XDF_Data(["start"], context.streams[0]["time_stamps"][:1]))
+
+@When("we convert it incrementally before and after the NIRS stream header is written")
+def step_impl(context):
+    context.path_to_snirf = os.path.join(context.directory.name, "recording.snirf")
+    context.runs, context.written = [], []
+    for streams in [context.streams[:1], context.streams]:
+        test_utils.Write_XDF_File(context.path_to_xdf, streams)
+        context.runs.append(XDF_TO_SNIRF.XdfToSnirfIncremental(context.path_to_snirf, context.path_to_xdf))
+        context.written.append((os.path.exists(context.path_to_snirf), os.path.exists(context.runs[-1].state_path)))
+
+@Then("the first run will write neither the SNIRF file nor its sidecar")
+def step_impl(context):
+    assert not context.runs[0].converted and context.written[0] == (False, False)
+
+@Then("the second run will convert the recording from the start")
+def step_impl(context):
+    run = context.runs[1]
+    assert run.converted and not run.resumed and run.start_offset == 0 and context.written[1] == (True, True)
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        assert len(h5_file["/nirs/data1/time"]) == 100
+
+@When("we convert it in memory and with --stream and a chunk budget of {budget_kb:d} KiB")
+def step_impl(context, budget_kb):
+    context.path_to_memory_snirf = os.path.join(context.directory.name, "memory.snirf")
+    context.path_to_stream_snirf = os.path.join(context.directory.name, "stream.snirf")
+    #Streaming writes the time stamps as recorded, so the in-memory conversion skips clock sync and dejittering too.
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_memory_snirf, context.path_to_xdf, False,
+                            timing=xdf_timing.XdfTimingOptions(synchronize_clocks=False, dejitter_timestamps=False))
+    XDF_TO_SNIRF.XdfToSnirfStreaming(context.path_to_stream_snirf, context.path_to_xdf, False, chunk_budget_mb=budget_kb / 1024)
+
+@Then("both SNIRF files will hold the same time and dataTimeSeries")
+def step_impl(context):
+    with h5py.File(context.path_to_memory_snirf, "r") as memory, h5py.File(context.path_to_stream_snirf, "r") as stream:
+        for name in ["time", "dataTimeSeries"]:
+            assert memory["/nirs/data1/" + name].shape == stream["/nirs/data1/" + name].shape
+            assert numpy.array_equal(memory["/nirs/data1/" + name][()], stream["/nirs/data1/" + name][()])
+
+@given("the following markers")
+def step_impl(context):
+    #Marker onsets are given relative to the first NIRS time stamp.
+    context.streams.append(test_utils.Generate_Marker_XDF_Data([row["value"] for row in context.table],
+                                                               [context.streams[0]["time_stamps"][0] + float(row["onset"]) for row in context.table]))
+    test_utils.Write_XDF_File(context.path_to_xdf, context.streams, context.chunk_samples)
+
+@Then("both SNIRF files will have the following stim groups")
+def step_impl(context):
+    for path_to_snirf in [context.path_to_memory_snirf, context.path_to_stream_snirf]:
+        with h5py.File(path_to_snirf, "r") as h5_file:
+            stims = [h5_file["/nirs"][f"stim{i + 1}"] for i in range(len(context.table.rows))]
+            assert "stim" + str(len(context.table.rows) + 1) not in h5_file["/nirs"]
+            for stim, row in zip(stims, context.table):
+                assert stim["name"].asstr()[()] == row["name"]
+                onsets = [float(onset) for onset in row["onsets"].split(",")]
+                expected = numpy.column_stack([onsets, numpy.zeros(len(onsets)), numpy.ones(len(onsets))])
+                assert numpy.allclose(stim["data"][()], expected, rtol=0, atol=1e-6)
+
+def h5_datasets(h5_group):
+    """
+    :return: The values of every dataset below an h5py group, indexed by their path relative to it.
+    """
+    datasets = {}
+    h5_group.visititems(lambda name, item: datasets.__setitem__(name, item[()]) if isinstance(item, h5py.Dataset) else None)
+    return datasets
+
+class CountingProbeCache(probe_cache.ProbeCache):
+    """
+    A ProbeCache counting the entries found by Load.
+    """
+    hits = 0
+
+    def Load(self, key, snirf_file, columns = False):
+        cached = super().Load(key, snirf_file, columns)
+        self.hits += cached is not None
+        return cached
+
+@When("we convert it twice with a probe cache and the {layout} measurement list layout")
+def step_impl(context, layout):
+    context.probe_cache = CountingProbeCache(os.path.join(context.directory.name, "cache"))
+    context.paths_to_snirf = [os.path.join(context.directory.name, f"run{run}.snirf") for run in [1, 2]]
+    context.hits = []
+    for path_to_snirf in context.paths_to_snirf:
+        XDF_TO_SNIRF.XdfToSnirf(path_to_snirf, context.path_to_xdf, False, context.probe_cache, measurement_list_layout=layout)
+        context.hits.append(context.probe_cache.hits)
+
+@Then("the second conversion will load its probe and measurement list from the cache")
+def step_impl(context):
+    assert context.hits == [0, 1]
 
+@Then("both SNIRF files will hold the same probe and measurement list")
+def step_impl(context):
+    with h5py.File(context.paths_to_snirf[0], "r") as first, h5py.File(context.paths_to_snirf[1], "r") as second:
+        for path, prefix in [("/nirs/probe", ""), ("/nirs/data1", "measurementList")]:
+            first_datasets = {name: value for name, value in h5_datasets(first[path]).items() if name.startswith(prefix)}
+            second_datasets = {name: value for name, value in h5_datasets(second[path]).items() if name.startswith(prefix)}
+            assert first_datasets and first_datasets.keys() == second_datasets.keys()
+            for name, value in first_datasets.items():
+                assert numpy.array_equal(value, second_datasets[name], equal_nan=numpy.asarray(value).dtype.kind == "f"), name
+
+@given("a probe cache with room for {entries:d} entries")
+def step_impl(context, entries):
+    context.probe_cache = probe_cache.ProbeCache(os.path.join(context.directory.name, "cache"))
+    context.store = lambda key: context.probe_cache.Store(key, snirf.Probe("", probe_cache.conf),
+                                                          {field: [1] for field in probe_cache.MEASUREMENT_LIST_FIELDS})
+    #Every entry has the same size, so the limit is set from the size of a first one.
+    context.store("sizing")
+    entry_bytes = os.path.getsize(context.probe_cache.Path("sizing"))
+    context.probe_cache.Invalidate("sizing")
+    context.probe_cache.max_bytes = entries * entry_bytes + entry_bytes // 2
+
+@When("we store {entries:d} entries one after the other")
+def step_impl(context, entries):
+    for entry in range(1, entries + 1):
+        context.store(str(entry))
+        #Space the use times apart, the file system may not tell entries stored in the same instant apart.
+        os.utime(context.probe_cache.Path(str(entry)), (1000 * entry, 1000 * entry))
+
+@When("we invalidate entry {entry}")
+def step_impl(context, entry):
+    context.probe_cache.Invalidate(entry)
+
+@When("we invalidate the cache")
+def step_impl(context):
+    context.probe_cache.Invalidate()
+
+@Then("the cache will hold the entries {entries}")
+def step_impl(context, entries):
+    assert sorted(os.listdir(context.probe_cache.cache_dir)) == [entry + ".pkl" for entry in entries.split(",")]
+
+@Then("the cache will hold no entries")
+def step_impl(context):
+    assert os.listdir(context.probe_cache.cache_dir) == []
+
+@When("we convert it with the groups and with the arrays measurement list layout")
+def step_impl(context):
+    context.paths_to_snirf = {}
+    for layout in XDF_TO_SNIRF.MEASUREMENT_LIST_LAYOUTS:
+        context.paths_to_snirf[layout] = os.path.join(context.directory.name, layout + ".snirf")
+        XDF_TO_SNIRF.XdfToSnirf(context.paths_to_snirf[layout], context.path_to_xdf, False, measurement_list_layout=layout)
+
+@Then("the measurementLists arrays will hold the fields of the measurementList groups")
+def step_impl(context):
+    with h5py.File(context.paths_to_snirf["groups"], "r") as groups, h5py.File(context.paths_to_snirf["arrays"], "r") as arrays:
+        data_groups, data_arrays = groups["/nirs/data1"], arrays["/nirs/data1"]
+        assert not any(name.startswith("measurementList") and name != "measurementLists" for name in data_arrays)
+        elements = [data_groups[f"measurementList{i + 1}"] for i in range(data_groups["dataTimeSeries"].shape[1])]
+        assert set(data_arrays["measurementLists"]) == set(elements[0])
+        for field, values in data_arrays["measurementLists"].items():
+            values = values.asstr()[()] if values.dtype.kind == "O" else values[()]
+            expected = [element[field].asstr()[()] if element[field].dtype.kind == "O" else element[field][()] for element in elements]
+            if field == "wavelengthIndex":
+                #Compare the wavelengths, each file numbers its probe's wavelengths on its own.
+                values = arrays["/nirs/probe/wavelengths"][()][values - 1]
+                expected = groups["/nirs/probe/wavelengths"][()][numpy.asarray(expected) - 1]
+            assert len(values) == len(elements) and numpy.array_equal(values, expected), field
+
+SNIRF_STORAGES = {"contiguously": {}, "in chunks of 8 rows": {"chunk_rows": 8},
+                  "in chunks of 8 rows with gzip": {"chunk_rows": 8, "compression": "gzip"},
+                  "in chunks of 8 rows with shuffle": {"chunk_rows": 8, "compression": "gzip", "shuffle": True},
+                  "in chunks of 8 rows with float32": {"chunk_rows": 8, "float32": True}}
+
+@given("a SNIRF data group stored {storage}")
+def step_impl(context, storage):
+    context.path_to_snirf = os.path.join(context.directory.name, "written.snirf")
+    context.storage = snirf_writer.SnirfStorage(**SNIRF_STORAGES[storage])
+    with h5py.File(context.path_to_snirf, "w") as h5_file:
+        h5_file.create_group("/nirs/data1")
+
+@When("we append {dtype} blocks of {block_sizes} samples of {channels:d} channels")
+def step_impl(context, dtype, block_sizes, channels):
+    block_sizes = [int(size) for size in block_sizes.replace(" and ", ", ").split(", ")]
+    context.time_stamps = 100 + numpy.arange(sum(block_sizes)) / 10
+    context.time_series = numpy.random.uniform(0.001, 10, (sum(block_sizes), channels)).astype(dtype)
+    context.dtype = context.storage.Dtype("float32" if dtype == "float32" else "double64")
+    with h5py.File(context.path_to_snirf, "r+") as h5_file:
+        #Contiguous datasets need the number of samples up front, chunked ones are grown by every block.
+        sample_count = None if context.storage.Chunked() else sum(block_sizes)
+        writer = snirf_writer.SnirfTimeSeriesWriter(h5_file, "/nirs/data1", channels, dtype=context.dtype,
+                                                    storage=context.storage, sample_count=sample_count)
+        for start, stop in zip(numpy.cumsum([0] + block_sizes[:-1]), numpy.cumsum(block_sizes)):
+            writer.Append(context.time_stamps[start:stop].copy(), context.time_series[start:stop])
+
+@Then("the datasets will read back the appended samples")
+def step_impl(context):
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        data = h5_file["/nirs/data1"]
+        assert data["dataTimeSeries"].dtype == context.dtype
+        assert numpy.array_equal(data["time"][()], context.time_stamps - context.time_stamps[0])
+        assert numpy.array_equal(data["dataTimeSeries"][()], context.time_series.astype(context.dtype))
+
+@given("a directory of {recordings:d} XDF recordings")
+def step_impl(context, recordings):
+    for recording in range(recordings):
+        test_utils.Write_XDF_File(os.path.join(context.directory.name, f"recording{recording + 1}.xdf"),
+                                  [test_utils.Generate_Generic_XDF_Data(2, 2, [735, 850], 100)])
+
+@When("we convert the directory with {workers:d} workers and validate the SNIRF files with the {tier} tier")
+def step_impl(context, workers, tier):
+    batch = batch_convert.BatchConversion(batch_convert.find_xdf_files([context.directory.name]), workers=workers,
+                                          validate=True, quiet=True, validate_tier=tier)
+    context.summary = batch.Summary()
+
+@Then("the batch summary will count {converted:d} converted, {skipped:d} skipped and {failed:d} failed files")
+def step_impl(context, converted, skipped, failed):
+    summary = context.summary
+    assert (summary["files"], summary["converted"], summary["skipped"], summary["failed"]) == (converted + skipped + failed, converted, skipped, failed)
+    assert all(os.path.exists(result["snirf"]) for result in summary["results"] if result["status"] == "converted")
+
+@Then("the batch summary will count {valid:d} valid and {invalid:d} invalid files validated with the {tier} tier")
+def step_impl(context, valid, invalid, tier):
+    validation = context.summary["validation"]
+    assert (validation["tier"], validation["files"], validation["valid"], validation["invalid"]) == (tier, valid + invalid, valid, invalid)
+
+@given("{streams:d} aux streams at {rate:d} Hz from {start1:g} to {stop1:g} and from {start2:g} to {stop2:g} seconds after the NIRS start")
+def step_impl(context, streams, rate, start1, stop1, start2, stop2):
+    #The aux channels are linear in time, so their interpolated values are known exactly: the time since the NIRS start and its opposite.
+    context.aux_segments = [(start1, stop1), (start2, stop2)]
+    nirs_start = context.streams[0]["time_stamps"][0]
+    times = numpy.concatenate([start + numpy.arange(round((stop - start) * rate) + 1) / rate for start, stop in context.aux_segments])
+    for n in range(streams):
+        context.streams.append(test_utils.Generate_Aux_XDF_Data(f"Acc{n + 1}", nirs_start + times, numpy.column_stack([times, -times]), rate))
+    test_utils.Write_XDF_File(context.path_to_xdf, context.streams, context.chunk_samples)
+
+@When("we convert it in memory")
+def step_impl(context):
+    context.path_to_snirf = os.path.join(context.directory.name, "recording.snirf")
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_snirf, context.path_to_xdf, False)
+
+@Then("the data group will hold the time stamps and time series loaded by pyxdf in a contiguous dataset")
+def step_impl(context):
+    xdf_streams, _ = pyxdf.load_xdf(context.path_to_xdf)
+    time_stamps, time_series = xdf_streams[0]["time_stamps"], xdf_streams[0]["time_series"]
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        assert h5_file["/nirs/data1/dataTimeSeries"].chunks is None
+        assert numpy.array_equal(h5_file["/nirs/data1/dataTimeSeries"][()], time_series)
+        assert numpy.allclose(h5_file["/nirs/data1/time"][()], time_stamps - time_stamps[0], rtol=0, atol=1e-9)
+
+@When("we convert it with the aux streams aligned onto {align_aux}")
+def step_impl(context, align_aux):
+    context.path_to_snirf = os.path.join(context.directory.name, "aligned.snirf")
+    #Keep the recorded time stamps, the expected values are computed from them.
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_snirf, context.path_to_xdf, False, align_aux=align_aux,
+                            timing=xdf_timing.XdfTimingOptions(synchronize_clocks=False, dejitter_timestamps=False))
+
+@Then("the time of every aux group will be a hard link to {linked}")
+def step_impl(context, linked):
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        aux_names = [name for name in h5_file["/nirs"] if name.startswith("aux")]
+        assert len(aux_names) == len(context.streams) - 1
+        for name in aux_names:
+            assert h5_file[f"/nirs/{name}/time"] == h5_file[linked]
+
+@Then("the aux time will hold {samples:d} samples {interval:g} seconds apart from the NIRS start")
+def step_impl(context, samples, interval):
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        assert numpy.allclose(h5_file["/nirs/aux1/time"][()], numpy.arange(samples) * interval, rtol=0, atol=1e-6)
+
+@Then("the aux values will be interpolated, NaN before the aux start and across the gap")
+def step_impl(context):
+    (start1, stop1), (start2, stop2) = context.aux_segments
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        for name in [name for name in h5_file["/nirs"] if name.startswith("aux")]:
+            time, values = h5_file[f"/nirs/{name}/time"][()], h5_file[f"/nirs/{name}/dataTimeSeries"][()]
+            recorded = ((time >= start1) & (time <= stop1)) | ((time >= start2) & (time <= stop2))
+            assert recorded.any() and (~recorded).any()
+            assert numpy.isnan(values[~recorded]).all()
+            assert numpy.allclose(values[recorded], numpy.column_stack([time, -time])[recorded], rtol=0, atol=1e-6)
+
+def number_list(text):
+    return [float(value) for value in text.replace(" and ", ", ").split(", ")]
+
+@given("a time series with the values {values} recorded at {time_stamps} seconds")
+def step_impl(context, values, time_stamps):
+    context.time_series, context.time_stamps = number_list(values), number_list(time_stamps)
+
+@When("we interpolate it onto {target_time_stamps} seconds")
+def step_impl(context, target_time_stamps):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error") #A division by a zero interval warns.
+        context.aligned = aux_alignment.align_time_series(context.time_stamps, context.time_series, number_list(target_time_stamps))
+
+@Then("the interpolated values will be {values}")
+def step_impl(context, values):
+    assert numpy.array_equal(context.aligned, number_list(values), equal_nan=True)
+
+def pull_samples(inlet, sample_count, timeout = 10.0):
+    """
+    :return: The values and time stamps of the first sample_count samples pulled from the inlet, fewer if it times out.
+    """
+    values, time_stamps = [], []
+    deadline = time.monotonic() + timeout
+    while len(time_stamps) < sample_count and time.monotonic() < deadline:
+        chunk, stamps = inlet.pull_chunk(timeout=0.5)
+        values.extend(chunk)
+        time_stamps.extend(stamps)
+    return numpy.asarray(values), numpy.asarray(time_stamps)
+
+@When("we convert it and replay the SNIRF file over LSL at speed {speed:g} in chunks of {chunk_size:d} samples")
+def step_impl(context, speed, chunk_size):
+    context.path_to_snirf = os.path.join(context.directory.name, "replayed.snirf")
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_snirf, context.path_to_xdf, False)
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        context.time, context.data = h5_file["/nirs/data1/time"][()], h5_file["/nirs/data1/dataTimeSeries"][()]
+
+    #The streamer sends once the inlet is connected, and the inlet pulls while it sends.
+    snirf_file = snirf.loadSnirf(context.path_to_snirf, True, True)
+    replay = threading.Thread(target=lambda: setattr(context, "streamer", stream_snirf.SnirfStreamer(snirf_file, chunk_size, speed, wait_for_consumers=10)))
+    replay.start()
+    stream_infos = pylsl.resolve_byprop("name", "SNIRF_DATA", timeout=10)
+    inlet = pylsl.StreamInlet(stream_infos[0])
+    inlet.open_stream(timeout=10)
+    context.received, context.received_stamps = pull_samples(inlet, len(context.time))
+    inlet.close_stream() #Lets the streamer close its outlet.
+    replay.join()
+    snirf_file.close()
+
+@Then("an inlet will receive every sample, time stamped {scale:g} times the recorded time apart")
+def step_impl(context, scale):
+    assert context.streamer.replay_stats.samples == len(context.time) == len(context.received_stamps)
+    assert numpy.allclose(context.received, context.data, rtol=1e-6)
+    assert numpy.allclose(context.received_stamps - context.received_stamps[0], (context.time - context.time[0]) * scale, rtol=0, atol=1e-6)
+
+@Then("the replay will take at least {seconds:g} seconds")
+def step_impl(context, seconds):
+    assert seconds <= context.streamer.replay_stats.elapsed < seconds + 5
+
+@given("an aux stream of {samples:d} samples at {rate:d} Hz starting {offset:g} seconds after the NIRS start")
+def step_impl(context, samples, rate, offset):
+    time_stamps = context.streams[0]["time_stamps"][0] + offset + numpy.arange(samples) / rate
+    context.streams.append(test_utils.Generate_Aux_XDF_Data("Replayed Acc", time_stamps, numpy.ones((samples, 1)), rate))
+    test_utils.Write_XDF_File(context.path_to_xdf, context.streams, context.chunk_samples)
+
+@When("we replay the XDF file over LSL at speed {speed:g}")
+def step_impl(context, speed):
+    #The inlets connect during the lead time, before the first sample is due.
+    context.xdf_replay = xdf_replay.XdfReplay(context.path_to_xdf, speed, 16, lead_time=2.0)
+    inlets = [pylsl.StreamInlet(pylsl.resolve_byprop("name", stream["info"]["name"][0], timeout=10)[0]) for stream in context.streams]
+    for inlet in inlets:
+        inlet.open_stream(timeout=10)
+    replay = threading.Thread(target=lambda: setattr(context, "replay_stats", context.xdf_replay.Run()))
+    replay.start()
+    context.received_stamps = [pull_samples(inlet, len(stream["time_stamps"]))[1] for inlet, stream in zip(inlets, context.streams)]
+    for inlet in inlets:
+        inlet.close_stream()
+    replay.join()
+
+@Then("the inlets will receive every sample of each stream with the recorded offsets between the streams")
+def step_impl(context):
+    assert len(context.replay_stats) == len(context.streams)
+    first_stamp = min(stream["time_stamps"][0] for stream in context.streams)
+    first_received = min(stamps[0] for stamps in context.received_stamps)
+    for stamps, stream in zip(context.received_stamps, context.streams):
+        assert len(stamps) == len(stream["time_stamps"])
+        assert numpy.allclose(stamps - first_received, stream["time_stamps"] - first_stamp, rtol=0, atol=1e-6)
+
+@When("we convert it and read its data group in slabs of {slab_rows:d} rows, {read_ahead:d} slabs ahead")
+def step_impl(context, slab_rows, read_ahead):
+    context.path_to_snirf = os.path.join(context.directory.name, "slabs.snirf")
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_snirf, context.path_to_xdf, False)
+    with h5py.File(context.path_to_snirf, "r") as h5_file:
+        context.time, context.data = h5_file["/nirs/data1/time"][()], h5_file["/nirs/data1/dataTimeSeries"][()]
+        context.slab_reader = stream_snirf.SnirfSlabReader(h5_file["/nirs/data1"], slab_rows, read_ahead)
+        context.slabs = list(context.slab_reader)
+
+@Then("the slabs will hold {rows} rows of the time and dataTimeSeries datasets")
+def step_impl(context, rows):
+    assert [len(slab_time) for slab_time, _ in context.slabs] == [int(row) for row in rows.replace(" and ", ", ").split(", ")]
+    assert all(len(slab_time) == len(slab_data) for slab_time, slab_data in context.slabs)
+    assert numpy.array_equal(numpy.concatenate([slab_time for slab_time, _ in context.slabs]), context.time)
+    assert numpy.array_equal(numpy.concatenate([slab_data for _, slab_data in context.slabs]), context.data)
+
+@Then("the reader thread will stop at the end of the file")
+def step_impl(context):
+    context.slab_reader.thread.join(timeout=5)
+    assert not context.slab_reader.thread.is_alive()
+
+@When("we convert the following values")
+def step_impl(context):
+    context.conversions = []
+    for row in context.table:
+        values = number_list(row["value"]) if row["value"] else []
+        value = {"number": values[0] if values else None, "string": row["value"], "list": values,
+                 "array": numpy.asarray(values)}[row["passed as"]]
+        context.conversions.append((utils.convert(row["unit"], row["target"], value), row["result"], row["passed as"]))
+
+@Then("every value will be converted to its result")
+def step_impl(context):
+    for converted, result, passed_as in context.conversions:
+        if result == "None":
+            assert converted is None
+        elif passed_as in ["list", "array"]:
+            assert isinstance(converted, numpy.ndarray) and numpy.allclose(converted, number_list(result), rtol=1e-12, atol=0)
+        else:
+            assert converted is not None and numpy.isclose(converted, float(result), rtol=1e-12, atol=0)
+
+@When("we compute the conversion factors between every SI prefix of {units}")
+def step_impl(context, units):
+    units = units.replace(" and ", ", ").split(", ")
+    context.unit_pairs = [(prefix + unit, other_prefix + unit) for unit in units
+                          for prefix in utils._si_prefix_exponents for other_prefix in utils._si_prefix_exponents]
+    context.factors = [utils.conversion_factor(current_unit, target_unit) for current_unit, target_unit in context.unit_pairs]
+
+@Then("they will equal the conversion factors of astropy")
+def step_impl(context):
+    from astropy import units as u
+    for (current_unit, target_unit), factor in zip(context.unit_pairs, context.factors):
+        assert numpy.isclose(factor, u.Unit(current_unit).to(u.Unit(target_unit)), rtol=1e-12, atol=0), (current_unit, target_unit)
+
+@When("we convert it, replay it over LSL at speed {speed:g} and record the stream for {duration:g} seconds")
+def step_impl(context, speed, duration):
+    context.path_to_snirf = os.path.join(context.directory.name, "replayed.snirf")
+    context.path_to_recorded_snirf = os.path.join(context.directory.name, "recorded.snirf")
+    XDF_TO_SNIRF.XdfToSnirf(context.path_to_snirf, context.path_to_xdf, False)
+    snirf_file = snirf.loadSnirf(context.path_to_snirf, True, True)
+    replay = threading.Thread(target=lambda: stream_snirf.SnirfStreamer(snirf_file, 16, speed, wait_for_consumers=10))
+    replay.start()
+    recorder = lsl_recorder.LslToSnirfRecorder(context.path_to_recorded_snirf, lsl_recorder.resolve_nirs_inlet("SNIRF_DATA"))
+    context.recorded_samples = recorder.Record(duration)
+    recorder.Close()
+    replay.join()
+    snirf_file.close()
+
+@Then("the recorded SNIRF file will hold every replayed sample with its time from the first sample")
+def step_impl(context):
+    with h5py.File(context.path_to_snirf, "r") as replayed, h5py.File(context.path_to_recorded_snirf, "r") as recorded:
+        time = replayed["/nirs/data1/time"][()]
+        assert context.recorded_samples == len(time) == len(recorded["/nirs/data1/time"])
+        assert numpy.allclose(recorded["/nirs/data1/time"][()], time - time[0], rtol=0, atol=1e-6)
+        assert numpy.allclose(recorded["/nirs/data1/dataTimeSeries"][()], replayed["/nirs/data1/dataTimeSeries"][()], rtol=1e-6)
@@ -1,6 +1,8 @@
 
 from random import uniform
+import struct
 import numpy as np
+from xml.sax.saxutils import escape
 
 def mimic_xdf_meta_data_channel(label="C1", type="Intensity", measure = "Amplitude", source="N1/A",
                                 detector="N1/1", wavelen="735.000000", 
@@ -24,7 +26,7 @@ def mimic_xdf_meta_data_channel(label="C1", type="Intensity", measure = "Amplitu
         channel["td"]["delay"] = [td_delay]
     if td_order:
         channel["td"]["order"] = [td_order]
-    if td_delay:
+    if td_width:
         channel["td"]["width"] = [td_width]
     if fd_frequency:
          channel["fd"] = {}
@@ -67,44 +69,127 @@ def mimic_corresponding_optodes(channel):
     return source, detector
 
 
-def Generate_Generic_XDF_Data(num_sources, num_detectors, wavelen_1, wavelen_2, num_time_stamps):
+VARIANT_CHANNELS = {"CW": {"measure": "Amplitude"},
+                    "TD": {"measure": "TD_Gated_Amplitude", "td_delay": "1000", "td_width": "500"},
+                    "DCS": {"measure": "DCS_g2", "dcs_delay": "1000", "dcs_width": "500"},
+                    "FD": {"measure": "FD_AC_Amplitude", "fd_frequency": "110000000"}}
+
+
+def Generate_Generic_XDF_Data(num_sources, num_detectors, wavelengths, num_time_stamps, variant="CW", nominal_srate=10.0):
+    """
+    Generate a synthetic XDF NIRS stream with one channel per source, detector and wavelength.
+
+    :param wavelengths: List of wavelengths in nm.
+    :param variant: Data type of the channels, one of VARIANT_CHANNELS ("CW", "TD", "DCS" or "FD").
+    :param nominal_srate: Sample rate of the time stamps in Hz.
+    :return: A stream dictionary with "info", "time_stamps" and "time_series" keys, formatted like those of pyxdf.
+    """
     count = 0
     channels = []
     optodes = []
     xdf_data = {}
     for i in range(num_sources):
         for j in range(num_detectors):
-            count += 1
-            channel_1 = mimic_xdf_meta_data_channel(f"C/{count}", "Intensity", "Amplitude", f"S/{i}", f"D/{j}", wavelen_1)
-            channel_2 = mimic_xdf_meta_data_channel(f"C/{count}", "Intensity", "Amplitude", f"S/{i}", f"D/{j}", wavelen_2)
-            channels.append(channel_1, channel_2)
+            for wavelen in wavelengths:
+                count += 1
+                channels.append(mimic_xdf_meta_data_channel(f"C/{count}", "Intensity", source=f"S/{i}", detector=f"D/{j}",
+                                                            wavelen=str(wavelen), **VARIANT_CHANNELS[variant]))
     
     for i in range(num_sources):
-        optodes.append(mimic_xdf_meta_data_optode(f"S/{i}", None, "Source"))
+        optodes.append(mimic_xdf_meta_data_optode(f"S/{i}", None, "Source", uniform(0, 100), uniform(0, 100), uniform(0, 100)))
     
     for i in range(num_detectors):
-        optodes.append(mimic_xdf_meta_data_optode(f"D/{i}", None, "Detector"))
+        optodes.append(mimic_xdf_meta_data_optode(f"D/{i}", None, "Detector", uniform(0, 100), uniform(0, 100), uniform(0, 100)))
 
-    
-    info = mimic_xdf_meta_data(channels=channels, optodes=optodes)
+    info = mimic_xdf_meta_data_info(name="Generic NIRS", channel_count=str(len(channels)), source_id="generic",
+                                    nominal_srate=str(nominal_srate))
+    info = mimic_xdf_meta_data(info=info, channels=channels, optodes=optodes, fiducials=[mimic_xdf_meta_data_fiducial()])
     xdf_data["info"] = info
 
-    time_stamps = []
-    inital = uniform(100000000000, 0)
-    increment = uniform(10, 0.01) 
-    for i in range(num_time_stamps):
-        time_stamps.append(inital + increment * i)
-    
-    xdf_data["time_stamps"] = time_stamps
-
-    time_series = []
-    for i in range(num_time_stamps):
-        time_series.append(np.arange(0, len(channels), uniform(10, 0.001)))
-    
-    xdf_data["time_series"] = time_series
+    inital = uniform(0, 100000)
+    xdf_data["time_stamps"] = inital + np.arange(num_time_stamps) / nominal_srate
+    xdf_data["time_series"] = np.random.uniform(0.001, 10, (num_time_stamps, len(channels))).astype(np.float32)
 
     return xdf_data
 
 
-
-    
\ No newline at end of file
+def Generate_Marker_XDF_Data(values, time_stamps):
+    """
+    :param values: The marker values, one string per event.
+    :param time_stamps: The time stamps of the events.
+    :return: A marker stream formatted like those of pyxdf.
+    """
+    info = mimic_xdf_meta_data_info(name="Generic Markers", type="Markers", channel_count="1", channel_format="string",
+                                    source_id="generic markers", nominal_srate="0")
+    return {"info": mimic_xdf_meta_data(info=info), "time_stamps": np.asarray(time_stamps, dtype=np.float64),
+            "time_series": [[value] for value in values]}
+
+
+def Generate_Aux_XDF_Data(name, time_stamps, time_series, nominal_srate):
+    """
+    :param name: The name of the stream.
+    :param time_stamps: The time stamps of the samples.
+    :param time_series: A [#Samples x #Channels] array of values.
+    :param nominal_srate: The nominal sample rate of the stream in Hz.
+    :return: An accelerometer stream formatted like those of pyxdf.
+    """
+    time_series = np.asarray(time_series, dtype=np.float64)
+    info = mimic_xdf_meta_data_info(name=name, type="Accelerometer", channel_count=str(time_series.shape[1]), channel_format="double64",
+                                    source_id=name, nominal_srate=str(nominal_srate))
+    return {"info": mimic_xdf_meta_data(info=info), "time_stamps": np.asarray(time_stamps, dtype=np.float64), "time_series": time_series}
+
+
+def _xdf_varlen_int(value):
+    if value < 256:
+        return b"\x01" + struct.pack("<B", value)
+    if value < 2**32:
+        return b"\x04" + struct.pack("<I", value)
+    return b"\x08" + struct.pack("<Q", value)
+
+
+def _xdf_chunk(tag, content, stream_id=None):
+    body = struct.pack("<H", tag) + (struct.pack("<I", stream_id) if stream_id is not None else b"") + content
+    return _xdf_varlen_int(len(body)) + body
+
+
+def _xdf_xml(tag, value):
+    if isinstance(value, dict):
+        return f"<{tag}>" + "".join(_xdf_xml(key, item) for key, item in value.items()) + f"</{tag}>"
+    if isinstance(value, list):
+        return "".join(_xdf_xml(tag, item) for item in value)
+    return f"<{tag}>{'' if value is None else escape(str(value))}</{tag}>"
+
+
+XDF_VALUE_FORMATS = {"float32": "<f4", "double64": "<f8", "int8": "<i1", "int16": "<i2", "int32": "<i4", "int64": "<i8"}
+
+def Write_XDF_File(path, streams, chunk_samples=32):
+    """
+    Write streams formatted like those of pyxdf (e.g. from Generate_Generic_XDF_Data) to an XDF file.
+    Chunk layout according to https://github.com/sccn/xdf/wiki/Specifications
+
+    :param path: Path of the XDF file.
+    :param streams: List of stream dictionaries with "info", "time_stamps" and "time_series" keys.
+    :param chunk_samples: Number of samples per sample chunk.
+    """
+    with open(path, "wb") as f:
+        f.write(b"XDF:")
+        f.write(_xdf_chunk(1, b'<?xml version="1.0"?><info><version>1.0</version></info>'))
+        for stream_id, stream in enumerate(streams, 1):
+            f.write(_xdf_chunk(2, ('<?xml version="1.0"?>' + _xdf_xml("info", stream["info"])).encode(), stream_id))
+        for stream_id, stream in enumerate(streams, 1):
+            time_stamps = stream["time_stamps"]
+            channel_format = stream["info"]["channel_format"][0]
+            for start in range(0, len(time_stamps), chunk_samples):
+                stop = min(start + chunk_samples, len(time_stamps))
+                content = [_xdf_varlen_int(stop - start)]
+                for k in range(start, stop):
+                    content.append(b"\x08" + struct.pack("<d", time_stamps[k]))
+                    if channel_format == "string":
+                        for value in stream["time_series"][k]:
+                            value = str(value).encode()
+                            content.append(_xdf_varlen_int(len(value)) + value)
+                    else:
+                        content.append(np.asarray(stream["time_series"][k], dtype=XDF_VALUE_FORMATS[channel_format]).tobytes())
+                f.write(_xdf_chunk(3, b"".join(content), stream_id))
+            last_time_stamp = time_stamps[-1] if len(time_stamps) else 0.0
+            f.write(_xdf_chunk(4, struct.pack("<dd", last_time_stamp, 0.0), stream_id))
@@ -28,4 +28,207 @@ Feature: XDF Channels To Snirf Measurment List and Probe
       |201     |3332.434|444.333|2200.000|
       |201     |1.113399|222.3  |22224444|
       |201     |777.8866|240.3  |7777.111|
-      |201     |777.8888|222.3  |2200.333|
\ No newline at end of file
+      |201     |777.8888|222.3  |2200.333|
+
+  Scenario: Convert XDF channels containg Frequency Domain data to SNIRF
+      Given xdf channels populated with the following Frequency Domain data
+      |wavelen|fd_frequency|measure        |
+      |735.0  |110000000   |FD_AC_Amplitude|
+      |850.0  |110000000   |FD_Phase       |
+      |735.0  |220000000   |FD_AC_Amplitude|
+      When we convert the channels into snirf measumentLists and probe
+      Then the probe and the measumentLists will contain corresponding Frequency Domain data
+      |datatype|fd_frequency|wavelen|
+      |101     |110000000   |735.0  |
+      |102     |110000000   |850.0  |
+      |101     |220000000   |735.0  |
+
+  Scenario: Attach aux streams to the nirs group of the NIRS stream recorded on the same host
+      Given xdf streams recorded on the following hosts
+      |name|type         |hostname|
+      |DevA|NIRS         |hostA   |
+      |AccB|Accelerometer|hostB   |
+      |DevB|NIRS         |hostB   |
+      |AccA|Accelerometer|hostA   |
+      |Mic |Audio        |hostC   |
+      When we attach the aux streams to the NIRS streams with the hostname rule
+      Then each NIRS stream will have the following aux streams
+      |nirs|aux     |
+      |DevA|AccA,Mic|
+      |DevB|AccB    |
+
+  Scenario: Normalize the optode layout of LUMO streams of any unit serial
+      Given xdf NIRS streams with the following names and optode layouts
+      |name                |layout  |
+      |LUMO HA00030/GA00324|lumo    |
+      |LUMO HA00101/GA00512|lumo    |
+      |Generic NIRS        |standard|
+      When we normalize the streams with the device adapters
+      Then every stream will have optodes with locations and fiducials
+
+  Scenario: Select streams by name or type and NIRS channels by source and wavelength from the stream headers
+      Given xdf stream headers with the following streams
+      |name    |type         |
+      |DevA    |NIRS         |
+      |DevB    |NIRS         |
+      |Accel   |Accelerometer|
+      |Video   |VideoFrames  |
+      When we select the NIRS streams "DevA" and the aux streams "Accel.*" keeping source "S2" at wavelength 850
+      Then the selected streams will be "DevA,Accel" and the NIRS channels kept will be "S2-D1-850,S2-D2-850"
+
+  Scenario: Report the segments, effective rate and clock drift of a stream's time stamps
+      Given a 10 Hz stream of 1000 samples with a 30 second gap after sample 500 and a clock drifting by 20 ppm
+      When we report its timing with a jitter break threshold of 5 samples
+      Then the timing report will show 2 segments, an effective rate of 10 Hz and a clock drift of 20 ppm
+
+  Scenario: Extend the SNIRF file of an XDF recording as it grows
+      Given an XDF recording of 300 samples
+      When we convert it incrementally after 30, 60, 61 and 100 percent of its bytes are written
+      Then every run after the first will resume where the previous one stopped
+      And the SNIRF file will hold the same samples as a conversion of the finished recording
+
+  Scenario: Wait for the NIRS stream header of a growing XDF recording
+      Given an XDF recording of 100 samples
+      And a marker stream that starts before its NIRS stream
+      When we convert it incrementally before and after the NIRS stream header is written
+      Then the first run will write neither the SNIRF file nor its sidecar
+      And the second run will convert the recording from the start
+
+  Scenario: Stream an XDF recording into SNIRF through a small chunk buffer
+      Given an XDF recording of 300 samples from 2 sources and 4 detectors in chunks of 16 samples
+      When we convert it in memory and with --stream and a chunk budget of 4 KiB
+      Then both SNIRF files will hold the same time and dataTimeSeries
+
+  Scenario: Group the events of a marker stream into one stim group per marker value
+      Given an XDF recording of 100 samples
+      And the following markers
+      |onset|value|
+      |1.0  |rest |
+      |2.5  |task |
+      |4.0  |rest |
+      |6.2  |cue  |
+      When we convert it in memory and with --stream and a chunk budget of 64 KiB
+      Then both SNIRF files will have the following stim groups
+      |name|onsets |
+      |cue |6.2    |
+      |rest|1.0,4.0|
+      |task|2.5    |
+
+  Scenario Outline: Load the probe of a known montage from the probe cache
+      Given an XDF recording of 100 samples from 3 sources and 4 detectors
+      When we convert it twice with a probe cache and the <layout> measurement list layout
+      Then the second conversion will load its probe and measurement list from the cache
+      And both SNIRF files will hold the same probe and measurement list
+
+      Examples:
+      |layout|
+      |groups|
+      |arrays|
+
+  Scenario: Evict and invalidate probe cache entries
+      Given a probe cache with room for 2 entries
+      When we store 3 entries one after the other
+      Then the cache will hold the entries 2,3
+      When we invalidate entry 2
+      Then the cache will hold the entries 3
+      When we invalidate the cache
+      Then the cache will hold no entries
+
+  Scenario Outline: Write the measurement list of <variant> data as measurementLists arrays
+      Given an XDF recording of 50 <variant> samples from 2 sources and 3 detectors
+      When we convert it with the groups and with the arrays measurement list layout
+      Then the measurementLists arrays will hold the fields of the measurementList groups
+
+      Examples:
+      |variant|
+      |CW     |
+      |FD     |
+      |TD     |
+      |DCS    |
+
+  Scenario Outline: Append <dtype> blocks of samples across the chunk boundaries of <storage> datasets
+      Given a SNIRF data group stored <storage>
+      When we append <dtype> blocks of 3, 8, 13, 1, 16 and 5 samples of 6 channels
+      Then the datasets will read back the appended samples
+
+      Examples:
+      |storage                         |dtype  |
+      |contiguously                    |float64|
+      |in chunks of 8 rows             |float64|
+      |in chunks of 8 rows             |float32|
+      |in chunks of 8 rows with gzip   |float64|
+      |in chunks of 8 rows with shuffle|float32|
+      |in chunks of 8 rows with float32|float32|
+      |in chunks of 8 rows with float32|float64|
+
+  Scenario: Convert and validate a directory of XDF recordings in a batch
+      Given a directory of 2 XDF recordings
+      When we convert the directory with 2 workers and validate the SNIRF files with the fast tier
+      Then the batch summary will count 2 converted, 0 skipped and 0 failed files
+      And the batch summary will count 2 valid and 0 invalid files validated with the fast tier
+
+  Scenario: Write the time series loaded by pyxdf without copies into contiguous datasets
+      Given an XDF recording of 100 samples
+      When we convert it in memory
+      Then the data group will hold the time stamps and time series loaded by pyxdf in a contiguous dataset
+
+  Scenario Outline: Align the aux streams onto <time base>
+      Given an XDF recording of 100 samples
+      And 2 aux streams at 20 Hz from 1.025 to 4.025 and from 6.025 to 9.475 seconds after the NIRS start
+      When we convert it with the aux streams aligned onto <align_aux>
+      Then the time of every aux group will be a hard link to <linked>
+      And the aux time will hold <samples> samples <interval> seconds apart from the NIRS start
+      And the aux values will be interpolated, NaN before the aux start and across the gap
+
+      Examples:
+      |time base         |align_aux|linked          |samples|interval|
+      |the NIRS time     |nirs     |/nirs/data1/time|100    |0.1     |
+      |a common time base|4        |/nirs/aux1/time |40     |0.25    |
+
+  Scenario: Interpolate a time series starting with repeated time stamps
+      Given a time series with the values 1, 2, 3 and 4 recorded at 0, 0, 1 and 2 seconds
+      When we interpolate it onto 0, 0.5, 1 and 2.5 seconds
+      Then the interpolated values will be 2, 2.5, 3 and NaN
+
+  Scenario Outline: Replay a SNIRF file over LSL at speed <speed>
+      Given an XDF recording of 100 samples
+      When we convert it and replay the SNIRF file over LSL at speed <speed> in chunks of 16 samples
+      Then an inlet will receive every sample, time stamped <time scale> times the recorded time apart
+      And the replay will take at least <seconds> seconds
+
+      Examples:
+      |speed|time scale|seconds|
+      |0    |1         |0      |
+      |20   |0.05      |0.49   |
+
+  Scenario: Replay the streams of an XDF file over LSL on a shared clock
+      Given an XDF recording of 100 samples
+      And an aux stream of 40 samples at 20 Hz starting 2.5 seconds after the NIRS start
+      When we replay the XDF file over LSL at speed 0
+      Then the inlets will receive every sample of each stream with the recorded offsets between the streams
+
+  Scenario: Read the time series of a SNIRF file in slabs on a background thread
+      Given an XDF recording of 100 samples
+      When we convert it and read its data group in slabs of 32 rows, 2 slabs ahead
+      Then the slabs will hold 32, 32, 32 and 4 rows of the time and dataTimeSeries datasets
+      And the reader thread will stop at the end of the file
+
+  Scenario: Convert values between units
+      When we convert the following values
+      |unit|target|value     |passed as|result          |
+      |ps  |s     |0         |number   |0               |
+      |ps  |s     |          |string   |None            |
+      |ns  |ps    |2.5       |string   |2500            |
+      |mW  |W     |0         |string   |0               |
+      |mm  |m     |1, 20, 300|list     |0.001, 0.02, 0.3|
+      |GHz |MHz   |0.11, 0.22|array    |110, 220        |
+      Then every value will be converted to its result
+
+  Scenario: Convert SI prefixes without astropy
+      When we compute the conversion factors between every SI prefix of m, s, Hz and W
+      Then they will equal the conversion factors of astropy
+
+  Scenario: Record a live NIRS LSL stream into a SNIRF file
+      Given an XDF recording of 100 samples
+      When we convert it, replay it over LSL at speed 0 and record the stream for 2 seconds
+      Then the recorded SNIRF file will hold every replayed sample with its time from the first sample
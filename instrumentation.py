@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+import contextlib
+from utils import lookup_diagnostics
+
+
+def current_rss_bytes():
+    """
+    :return: The resident set size of this process in bytes, or its peak where the current size is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Instrumentation():
+    """
+    Collects the wall time, peak RSS and get lookups of each stage of a conversion, with optional cProfile and
+    tracemalloc capture of selected stages. Stages are named blocks wrapped in `with instrumentation.Stage(name):`,
+    which cost nothing while the instrumentation is disabled. A stage entered several times (e.g. once per nirs
+    group) accumulates its time and call count.
+    """
+    def __init__(self):
+        self.enabled = False #Whether stages are recorded.
+        self.profile_stages = set() #Stages captured with cProfile.
+        self.trace_stages = set() #Stages captured with tracemalloc.
+        self.sample_interval = 0.01 #Seconds between RSS samples.
+        self.Reset()
+
+    def Enable(self, profile_stages = (), trace_stages = (), sample_interval = 0.01):
+        """
+        Start recording stages.
+
+        :param profile_stages: Names of the stages to profile with cProfile, or ["all"].
+        :param trace_stages: Names of the stages to trace with tracemalloc, or ["all"].
+        :param sample_interval: Seconds between RSS samples taken in a background thread.
+        """
+        self.enabled = True
+        self.profile_stages = set(profile_stages)
+        self.trace_stages = set(trace_stages)
+        self.sample_interval = sample_interval
+        self.Reset()
+
+    def Reset(self):
+        self.stages = {} #Records of the stages, in the order they were first entered.
+        self.lock = threading.Lock()
+        self.active_peaks = {} #Peak RSS sampled during each running stage, indexed by a token per entry.
+        self.profiling = False #Whether a cProfile capture is running; captures are not nested.
+        self.start_time = time.perf_counter()
+        self.start_calls, self.start_misses = lookup_diagnostics.Counts()
+        self.sampler = None
+
+    def Wants(self, selected, name):
+        return "all" in selected or name in selected
+
+    def SampleRss(self):
+        """
+        Sample the RSS into the peaks of the running stages until no stage is running.
+        """
+        while True:
+            with self.lock:
+                if not self.active_peaks:
+                    self.sampler = None
+                    return
+                rss = current_rss_bytes()
+                for token in self.active_peaks:
+                    self.active_peaks[token] = max(self.active_peaks[token], rss)
+            time.sleep(self.sample_interval)
+
+    @contextlib.contextmanager
+    def Stage(self, name):
+        """
+        Record the block as the stage `name`.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        token = object()
+        with self.lock:
+            self.active_peaks[token] = current_rss_bytes()
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.SampleRss, daemon=True)
+                self.sampler.start()
+        profiler = None
+        if self.Wants(self.profile_stages, name) and not self.profiling:
+            self.profiling = True
+            profiler = cProfile.Profile()
+        tracing = self.Wants(self.trace_stages, name)
+        started_tracing = tracing and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if tracing:
+            tracemalloc.reset_peak()
+        calls, misses = lookup_diagnostics.Counts()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+            seconds = time.perf_counter() - start
+            traced = None
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                traced = {"peak_mb": tracemalloc.get_traced_memory()[1] / 2**20,
+                          "top_allocations": [{"location": str(stat.traceback), "size_mb": stat.size / 2**20, "count": stat.count}
+                                              for stat in snapshot.statistics("lineno")[:10]]}
+                if started_tracing:
+                    tracemalloc.stop()
+            with self.lock:
+                peak = max(self.active_peaks.pop(token), current_rss_bytes())
+                record = self.stages.setdefault(name, {"seconds": 0.0, "count": 0, "peak_rss_mb": 0.0, "get_calls": 0, "get_misses": 0})
+                record["seconds"] += seconds
+                record["count"] += 1
+                record["peak_rss_mb"] = max(record["peak_rss_mb"], peak / 2**20)
+                end_calls, end_misses = lookup_diagnostics.Counts()
+                record["get_calls"] += end_calls - calls
+                record["get_misses"] += end_misses - misses
+                if traced is not None:
+                    record["tracemalloc"] = traced
+                if profiler is not None:
+                    record["profile"] = profile_summary(profiler)
+
+    def Report(self):
+        """
+        :return: A JSON serializable dictionary with the record of every stage, the total wall time, the peak RSS
+        of the process and the get lookups made since the instrumentation was enabled.
+        """
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        calls, misses = lookup_diagnostics.Counts()
+        return {"stages": self.stages,
+                "total_seconds": time.perf_counter() - self.start_time,
+                "peak_rss_mb": peak / 2**20 if sys.platform == "darwin" else peak / 2**10,
+                "get_calls": calls - self.start_calls,
+                "get_misses": misses - self.start_misses,
+                "missed_paths": lookup_diagnostics.MissedPaths()}
+
+    def WriteJson(self, path):
+        with open(path, "w") as json_file:
+            json.dump(self.Report(), json_file, indent=2)
+
+
+def profile_summary(profiler, limit = 25):
+    """
+    :return: The `limit` functions of a cProfile capture with the largest cumulative time.
+    """
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls,
+                     "tottime": tottime, "cumtime": cumtime})
+    return sorted(rows, key=lambda row: row["cumtime"], reverse=True)[:limit]
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,147 @@
+"""
+Records a live NIRS LSL stream straight into a SNIRF file.
+"""
+import time
+import argparse
+import numpy
+import h5py
+import pylsl
+import snirf
+from xml.etree.ElementTree import fromstring
+from pyxdf.pyxdf import _xml2dict
+from utils import get
+from xdf_reader import header_only_stream
+from snirf_writer import SnirfTimeSeriesWriter
+import XDF_TO_SNIRF
+
+
+def resolve_nirs_inlet(name = None, timeout = 10.0):
+    """
+    Resolve a NIRS stream on the network and open an inlet to it.
+
+    :param name: Optional name of the stream. The first stream of type NIRS is used if None.
+    :param timeout: Seconds to wait for the stream to appear.
+    :return: A pylsl.StreamInlet with clock synchronization enabled.
+    """
+    if name is None:
+        stream_infos = pylsl.resolve_byprop("type", "NIRS", timeout=timeout)
+    else:
+        stream_infos = pylsl.resolve_byprop("name", name, timeout=timeout)
+    if not stream_infos:
+        raise RuntimeError(f"no NIRS stream {'named ' + repr(name) + ' ' if name else ''}found within {timeout}s")
+    return pylsl.StreamInlet(stream_infos[0], processing_flags=pylsl.proc_clocksync)
+
+
+def stream_header_from_inlet(inlet: pylsl.StreamInlet, timeout = 10.0):
+    """
+    Read the full stream info of an inlet, including desc(), as a stream header formatted like those of pyxdf.
+
+    :param inlet: The LSL inlet.
+    :param timeout: Seconds to wait for the stream info.
+    :return: A dictionary with an "info" key, as returned by XdfChunkReader.ReadHeaders.
+    """
+    return _xml2dict(fromstring(inlet.info(timeout).as_xml()))
+
+
+class LslToSnirfRecorder():
+    """
+    Records a live NIRS LSL stream into a SNIRF file, appending pulled chunks to the data group and flushing
+    the file periodically.
+    """
+    def __init__(self, path_to_snirf, inlet: pylsl.StreamInlet, flush_interval = 1.0, max_chunk = 1024):
+        """
+        Initialize the class, convert the stream's metadata and create the SNIRF file with an empty time series.
+
+        :param path_to_snirf: Path to save the SNIRF file.
+        :param inlet: The inlet of the NIRS stream to record.
+        :param flush_interval: Seconds between writes of the pulled samples to disk.
+        :param max_chunk: Maximum number of samples pulled at once.
+        """
+        self.path_to_snirf = path_to_snirf #Store the SNIRF file path.
+        self.inlet = inlet #Store the LSL inlet.
+        self.flush_interval = flush_interval #Store the time between flushes.
+        self.max_chunk = max_chunk #Store the maximum chunk size.
+
+        #Convert the metadata exactly as for an XDF stream and save the SNIRF file with an empty time series.
+        self.stream_header = stream_header_from_inlet(inlet)
+        self.channel_count = int(get(self.stream_header, "info.channel_count"))
+        xdf_nirs_stream = header_only_stream(self.stream_header, self.channel_count)
+        snirf_file = snirf.Snirf(path_to_snirf)
+        snirf_file.formatVersion = 1.1
+        snirf_file.nirs = XDF_TO_SNIRF.XdfToSnirfNirs([xdf_nirs_stream], None, snirf_file).nirs
+        snirf_file.save()
+        snirf_file.close()
+
+        self.h5_file = h5py.File(path_to_snirf, "r+")
+        self.writer = SnirfTimeSeriesWriter(self.h5_file, "/nirs/data1", self.channel_count)
+        self.h5_file.flush()
+
+    def Record(self, duration = None):
+        """
+        Pull samples until the duration has elapsed or the recording is interrupted with Ctrl+C.
+
+        :param duration: Seconds to record for. Records until interrupted if None.
+        :return: The number of samples written.
+        """
+        self.inlet.open_stream()
+        start = time.monotonic()
+        next_flush = start + self.flush_interval
+        stamps_buffer, values_buffer = [], []
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                values, stamps = self.inlet.pull_chunk(timeout=min(self.flush_interval, 0.5), max_samples=self.max_chunk)
+                if stamps:
+                    stamps_buffer.append(numpy.asarray(stamps))
+                    values_buffer.append(numpy.asarray(values))
+                if time.monotonic() >= next_flush:
+                    self.Flush(stamps_buffer, values_buffer)
+                    stamps_buffer, values_buffer = [], []
+                    next_flush = time.monotonic() + self.flush_interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.Flush(stamps_buffer, values_buffer)
+        return self.writer.samples_written
+
+    def Flush(self, stamps_buffer, values_buffer):
+        """
+        Append the buffered chunks to the SNIRF file and flush it to disk.
+
+        :param stamps_buffer: A list of 1D time stamp arrays.
+        :param values_buffer: A list of [#Samples x #Channels] arrays, one per time stamp array.
+        """
+        if stamps_buffer:
+            self.writer.Append(numpy.concatenate(stamps_buffer), numpy.concatenate(values_buffer))
+        self.h5_file.flush()
+
+    def Close(self):
+        """
+        Close the inlet and the SNIRF file.
+        """
+        self.inlet.close_stream()
+        self.h5_file.close()
+
+
+if __name__ == "__main__":
+    """
+    Command-line interface for recording a live NIRS LSL stream to SNIRF.
+    """
+    parser = argparse.ArgumentParser("LSL to SNIRF Recorder",
+    """This program records a live NIRS LSL stream into a SNIRF file.""")
+    parser.add_argument("save_snirf_path", help="Path to save the output SNIRF file.")
+    parser.add_argument("--name", help="Name of the LSL stream to record. Defaults to the first stream of type NIRS.")
+    parser.add_argument("--duration", help="Seconds to record for. Records until Ctrl+C if not given.", type=float)
+    parser.add_argument("--flush-interval", help="Seconds between writes to disk", type=float, default=1.0)
+    parser.add_argument("--resolve-timeout", help="Seconds to wait for the stream to appear", type=float, default=10.0)
+    parser.add_argument("-v", help="validate the created SNIRF file", action="store_true")
+    args = parser.parse_args()
+
+    XDF_TO_SNIRF.backup_existing_snirf(args.save_snirf_path)
+    recorder = LslToSnirfRecorder(args.save_snirf_path, resolve_nirs_inlet(args.name, args.resolve_timeout), args.flush_interval)
+    print(f"recording {get(recorder.stream_header, 'info.name')} to {args.save_snirf_path}")
+    samples = recorder.Record(args.duration)
+    recorder.Close()
+    print(f"recorded {samples} samples")
+
+    if args.v:
+        XDF_TO_SNIRF.validate_snirf_file(args.save_snirf_path)
@@ -0,0 +1,33 @@
+import numpy
+from utils import get
+
+
+def is_marker_stream(xdf_stream):
+    """
+    :param xdf_stream: An XDF stream or stream header.
+    :return: True if the stream carries string markers (e.g. event labels) rather than numeric samples.
+    """
+    return get(xdf_stream, "info.channel_format", report=False) == "string"
+
+
+def group_markers(time_stamps, time_series, time_origin = 0):
+    """
+    Group markers by value into SNIRF stim data, with a single numpy.unique pass over all events.
+
+    :param time_stamps: A 1D array of marker time stamps.
+    :param time_series: The marker values, one row per time stamp. The first channel holds the marker value.
+    :param time_origin: Time stamp the onsets are relative to, usually the first NIRS time stamp.
+    :return: A list of (name, data) tuples, one per distinct marker value in sorted order, where data is a
+    [#Events x 3] array of [onset, duration, amplitude] rows with zero duration and unit amplitude.
+    """
+    time_stamps = numpy.asarray(time_stamps, dtype=numpy.float64)
+    if len(time_stamps) == 0:
+        return []
+    values = numpy.asarray(time_series, dtype=object).reshape(len(time_stamps), -1)[:, 0].astype(str)
+    names, inverse = numpy.unique(values, return_inverse=True)
+
+    data = numpy.column_stack([time_stamps - time_origin, numpy.zeros(len(time_stamps)), numpy.ones(len(time_stamps))])
+    #Sort the events by marker value, keeping them in time order within each value, then split per value.
+    order = numpy.lexsort((time_stamps, inverse))
+    counts = numpy.bincount(inverse, minlength=len(names))
+    return list(zip(names.tolist(), numpy.split(data[order], numpy.cumsum(counts)[:-1])))
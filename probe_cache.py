@@ -0,0 +1,142 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import snirf
+from utils import get
+
+CACHE_VERSION = 1 #Bump when the cached form changes, so older entries are no longer matched.
+
+PROBE_FIELDS = ["wavelengths", "wavelengthsEmission", "sourcePos2D", "sourcePos3D", "detectorPos2D", "detectorPos3D",
+                "frequencies", "timeDelays", "timeDelayWidths", "momentOrders", "correlationTimeDelays",
+                "correlationTimeDelayWidths", "sourceLabels", "detectorLabels", "landmarkPos2D", "landmarkPos3D", "landmarkLabels"]
+
+MEASUREMENT_LIST_FIELDS = ["sourceIndex", "detectorIndex", "wavelengthIndex", "wavelengthActual", "wavelengthEmissionActual",
+                           "dataType", "dataUnit", "dataTypeLabel", "dataTypeIndex", "sourcePower", "detectorGain"]
+
+
+class ProbeCache():
+    """
+    An on-disk cache of converted probes and measurement lists, keyed by a hash of the NIRS stream's info.desc.
+    Recordings made with the same montage share an entry, so their metadata is only converted once.
+    Entries are stored column by column (one list per field) and evicted least recently used first once the
+    cache grows beyond its size limit.
+    """
+    def __init__(self, cache_dir, max_bytes = 256 * 2**20):
+        """
+        Initialize the class with the directory holding the cache.
+
+        :param cache_dir: Directory of the cache, created if missing.
+        :param max_bytes: Size above which the least recently used entries are evicted.
+        """
+        self.cache_dir = cache_dir #Store the cache directory.
+        self.max_bytes = max_bytes #Store the size limit of the cache.
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def Key(self, xdf_nirs_stream):
+        """
+        :param xdf_nirs_stream: The XDF NIRS stream.
+        :return: The hex digest identifying the stream's channel, optode and fiducial metadata.
+        """
+        desc = json.dumps(get(xdf_nirs_stream, "info.desc"), sort_keys=True, default=str)
+        return hashlib.sha256(f"{CACHE_VERSION}:{desc}".encode()).hexdigest()
+
+    def Path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def Load(self, key, snirf_file, columns = False):
+        """
+        Load a cached probe and measurement list.
+
+        :param key: The key returned by Key.
+        :param snirf_file: The target SNIRF file the measurement list will be added to.
+        :param columns: Return the measurement list as the cached columns, for the measurementLists arrays layout.
+        :return: A (probe, measurementList) tuple of pysnirf2 objects, or (probe, columns) with columns, or None if
+        the key is not cached.
+        """
+        path = self.Path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(path) #Mark the entry as recently used.
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        probe = snirf.Probe("", conf)
+        for field, value in entry["probe"].items():
+            setattr(probe, field, value)
+
+        if columns:
+            return probe, entry["measurementList"]
+        measurement_list = snirf.MeasurementList(snirf_file, conf)
+        columns = entry["measurementList"]
+        for i in range(entry["channel_count"]):
+            element = snirf.MeasurementListElement("", conf)
+            for field, values in columns.items():
+                setattr(element, field, values[i])
+            measurement_list.append(element)
+        return probe, measurement_list
+
+    def Store(self, key, probe: snirf.Probe, measurement_list: snirf.MeasurementList):
+        """
+        Store a converted probe and measurement list, then evict entries if the cache is over its size limit.
+
+        :param key: The key returned by Key.
+        :param probe: The converted pysnirf2 probe.
+        :param measurement_list: The converted pysnirf2 measurement list, or its columns (see XdfToSnirfMeasurementLists).
+        """
+        if isinstance(measurement_list, dict):
+            columns = {field: list(measurement_list[field]) for field in MEASUREMENT_LIST_FIELDS}
+        else:
+            columns = {field: [getattr(element, field) for element in measurement_list] for field in MEASUREMENT_LIST_FIELDS}
+        entry = {"probe": {}, "measurementList": columns, "channel_count": len(columns["sourceIndex"])}
+        for field in PROBE_FIELDS:
+            value = getattr(probe, field)
+            if value is not None:
+                entry["probe"][field] = value
+
+        #Write to a temporary file first, so concurrent conversions never read a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.Path(key))
+        self.Evict()
+
+    def Evict(self):
+        """
+        Remove the least recently used entries until the cache is within its size limit.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def Invalidate(self, key = None):
+        """
+        Remove one entry, or every entry if no key is given.
+
+        :param key: The key of the entry to remove.
+        """
+        names = [key + ".pkl"] if key else [name for name in os.listdir(self.cache_dir) if name.endswith((".pkl", ".tmp"))]
+        for name in names:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+conf = snirf.SnirfConfig()
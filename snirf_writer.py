@@ -0,0 +1,228 @@
+import h5py
+import numpy
+
+TIME_CHUNK_BYTES = 2**16 #Target size of the chunks of the resizable "time" datasets.
+
+
+class SnirfStorage():
+    """
+    HDF5 storage options of the dataTimeSeries datasets: chunk shape, compression filters and dtype.
+    """
+    def __init__(self, chunk_rows = None, chunk_channels = None, compression = None, compression_level = None, shuffle = False, float32 = False):
+        """
+        :param chunk_rows: Number of samples per HDF5 chunk. Defaults to chunks of roughly 1 MiB.
+        :param chunk_channels: Number of channels per HDF5 chunk. Defaults to all channels.
+        :param compression: HDF5 compression filter, "gzip", "lzf" or None.
+        :param compression_level: gzip level from 0 to 9.
+        :param shuffle: Apply the byte shuffle filter before compression, which helps on slowly varying signals.
+        :param float32: Store float32 sources as float32 instead of float64.
+        """
+        self.chunk_rows = chunk_rows #Store the number of samples per chunk.
+        self.chunk_channels = chunk_channels #Store the number of channels per chunk.
+        self.compression = compression #Store the compression filter.
+        self.compression_level = compression_level #Store the gzip level.
+        self.shuffle = shuffle #Store whether to shuffle bytes.
+        self.float32 = float32 #Store whether float32 sources are stored as float32.
+
+    def Dtype(self, channel_format):
+        """
+        :param channel_format: The channel_format of the XDF stream, e.g. "float32" or "double64".
+        :return: The dtype to store the stream's dataTimeSeries with.
+        """
+        return numpy.float32 if self.float32 and channel_format == "float32" else numpy.float64
+
+    def Chunked(self):
+        """
+        :return: Whether the options need a chunked dataset: an explicit chunk shape or a filter.
+        """
+        return bool(self.chunk_rows or self.chunk_channels or self.compression or self.shuffle)
+
+    def DatasetOptions(self, channel_count, dtype, sample_count = None):
+        """
+        :param channel_count: Number of channels (columns) of the time series.
+        :param dtype: Storage dtype of the dataTimeSeries dataset.
+        :param sample_count: Number of samples of the whole time series if known, which caps the chunk rows.
+        :return: The keyword arguments of h5py's create_dataset for the dataTimeSeries dataset.
+        """
+        chunk_channels = min(self.chunk_channels or channel_count, max(channel_count, 1))
+        chunk_rows = self.chunk_rows or max(1, 2**20 // (max(chunk_channels, 1) * numpy.dtype(dtype).itemsize))
+        if sample_count is not None:
+            chunk_rows = max(1, min(chunk_rows, sample_count))
+        return {"chunks": (chunk_rows, max(chunk_channels, 1)), "compression": self.compression,
+                "compression_opts": self.compression_level if self.compression == "gzip" else None,
+                "shuffle": self.shuffle}
+
+
+class SnirfTimeSeriesWriter():
+    """
+    Appends samples to the "time" and "dataTimeSeries" datasets of a data or aux group in a SNIRF file.
+    The datasets are replaced with chunked, resizable HDF5 datasets so the recording can be written
+    in pieces without ever being held in memory as a whole. When the number of samples is known up front,
+    they are created with their final shape instead, contiguous unless the storage options need chunks.
+    """
+    def __init__(self, h5_file: h5py.File, group_path, channel_count, time_offset = None, dtype = numpy.float64, chunk_rows = None,
+                 storage: SnirfStorage = None, resume = False, sample_count = None):
+        """
+        Initialize the class with an opened SNIRF file and the group to write to.
+
+        :param h5_file: The SNIRF file opened with h5py in "r+" mode.
+        :param group_path: Path of the group holding the datasets, e.g. "/nirs/data1" or "/nirs/aux1".
+        :param channel_count: Number of channels (columns) of the time series.
+        :param time_offset: Time subtracted from every time stamp. Defaults to the first time stamp written.
+        :param dtype: Storage dtype of the dataTimeSeries dataset.
+        :param chunk_rows: Number of samples per HDF5 chunk. Defaults to chunks of roughly 1 MiB.
+        :param storage: Optional SnirfStorage with the chunk shape and filters of the dataTimeSeries dataset.
+        :param resume: Append after the samples of the resizable datasets written by an earlier writer, keeping their
+        dtype, chunks and filters, instead of replacing them. Pass that writer's time offset.
+        :param sample_count: Number of samples of the whole time series, when known before writing.
+        """
+        self.group = h5_file[group_path] #Store the group holding the datasets.
+        self.group_path = group_path #Store the path of the group.
+        self.channel_count = channel_count #Store the number of channels.
+        self.time_offset = time_offset #Store the time offset, set from the first time stamp if None.
+        self.samples_written = 0 #Number of samples written so far.
+
+        if resume and "time" in self.group and self.group["time"].maxshape[0] is None:
+            self.time = self.group["time"]
+            self.dataTimeSeries = self.group["dataTimeSeries"]
+            self.samples_written = len(self.time)
+            options = {"chunks": self.dataTimeSeries.chunks, "compression": self.dataTimeSeries.compression,
+                       "shuffle": self.dataTimeSeries.shuffle}
+        else:
+            if storage is None:
+                storage = SnirfStorage(chunk_rows)
+            for name in ["time", "dataTimeSeries"]:
+                if name in self.group:
+                    del self.group[name]
+
+            if sample_count is not None and not storage.Chunked():
+                #The whole time series is known, so it is stored contiguously, without any chunk padding.
+                options = {"chunks": None, "compression": None, "shuffle": False}
+                self.time = self.group.create_dataset("time", shape=(sample_count,), dtype=numpy.float64)
+                self.dataTimeSeries = self.group.create_dataset("dataTimeSeries", shape=(sample_count, channel_count), dtype=dtype)
+            else:
+                #Replace any existing datasets with resizable ones.
+                options = storage.DatasetOptions(channel_count, dtype, sample_count)
+                time_chunk_rows = TIME_CHUNK_BYTES // numpy.dtype(numpy.float64).itemsize
+                if sample_count is not None:
+                    time_chunk_rows = max(1, min(time_chunk_rows, sample_count))
+                self.time = self.group.create_dataset("time", shape=(0,), maxshape=(None,), dtype=numpy.float64, chunks=(time_chunk_rows,))
+                self.dataTimeSeries = self.group.create_dataset("dataTimeSeries", shape=(0, channel_count), maxshape=(None, channel_count),
+                                                                dtype=dtype, **options)
+        #Unfiltered chunks spanning every channel hold exactly the bytes of a block of rows, so they can be written as is.
+        self.chunk_rows = options["chunks"][0] if options["chunks"] and not options["compression"] and not options["shuffle"] \
+                          and options["chunks"][1] == channel_count else None
+
+    def Append(self, time_stamps, time_series, in_place = False):
+        """
+        Append a block of samples to the end of the datasets.
+
+        :param time_stamps: A 1D array of time stamps, one per sample.
+        :param time_series: A [#Samples x #Channels] array of values.
+        :param in_place: Subtract the time offset from time_stamps in place rather than from a copy. Only pass
+        True for a writable float64 array the caller no longer needs.
+        """
+        sample_count = len(time_stamps)
+        if sample_count == 0:
+            return
+        if self.time_offset is None:
+            self.time_offset = time_stamps[0]
+        start, stop = self.samples_written, self.samples_written + sample_count
+        if self.time.shape[0] < stop:
+            self.time.resize((stop,))
+            self.dataTimeSeries.resize((stop, self.channel_count))
+        time_stamps = numpy.asarray(time_stamps, dtype=numpy.float64)
+        if self.time_offset:
+            time_stamps = numpy.subtract(time_stamps, self.time_offset, out=time_stamps if in_place else None)
+        self.time.write_direct(numpy.ascontiguousarray(time_stamps), dest_sel=numpy.s_[start:stop])
+        self.WriteValues(start, time_series)
+        self.samples_written = stop
+
+    def WriteValues(self, start, time_series):
+        """
+        Write a block of values at row `start` of dataTimeSeries without copying them when their dtype matches the
+        dataset's: whole chunks are written straight to the file, bypassing the HDF5 pipeline, and the rows before
+        and after them are written directly from the array. Other dtypes are converted by HDF5 while writing.
+        """
+        values = numpy.asarray(time_series)
+        stop = start + len(values)
+        if values.dtype != self.dataTimeSeries.dtype or values.ndim != 2 or not values.flags.c_contiguous:
+            self.dataTimeSeries[start:stop] = values
+            return
+        if self.chunk_rows is None:
+            self.dataTimeSeries.write_direct(values, dest_sel=numpy.s_[start:stop])
+            return
+
+        #Rows up to the first chunk boundary, then whole chunks, then the remaining rows.
+        first = min(stop, -(-start // self.chunk_rows) * self.chunk_rows)
+        last = max(first, stop // self.chunk_rows * self.chunk_rows)
+        if first > start:
+            self.dataTimeSeries.write_direct(values, numpy.s_[:first - start], numpy.s_[start:first])
+        for row in range(first, last, self.chunk_rows):
+            self.dataTimeSeries.id.write_direct_chunk((row, 0), values[row - start:row - start + self.chunk_rows])
+        if stop > last:
+            self.dataTimeSeries.write_direct(values, numpy.s_[last - start:], numpy.s_[last:stop])
+
+
+class SnirfChunkBuffer():
+    """
+    Buffers incoming sample chunks for several writers and flushes them once a memory budget is reached.
+    Writing a few large blocks is much cheaper for HDF5 than writing every small XDF chunk separately.
+    """
+    def __init__(self, budget_bytes):
+        """
+        Initialize the class with the memory budget for buffered samples.
+
+        :param budget_bytes: Number of bytes of buffered samples above which all buffers are flushed.
+        """
+        self.budget_bytes = budget_bytes #Store the memory budget.
+        self.buffered_bytes = 0 #Number of bytes currently buffered.
+        self.buffers = {} #Buffered (time_stamps, time_series) chunks indexed by writer.
+
+    def Add(self, writer: SnirfTimeSeriesWriter, time_stamps, time_series):
+        """
+        Buffer a chunk of samples for a writer, flushing all buffers if the budget is exceeded.
+
+        :param writer: The writer the samples belong to.
+        :param time_stamps: A 1D array of time stamps, one per sample.
+        :param time_series: A [#Samples x #Channels] array of values.
+        """
+        self.buffers.setdefault(writer, []).append((time_stamps, time_series))
+        self.buffered_bytes += time_stamps.nbytes + time_series.nbytes
+        if self.buffered_bytes >= self.budget_bytes:
+            self.Flush()
+
+    def Flush(self):
+        """
+        Write all buffered chunks to their writers and release the buffers.
+        """
+        for writer, chunks in self.buffers.items():
+            #The concatenated time stamps are a fresh array, so the time offset is subtracted in place.
+            writer.Append(numpy.concatenate([stamps for stamps, _ in chunks]).astype(numpy.float64, copy=False),
+                          numpy.concatenate([values for _, values in chunks]), in_place=True)
+        self.buffers = {}
+        self.buffered_bytes = 0
+
+
+def write_stim_groups(nirs_group: h5py.Group, stims, append = False):
+    """
+    Write stim groups to a nirs group of a SNIRF file opened with h5py, replacing any existing ones.
+
+    :param nirs_group: The nirs group, e.g. h5_file["/nirs"].
+    :param stims: A list of (name, data) tuples as returned by markers.group_markers.
+    :param append: Add the events after those of the existing stim groups of the same name instead of replacing them.
+    """
+    if append:
+        merged = {}
+        for name in [name for name in nirs_group if name.startswith("stim") and "name" in nirs_group[name]]:
+            data = nirs_group[name]["data"][()]
+            merged[nirs_group[name]["name"].asstr()[()]] = data if data.ndim == 2 else data.reshape(-1, 3)
+        for name, data in stims:
+            merged[name] = numpy.concatenate([merged[name], data]) if name in merged else data
+        stims = sorted(merged.items())
+    for name in [name for name in nirs_group if name.startswith("stim")]:
+        del nirs_group[name]
+    for i, (name, data) in enumerate(stims):
+        stim_group = nirs_group.create_group(f"stim{i + 1}")
+        stim_group.create_dataset("name", data=name, dtype=h5py.string_dtype(encoding="ascii"))
+        stim_group.create_dataset("data", data=numpy.asarray(data, dtype=numpy.float64))
@@ -1,20 +1,142 @@
 import snirf
 import pylsl
 import utils
+import numpy
+import h5py
+import queue
+import threading
+import argparse
 import time as t
 
 
+class ReplayStats:
+    """
+    Timing of a replay: the sample rate achieved against the rate requested, and how late chunks were sent
+    relative to their schedule.
+    """
+    def __init__(self, samples, recorded_duration, speed, elapsed, lateness):
+        """
+        :param samples: Number of samples sent.
+        :param recorded_duration: Duration of the recording in seconds, from the first to the last time stamp.
+        :param speed: Replay speed multiplier, 0 for as fast as possible.
+        :param elapsed: Wall time of the replay in seconds.
+        :param lateness: Seconds each chunk was sent after its scheduled time.
+        """
+        self.samples = samples
+        self.recorded_rate = (samples - 1) / recorded_duration if recorded_duration > 0 else 0.0
+        self.target_rate = self.recorded_rate * speed if speed else float("inf")
+        self.achieved_rate = (samples - 1) / elapsed if elapsed > 0 else float("inf")
+        self.elapsed = elapsed
+        self.jitter = float(numpy.std(lateness)) if len(lateness) else 0.0
+        self.max_lateness = float(numpy.max(lateness)) if len(lateness) else 0.0
+
+    def Report(self):
+        return (f"sent {self.samples} samples in {self.elapsed:.3f}s: {self.achieved_rate:.2f} Hz achieved, "
+                f"{self.target_rate:.2f} Hz target ({self.recorded_rate:.2f} Hz recorded), "
+                f"jitter {self.jitter * 1000:.3f} ms, max lateness {self.max_lateness * 1000:.3f} ms")
+
+
+class SnirfSlabReader:
+    """
+    Reads the time and dataTimeSeries datasets of a SNIRF data group in row slabs on a background thread.
+    At most read_ahead slabs are held in memory, however long the recording is.
+    """
+    def __init__(self, h5_group: h5py.Group, slab_rows = 1024, read_ahead = 4):
+        """
+        :param h5_group: The HDF5 data group holding the "time" and "dataTimeSeries" datasets.
+        :param slab_rows: Number of samples read per slab.
+        :param read_ahead: Number of slabs read ahead of the consumer.
+        """
+        self.time: h5py.Dataset = h5_group["time"]
+        self.dataTimeSeries: h5py.Dataset = h5_group["dataTimeSeries"]
+        self.slab_rows = slab_rows
+        self.slabs = queue.Queue(read_ahead)
+        self.thread = threading.Thread(target=self.ReadSlabs, daemon=True)
+        self.thread.start()
+
+    def ReadSlabs(self):
+        try:
+            for i in range(0, len(self.time), self.slab_rows):
+                j = min(i + self.slab_rows, len(self.time))
+                self.slabs.put((self.time[i:j], self.dataTimeSeries[i:j]))
+        except Exception as e:
+            self.slabs.put(e)
+        self.slabs.put(None)
+
+    def __iter__(self):
+        """
+        :return: A generator yielding (time, dataTimeSeries) slabs in order.
+        """
+        while True:
+            slab = self.slabs.get()
+            if slab is None:
+                return
+            if isinstance(slab, Exception):
+                raise slab
+            yield slab
+
 
 class SnirfStreamer:
-    def __init__(self, snirf_file : snirf.Snirf):
+    def __init__(self, snirf_file : snirf.Snirf, chunk_size = 32, speed = 1.0, slab_rows = 1024, read_ahead = 4, wait_for_consumers = 0):
+        """
+        Stream the first data element of a SNIRF file over LSL, paced by its recorded time vector.
+        The time series is read lazily from the HDF5 file in slabs, so load the SNIRF file with dynamic_loading=True
+        to keep it from being read into memory by pysnirf2.
+
+        :param snirf_file: The SNIRF file to stream.
+        :param chunk_size: Number of samples sent per push_chunk.
+        :param speed: Replay speed multiplier, e.g. 1 for real time or 10 for ten times faster. 0 sends as fast as possible.
+        :param slab_rows: Number of samples read from the file at a time, rounded up to a multiple of chunk_size.
+        :param read_ahead: Number of slabs read ahead on a background thread.
+        :param wait_for_consumers: Seconds to wait for an inlet to connect before sending, and to disconnect after, as
+        samples still queued in the outlet are lost when it closes. 0 to send straight away and close once sent.
+        """
         self.snirf_file = snirf_file
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.slab_rows = -(-slab_rows // chunk_size) * chunk_size
+        self.read_ahead = read_ahead
+        self.wait_for_consumers = wait_for_consumers
         #self.resulut = self.snirf_file.validate()
         self.snirf_probe: snirf.Probe = snirf_file.nirs[0].probe
         self.snirf_meta_data: snirf.MetaDataTags = snirf_file.nirs[0].metaDataTags
-        self.snirf_measurement_list: snirf.MeasurementList = snirf_file.nirs[0].data[0].measurementList
-        self.stream_info: pylsl.StreamInfo = pylsl.stream_info("SNIRF_DATA", "NIRS", len(self.snirf_measurement_list))
+        self.snirf_data: snirf.DataElement = snirf_file.nirs[0].data[0]
+        self.snirf_measurement_list: snirf.MeasurementList = self.snirf_data.measurementList
+        #Open the data group directly, so the time series can be read in slabs.
+        self.h5_file = h5py.File(self.snirf_data.filename, "r")
+        self.h5_data: h5py.Group = self.h5_file[self.snirf_data.location]
+        self.stream_info: pylsl.StreamInfo = pylsl.StreamInfo("SNIRF_DATA", "NIRS", len(self.snirf_measurement_list), self.NominalRate())
+        self.ConvertProbeUnits()
         self.PopulateStreamInfo()
-        self.StreamOverLSL()
+        self.replay_stats = self.StreamOverLSL()
+        self.h5_file.close()
+
+    def NominalRate(self):
+        time = self.h5_data["time"]
+        if len(time) > 1 and time[-1] > time[0]:
+            return (len(time) - 1) / (time[-1] - time[0])
+        return pylsl.IRREGULAR_RATE
+
+    def ConvertProbeUnits(self):
+        """
+        Convert the probe positions, frequencies and time domain parameters to the units of the XDF NIRS metadata,
+        one call per array rather than one per channel or coordinate.
+        """
+        length_unit = self.snirf_meta_data.LengthUnit
+        time_unit = self.snirf_meta_data.TimeUnit
+        probe = self.snirf_probe
+        self.sourcePos2D = utils.convert(length_unit, "mm", probe.sourcePos2D)
+        self.sourcePos3D = utils.convert(length_unit, "mm", probe.sourcePos3D)
+        self.detectorPos2D = utils.convert(length_unit, "mm", probe.detectorPos2D)
+        self.detectorPos3D = utils.convert(length_unit, "mm", probe.detectorPos3D)
+        #Landmark positions may hold a label index in their last column, only convert the coordinates.
+        self.landmarkPos2D = utils.convert(length_unit, "mm", probe.landmarkPos2D[:, :2]) if utils.has_values(probe.landmarkPos2D) else None
+        self.landmarkPos3D = utils.convert(length_unit, "mm", probe.landmarkPos3D[:, :3]) if utils.has_values(probe.landmarkPos3D) else None
+        self.frequencies = utils.convert(self.snirf_meta_data.FrequencyUnit, "Hz", probe.frequencies) if utils.has_values(probe.frequencies) else None
+        self.timeDelays = utils.convert(time_unit, "ps", probe.timeDelays) if utils.has_values(probe.timeDelays) else None
+        self.timeDelayWidths = utils.convert(time_unit, "ps", probe.timeDelayWidths) if utils.has_values(probe.timeDelayWidths) else None
+        self.correlationTimeDelays = utils.convert(time_unit, "ps", probe.correlationTimeDelays) if utils.has_values(probe.correlationTimeDelays) else None
+        self.correlationTimeDelayWidths = utils.convert(time_unit, "ps", probe.correlationTimeDelayWidths) if utils.has_values(probe.correlationTimeDelayWidths) else None
 
     def PopulateStreamInfo(self):
         channels = self.stream_info.desc().append_child("channels")
@@ -33,19 +155,19 @@ class SnirfStreamer:
             self.PopulateOptode(optode, False, i)
 
          
-        if self.snirf_probe.landmarkPos3D is not None:
+        if utils.has_values(self.snirf_probe.landmarkPos3D):
             fiducials = self.stream_info.desc().append_child("fiducials")
             for i in range(len(self.snirf_probe.landmarkPos3D)):
                 fiducial = fiducials.append_child("fiducial")
                 self.PopulateFiducial(fiducial, i)  
        
-        elif self.snirf_probe.landmarkPos2D is not None:
+        elif utils.has_values(self.snirf_probe.landmarkPos2D):
             fiducials = self.stream_info.desc().append_child("fiducials")
             for i in range(len(self.snirf_probe.landmarkPos2D)):
                 fiducial = fiducials.append_child("fiducial")
                 self.PopulateFiducial(fiducial, i)     
 
-    def PopulateChannel(self, channel: pylsl.XMLElement, measurement_list_element : snirf.MeasurementListElement): 
+    def PopulateChannel(self, channel: "pylsl.XMLElement", measurement_list_element : snirf.MeasurementListElement): 
         #type
         if measurement_list_element.dataTypeLabel:
             channel.append_child_value("type", measurement_list_element.dataTypeLabel)
@@ -88,42 +210,42 @@ class SnirfStreamer:
 
         #frequency domain
         #if utils.Is_Frequency_Domain(measurement_list.dataType):
-        if  self.snirf_probe.frequencies:
-            frequency = str(utils.convert(self.snirf_meta_data.FrequencyUnit, "Hz", self.snirf_probe.frequencies[measurement_list_element.dataTypeIndex]))
+        if self.frequencies is not None:
+            frequency = str(self.frequencies[measurement_list_element.dataTypeIndex - 1])
             fd = channel.append_child("fd")
             fd.append_child_value("frequency", frequency)
 
         
         #time domain
        # if utils.Is_Gated_Time_Domain(measurement_list.dataType):
-        if self.snirf_probe.timeDelays and self.snirf_probe.timeDelayWidths:
-            delay = utils.convert(self.snirf_meta_data.TimeUnit, "ps", self.snirf_probe.timeDelays[measurement_list_element.dataTypeIndex - 1])
-            width = utils.convert(self.snirf_meta_data.TimeUnit, "ps", self.snirf_probe.timeDelayWidths[measurement_list_element.dataTypeIndex])
+        if self.timeDelays is not None and self.timeDelayWidths is not None:
+            delay = self.timeDelays[measurement_list_element.dataTypeIndex - 1]
+            width = self.timeDelayWidths[measurement_list_element.dataTypeIndex - 1]
 
             td = channel.append_child("td")
-            td.append_child_value("delay", delay)
-            td.append_child_value("width", width)
+            td.append_child_value("delay", str(delay))
+            td.append_child_value("width", str(width))
 
         #Diffuse Correlation Spectroscopy
         #if utils.Is_DCS(measurement_list.dataType):
-        if self.snirf_probe.correlationTimeDelays and self.snirf_probe.correlationTimeDelayWidths:
-            delay = utils.convert(self.snirf_meta_data.TimeUnit, "ps", self.snirf_probe.correlationTimeDelays[measurement_list_element.dataTypeIndex])
-            width = utils.convert(self.snirf_meta_data.TimeUnit, "ps", self.snirf_probe.correlationTimeDelayWidths[measurement_list_element.dataTypeIndex])
+        if self.correlationTimeDelays is not None and self.correlationTimeDelayWidths is not None:
+            delay = self.correlationTimeDelays[measurement_list_element.dataTypeIndex - 1]
+            width = self.correlationTimeDelayWidths[measurement_list_element.dataTypeIndex - 1]
 
             dcs = channel.append_child("dcs")
-            dcs.append_child_value("delay", self.snirf_probe.correlationTimeDelays[measurement_list_element.dataTypeIndex])
-            dcs.append_child_value("width", self.snirf_probe.correlationTimeDelayWidths[measurement_list_element.dataTypeIndex])
+            dcs.append_child_value("delay", str(delay))
+            dcs.append_child_value("width", str(width))
 
         
         #fluorescence
-        if self.snirf_probe.wavelengthsEmission:
+        if utils.has_values(self.snirf_probe.wavelengthsEmission):
             fluorescence = channel.append_child("fluorescence")
-            fluorescence.append_child_value("wavelen", self.snirf_probe.wavelengthsEmission[measurement_list_element.wavelengthIndex])
+            fluorescence.append_child_value("wavelen", str(self.snirf_probe.wavelengthsEmission[measurement_list_element.wavelengthIndex - 1]))
             fluorescence.append_child_value("wavelen_measured", measurement_list_element.wavelengthEmissionActual)
         
         #illumination?
 
-    def PopulateOptode(self, optode: pylsl.XMLElement, is_source, i):
+    def PopulateOptode(self, optode: "pylsl.XMLElement", is_source, i):
         postion2D = None
         postion3D = None
         label = None
@@ -131,18 +253,18 @@ class SnirfStreamer:
             function = "Source"
             if self.snirf_probe.sourceLabels is not None:
                 label = self.snirf_probe.sourceLabels[i]
-            if self.snirf_probe.sourcePos2D is not None:
-                postion2D = self.snirf_probe.sourcePos2D[i]
+            if utils.has_values(self.sourcePos2D):
+                postion2D = self.sourcePos2D[i]
             else:
-                postion3D = self.snirf_probe.sourcePos3D[i]
+                postion3D = self.sourcePos3D[i]
         else:
             function = "Detector"
             if self.snirf_probe.detectorLabels is not None:
                 label = self.snirf_probe.detectorLabels[i]
-            if self.snirf_probe.detectorPos2D is not None:
-                postion2D = self.snirf_probe.detectorPos2D[i]
+            if utils.has_values(self.detectorPos2D):
+                postion2D = self.detectorPos2D[i]
             else:
-                postion3D = self.snirf_probe.detectorPos3D[i]
+                postion3D = self.detectorPos3D[i]
 
         optode.append_child_value("function", function)
         if label:
@@ -150,40 +272,86 @@ class SnirfStreamer:
         
         location = optode.append_child("location")
         if postion2D is not None:
-            location.append_child_value("X", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postion2D[0])))
-            location.append_child_value("Y", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postion2D[1])))
+            location.append_child_value("X", str(postion2D[0]))
+            location.append_child_value("Y", str(postion2D[1]))
         
         if postion3D is not None:
-            location.append_child_value("X", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postion3D[0])))
-            location.append_child_value("Y", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postion3D[1])))
-            location.append_child_value("Z", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postion3D[2])))
+            location.append_child_value("X", str(postion3D[0]))
+            location.append_child_value("Y", str(postion3D[1]))
+            location.append_child_value("Z", str(postion3D[2]))
     
-    def PopulateFiducial(self, fiducial: pylsl.XMLElement, i):
+    def PopulateFiducial(self, fiducial: "pylsl.XMLElement", i):
         location = fiducial.append_child("location")
-        if self.snirf_probe.landmarkPos2D is not None:
+        if self.landmarkPos2D is not None:
             postions = self.snirf_probe.landmarkPos2D
-            location.append_child_value("X", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postions[i][0])))
-            location.append_child_value("Y", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postions[i][1])))
+            location.append_child_value("X", str(self.landmarkPos2D[i][0]))
+            location.append_child_value("Y", str(self.landmarkPos2D[i][1]))
             if len(postions[i]) == 3:
-                label = self.snirf_probe.landmarkLabels[postions[i][2]]
+                #Label indices are 1-based.
+                label = self.snirf_probe.landmarkLabels[int(postions[i][2]) - 1]
                 fiducial.append_child_value("label", label)
 
         else:
             postions = self.snirf_probe.landmarkPos3D
-            location.append_child_value("X", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postions[i][0])))
-            location.append_child_value("Y", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postions[i][1])))
-            location.append_child_value("Z", str(utils.convert(self.snirf_meta_data.LengthUnit, "mm", postions[i][2])))
+            location.append_child_value("X", str(self.landmarkPos3D[i][0]))
+            location.append_child_value("Y", str(self.landmarkPos3D[i][1]))
+            location.append_child_value("Z", str(self.landmarkPos3D[i][2]))
             if len(postions[i]) == 4:
-                label = self.snirf_probe.landmarkLabels[postions[i][3]]
+                label = self.snirf_probe.landmarkLabels[int(postions[i][3]) - 1]
                 fiducial.append_child_value("label", label)
 
     def StreamOverLSL(self):
-        stream_outlet = pylsl.stream_outlet(self.stream_info)
-        for data, time in  zip(snirf_file.nirs[0].data[0].dataTimeSeries, snirf_file.nirs[0].data[0].time):
-            stream_outlet.push_sample(data, time)
+        """
+        Send the data in chunks, each scheduled against pylsl.local_clock() for when its last sample is due
+        according to the recorded time vector and the speed multiplier.
+
+        :return: The ReplayStats of the replay.
+        """
+        stream_outlet = pylsl.StreamOutlet(self.stream_info, self.chunk_size)
+        if self.wait_for_consumers:
+            stream_outlet.wait_for_consumers(self.wait_for_consumers)
+        time = self.h5_data["time"]
+        sample_count = len(time)
+        if sample_count == 0:
+            return ReplayStats(0, 0.0, self.speed, 0.0, [])
+        first_time, last_time = time[0], time[-1]
+        lateness = []
+
+        slab_reader = SnirfSlabReader(self.h5_data, self.slab_rows, self.read_ahead)
+        start = pylsl.local_clock()
+        for slab_time, slab_data in slab_reader:
+            #Offsets of each sample from the start of the replay, in seconds of wall time.
+            offsets = (numpy.asarray(slab_time, dtype=numpy.float64) - first_time) / (self.speed if self.speed else 1.0)
+            for i in range(0, len(offsets), self.chunk_size):
+                j = min(i + self.chunk_size, len(offsets))
+                if self.speed:
+                    due = start + offsets[j - 1]
+                    delay = due - pylsl.local_clock()
+                    if delay > 0:
+                        t.sleep(delay)
+                    lateness.append(pylsl.local_clock() - due)
+                stream_outlet.push_chunk(slab_data[i:j], start + offsets[i:j])
+        elapsed = pylsl.local_clock() - start
+
+        #Keep the outlet open until the inlet has pulled the queued samples and disconnected.
+        deadline = pylsl.local_clock() + self.wait_for_consumers
+        while self.wait_for_consumers and stream_outlet.have_consumers() and pylsl.local_clock() < deadline:
             t.sleep(0.01)
+        return ReplayStats(sample_count, last_time - first_time, self.speed, elapsed, lateness)
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("SNIRF to LSL Streamer",
+    """This program replays the data of a SNIRF file over LSL at its recorded sample rate.""")
+    parser.add_argument("snirf_file_path", help="Path to the SNIRF file to stream.")
+    parser.add_argument("--chunk-size", help="number of samples sent per chunk", type=int, default=32)
+    parser.add_argument("--speed", help="replay speed multiplier, 0 streams as fast as possible", type=float, default=1.0)
+    parser.add_argument("--slab-rows", help="number of samples read from the file at a time", type=int, default=1024)
+    parser.add_argument("--read-ahead", help="number of slabs read ahead on a background thread", type=int, default=4)
+    parser.add_argument("--wait-for-consumers", help="seconds to wait for an inlet to connect before sending and to disconnect after", type=float, default=0)
+    args = parser.parse_args()
 
-#load snirf file
-snirf_file : snirf.Snirf = snirf.loadSnirf("./data/matlab_converted_lumo.snirf", False, True)
-SnirfStreamer(snirf_file)
\ No newline at end of file
+    #load snirf file, the time series are read lazily by the streamer.
+    snirf_file : snirf.Snirf = snirf.loadSnirf(args.snirf_file_path, True, True)
+    streamer = SnirfStreamer(snirf_file, args.chunk_size, args.speed, args.slab_rows, args.read_ahead, args.wait_for_consumers)
+    print(streamer.replay_stats.Report())
\ No newline at end of file
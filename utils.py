@@ -1,36 +1,104 @@
-from astropy import units as u
-import pydash
 import array
 import numpy
+import threading
+import itertools
+from collections import Counter
 
-def get(dict_to_search: dict, path: str):
-    try:
-        value = pydash.get(dict_to_search, path)
+class LookupDiagnostics():
+    """
+    Counts the metadata lookups made through get and the paths that were not found,
+    so missing keys can be reported once per conversion instead of once per lookup.
+    nirs groups are converted by a pool of threads: lookups are counted with an itertools.count, whose next() is
+    atomic, so get never takes the lock, which guards the misses and the reads of the counters.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def RecordMiss(self, path):
+        with self.lock:
+            self.misses[path] += 1
+
+    def Reset(self):
+        with self.lock:
+            self.call_counter = itertools.count() #Advanced by every lookup made through get.
+            self.reads = 0 #Number of times the counter was advanced to read it.
+            self.misses = Counter() #Number of misses per path.
+
+    def Calls(self):
+        """
+        :return: The number of lookups made. Must be called with the lock held.
+        """
+        #Reading the count advances it, so the earlier reads are subtracted.
+        calls = next(self.call_counter) - self.reads
+        self.reads += 1
+        return calls
+
+    def Counts(self):
+        """
+        :return: The number of lookups made and the number of them that missed.
+        """
+        with self.lock:
+            return self.Calls(), sum(self.misses.values())
+
+    def MissedPaths(self):
+        """
+        :return: A copy of the number of misses per path.
+        """
+        with self.lock:
+            return dict(self.misses)
+
+    def Report(self):
+        """
+        :return: A human readable summary of the lookups and misses, most frequent misses first.
+        """
+        with self.lock:
+            calls, misses = self.Calls(), Counter(self.misses)
+        lines = [f"{calls} metadata lookups, {sum(misses.values())} not found"]
+        for path, count in misses.most_common():
+            lines.append(f"  {path} not found {count} times")
+        return "\n".join(lines)
+
+lookup_diagnostics = LookupDiagnostics()
+
+_compiled_paths = {} # Dotted paths split into key tuples, indexed by path.
+
+def compile_path(path: str):
+    keys = _compiled_paths.get(path)
+    if keys is None:
+        keys = _compiled_paths[path] = tuple(path.split("."))
+    return keys
+
+def get(dict_to_search: dict, path: str, report: bool = True):
+    next(lookup_diagnostics.call_counter)
+    value = dict_to_search
+    for i, key in enumerate(compile_path(path)):
+        # pyxdf wraps every XML element in a list, unwrap single element lists between keys.
+        if i and type(value) is list and len(value) == 1:
+            value = value[0]
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            value = None
         if value is None:
-            raise
-        if isinstance(value, dict) or isinstance(value, numpy.ndarray):
+            if report:
+                lookup_diagnostics.RecordMiss(path)
+            return None
+
+    if isinstance(value, dict) or isinstance(value, numpy.ndarray):
+        return value
+    if isinstance(value, list):
+        if len(value) == 1:
+            value = value[0]
+        else:
             return value
-        if isinstance(value, list):
-            if len(value) == 1:
-                value = value[0]
-            else:
-                return value
-        if isinstance(value, str) and value.lstrip('-+').replace('.','', 1).isnumeric():
-            value = float(value)
-            if value.is_integer():
-                value = int(value) 
-        return value              
-    except:
-        try:
-            location, remaining_path  = path.split(".", 1)
-            if not remaining_path:
-                return None
-            value = get(dict_to_search, location)
-            if value:
-                return get(value, remaining_path)
-        except:
-            pass
-        print(f"{path} not founds")
+    if isinstance(value, str) and value.lstrip('-+').replace('.','', 1).isnumeric():
+        value = float(value)
+        if value.is_integer():
+            value = int(value) 
+    return value
 
 
 def get_index(in_list, val):
@@ -38,6 +106,23 @@ def get_index(in_list, val):
         return in_list.index(val)
     except ValueError:
         return None 
+
+def optional_list(values):
+    # pysnirf2 returns None for fields that were never set.
+    if values is None:
+        return []
+    return list(values)
+
+def has_values(values):
+    # Truth test for fields that may be None, a list or a numpy array.
+    return values is not None and len(values) > 0
+
+def build_index(in_list):
+    # Map each value to the position of its first occurrence, matching get_index.
+    index = {}
+    for i, val in enumerate(in_list):
+        index.setdefault(val, i)
+    return index
     
 def try_append(list, val, default: str = None, all = False):
     if all:
@@ -165,7 +250,38 @@ def Is_DCS(snirf_data_type):
     else:
         return False 
 
+_conversion_factors = {} # Unit conversion factors indexed by (current_unit, target_unit).
+
+# SI prefixes and base units converted without astropy, whose unit registry takes a noticeable time to import.
+_si_prefix_exponents = {"": 0, "f": -15, "p": -12, "n": -9, "u": -6, "\u00b5": -6, "m": -3, "c": -2, "d": -1, "k": 3, "M": 6, "G": 9}
+_si_base_units = {"m", "s", "Hz", "W", "g", "V", "A"}
+
+def _si_unit(unit):
+    # Split a unit like "mm" or "ps" into its base unit and prefix exponent, or None if it is not a prefixed base unit.
+    if unit in _si_base_units:
+        return unit, 0
+    if len(unit) > 1 and unit[0] in _si_prefix_exponents and unit[1:] in _si_base_units:
+        return unit[1:], _si_prefix_exponents[unit[0]]
+    return None
+
+def conversion_factor(current_unit, target_unit):
+    factor = _conversion_factors.get((current_unit, target_unit))
+    if factor is None:
+        current, target = _si_unit(current_unit), _si_unit(target_unit)
+        if current and target and current[0] == target[0]:
+            factor = 10.0 ** (current[1] - target[1])
+        else:
+            from astropy import units as u
+            factor = u.Unit(current_unit).to(u.Unit(target_unit))
+        _conversion_factors[(current_unit, target_unit)] = factor
+    return factor
+
 def convert(current_unit, target_unit, value):
-    if value:
-        current_unit_per_target_unit = u.Unit(current_unit).to(u.Unit(target_unit))
-        return value * current_unit_per_target_unit
+    # Accepts scalars, numeric strings, lists and numpy arrays. Returns None for missing values only, 0 converts to 0.
+    if isinstance(value, str):
+        value = float(value) if value.strip() else None
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        value = numpy.asarray(value, dtype=numpy.float64)
+    return value * conversion_factor(current_unit, target_unit)
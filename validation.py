@@ -0,0 +1,189 @@
+"""
+Validation of converted SNIRF files, decoupled from the conversion.
+"""
+import time
+import contextlib
+import io
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import h5py
+import numpy
+
+TIERS = ["fast", "full"]
+
+MEASUREMENT_LIST_INDICES = {"sourceIndex": ("sourceLabels", "sourcePos3D", "sourcePos2D"),
+                            "detectorIndex": ("detectorLabels", "detectorPos3D", "detectorPos2D"),
+                            "wavelengthIndex": ("wavelengths",)}
+
+
+def probe_length(probe, names):
+    """
+    :return: The length of the first of the named probe datasets present, or None if none is.
+    """
+    for name in names:
+        if name in probe:
+            return len(probe[name])
+    return None
+
+
+def measurement_list_columns(data_group):
+    """
+    Read the measurement list of a data group as columns, from either measurementList{i} groups or the
+    measurementLists group of arrays.
+
+    :return: A tuple of the number of channels described and a dictionary of column arrays.
+    """
+    if "measurementLists" in data_group:
+        columns = {name: data_group["measurementLists"][name][()] for name in data_group["measurementLists"]}
+        return (len(next(iter(columns.values()))) if columns else 0), columns
+    names = sorted((name for name in data_group if name.startswith("measurementList")), key=lambda name: int(name[15:] or 0))
+    columns = {}
+    for name in names:
+        for field in MEASUREMENT_LIST_INDICES:
+            if field in data_group[name]:
+                columns.setdefault(field, []).append(int(numpy.asarray(data_group[name][field][()]).item()))
+    return len(names), {field: numpy.asarray(values) for field, values in columns.items()}
+
+
+def validate_structure(path_to_snirf):
+    """
+    The fast tier: check the structure and shapes of a SNIRF file with h5py.
+
+    :param path_to_snirf: Path of the SNIRF file.
+    :return: A list of error messages, empty if the file is valid.
+    """
+    errors = []
+    with h5py.File(path_to_snirf, "r") as h5_file:
+        if "formatVersion" not in h5_file:
+            errors.append("/formatVersion: missing")
+        nirs_names = [name for name in h5_file if name.startswith("nirs")]
+        if not nirs_names:
+            errors.append("/: no nirs group")
+        for nirs_name in nirs_names:
+            nirs_group = h5_file[nirs_name]
+            for required in ["metaDataTags", "probe"]:
+                if required not in nirs_group:
+                    errors.append(f"/{nirs_name}/{required}: missing")
+            probe = nirs_group.get("probe", {})
+            data_names = [name for name in nirs_group if name.startswith("data")]
+            if not data_names:
+                errors.append(f"/{nirs_name}: no data group")
+
+            for name in data_names + [name for name in nirs_group if name.startswith("aux")]:
+                group = nirs_group[name]
+                location = f"/{nirs_name}/{name}"
+                if "time" not in group or "dataTimeSeries" not in group:
+                    errors.append(f"{location}: missing time or dataTimeSeries")
+                    continue
+                time_shape, series_shape = group["time"].shape, group["dataTimeSeries"].shape
+                if len(time_shape) != 1 and not (len(time_shape) == 2 and 1 in time_shape):
+                    errors.append(f"{location}/time: expected a vector, got shape {time_shape}")
+                if series_shape and series_shape[0] != time_shape[0] and time_shape[0] != 2:
+                    errors.append(f"{location}/dataTimeSeries: {series_shape[0]} samples but {time_shape[0]} time points")
+                if not name.startswith("data"):
+                    continue
+
+                channel_count, columns = measurement_list_columns(group)
+                series_channels = series_shape[1] if len(series_shape) == 2 else 1
+                if channel_count != series_channels:
+                    errors.append(f"{location}: {series_channels} channels but {channel_count} measurement list entries")
+                for field, probe_names in MEASUREMENT_LIST_INDICES.items():
+                    length = probe_length(probe, probe_names)
+                    values = columns.get(field)
+                    if values is None or not len(values):
+                        errors.append(f"{location}: measurement list {field} missing")
+                    elif length is not None and (values.min() < 1 or values.max() > length):
+                        errors.append(f"{location}: measurement list {field} out of range 1..{length}")
+
+            for name in [name for name in nirs_group if name.startswith("stim")]:
+                data = nirs_group[name].get("data")
+                if data is not None and data.size and (data.ndim != 2 or data.shape[1] < 3):
+                    errors.append(f"/{nirs_name}/{name}/data: expected [#Events x 3+] rows, got shape {data.shape}")
+    return errors
+
+
+def validate_full(path_to_snirf):
+    """
+    The full tier: validate a SNIRF file with pysnirf2 and read it back with MNE.
+
+    :param path_to_snirf: Path of the SNIRF file.
+    :return: A list of error messages, empty if the file is valid.
+    """
+    import snirf
+    from mne.io import read_raw_snirf
+
+    errors = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = snirf.validateSnirf(path_to_snirf)
+    errors += [f"{issue.location}: {issue.name}" for issue in result.errors]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            read_raw_snirf(path_to_snirf, verbose="error")
+    except Exception as e:
+        errors.append(f"mne read_raw_snirf: {type(e).__name__}: {e}")
+    return errors
+
+
+def validate_file(path_to_snirf, tier = "fast"):
+    """
+    Validate a SNIRF file with the given tier. Runs in a worker process.
+
+    :return: A dictionary with "snirf", "tier", "valid", "errors" and "seconds" keys.
+    """
+    start = time.perf_counter()
+    try:
+        errors = validate_structure(path_to_snirf) if tier == "fast" else validate_full(path_to_snirf)
+    except Exception:
+        errors = [traceback.format_exc()]
+    return {"snirf": path_to_snirf, "tier": tier, "valid": not errors, "errors": errors,
+            "seconds": time.perf_counter() - start}
+
+
+class ValidationPipeline():
+    """
+    Validates SNIRF files in a pool of worker processes while the caller carries on converting.
+    """
+    def __init__(self, tier = "fast", workers = 1):
+        """
+        Initialize the class and start the worker pool.
+
+        :param tier: "fast" or "full", see TIERS.
+        :param workers: Number of worker processes.
+        """
+        if tier not in TIERS:
+            raise ValueError(f"unknown validation tier {tier!r}, expected one of {TIERS}")
+        self.tier = tier #Store the validation tier.
+        self.executor = ProcessPoolExecutor(max_workers=workers) #Pool the files are validated in.
+        self.futures = [] #Pending and completed validations, in submission order.
+
+    def Submit(self, path_to_snirf):
+        """
+        Queue a SNIRF file for validation and return immediately.
+
+        :return: A concurrent.futures.Future of the validate_file result.
+        """
+        future = self.executor.submit(validate_file, path_to_snirf, self.tier)
+        self.futures.append(future)
+        return future
+
+    def Results(self):
+        """
+        Wait for every submitted file and shut the pool down.
+
+        :return: The validate_file result of every file, in submission order.
+        """
+        results = [future.result() for future in self.futures]
+        self.executor.shutdown()
+        return results
+
+    def Report(self):
+        """
+        :return: A dictionary with the tier, the number of valid and invalid files, the total validation time and
+        the result of every file.
+        """
+        results = self.Results()
+        return {"tier": self.tier, "files": len(results),
+                "valid": sum(result["valid"] for result in results),
+                "invalid": sum(not result["valid"] for result in results),
+                "seconds": sum(result["seconds"] for result in results),
+                "results": results}
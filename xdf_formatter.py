@@ -1,15 +1,96 @@
+import re
 from utils import *
 
+
+class XdfDeviceAdapter():
+    """
+    Normalizes the desc() metadata of a device's XDF NIRS streams, in place, into the layout read by the converter:
+    desc.channels.channel, desc.optodes.optode (each optode with its location) and desc.fiducials.fiducial.
+    Subclasses set the patterns identifying their streams, override Normalize and are added to the registry
+    with @register_device_adapter.
+    """
+    name_pattern = None #Regular expression searched for in info.name, or None.
+    manufacturer_pattern = None #Regular expression searched for in desc.manufacturer or desc.acquisition.manufacturer, or None.
+
+    def Matches(self, stream: dict):
+        """
+        :return: True if the stream's name or manufacturer matches the adapter's patterns.
+        """
+        name = get(stream, "info.name", report=False)
+        if self.name_pattern and isinstance(name, str) and re.search(self.name_pattern, name):
+            return True
+        manufacturer = get(stream, "info.desc.acquisition.manufacturer", report=False) or get(stream, "info.desc.manufacturer", report=False)
+        return bool(self.manufacturer_pattern and isinstance(manufacturer, str) and re.search(self.manufacturer_pattern, manufacturer))
+
+    def Normalize(self, desc: dict):
+        """
+        Rewrite the stream's desc() dictionary in place. Must leave an already normalized desc unchanged.
+        """
+        pass
+
+
+DEVICE_ADAPTERS = [] #Registered adapters, tried in the order they were registered.
+
+
+def register_device_adapter(adapter_class):
+    """
+    Class decorator adding an XdfDeviceAdapter subclass to the registry.
+    """
+    DEVICE_ADAPTERS.append(adapter_class())
+    return adapter_class
+
+
+def find_device_adapter(stream: dict):
+    """
+    :return: The first registered adapter matching the stream, or None.
+    """
+    for adapter in DEVICE_ADAPTERS:
+        if adapter.Matches(stream):
+            return adapter
+    return None
+
+
+def normalize_xdf_stream(stream: dict):
+    """
+    Normalize the desc() metadata of a stream in place with the matching device adapter, if any.
+
+    :return: The stream.
+    """
+    adapter = find_device_adapter(stream)
+    desc = get(stream, "info.desc", report=False)
+    if adapter is not None and isinstance(desc, dict):
+        adapter.Normalize(desc)
+    return stream
+
+
+@register_device_adapter
+class LumoDeviceAdapter(XdfDeviceAdapter):
+    """
+    Gowerlabs LUMO, of any unit serial. LUMO names its fiducials "fiducial" and its optodes "probes.probe",
+    with the optode locations in a separate "probes.location" list in the same order as the optodes.
+    """
+    name_pattern = r"^LUMO\b"
+    manufacturer_pattern = r"(?i)gowerlabs"
+
+    def Normalize(self, desc: dict):
+        if "fiducial" in desc and "fiducials" not in desc:
+            desc["fiducials"] = desc.pop("fiducial")
+        if "probes" in desc and "optodes" not in desc:
+            probes = desc.pop("probes")[0]
+            optodes = probes.pop("probe", [])
+            #Attach each location to its optode, reusing the parsed dictionaries rather than copying them.
+            for optode, location in zip(optodes, probes.pop("location", [])):
+                optode["location"] = location
+            desc["optodes"] = [{"optode": optodes}]
+
+
 class LumoxdfToStandardXdf():
+    """
+    Normalizes a LUMO stream in place, kept for callers of the former LUMO special case.
+    """
     def __init__(self, lumo_xdf_stream: dict) -> None:
-        self.stream =  lumo_xdf_stream
+        self.stream = lumo_xdf_stream
         self.convert_lumo_to_standard_xdf()
-    
 
     def convert_lumo_to_standard_xdf(self):
-        self.stream["info"]["desc"][0]["fiducials"] = self.stream["info"]["desc"][0].pop("fiducial")
-        self.stream["info"]["desc"][0]["optodes"] = self.stream["info"]["desc"][0].pop("probes")
-        self.stream["info"]["desc"][0]["optodes"][0]["optode"] = self.stream["info"]["desc"][0]["optodes"][0].pop("probe")
-        
-        for optode, location in zip(self.stream["info"]["desc"][0]["optodes"][0]["optode"], self.stream["info"]["desc"][0]["optodes"][0].pop("location")):
-            optode["location"] = location
+        LumoDeviceAdapter().Normalize(get(self.stream, "info.desc", report=False))
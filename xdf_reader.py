@@ -0,0 +1,264 @@
+import re
+import gzip
+import logging
+import os
+import struct
+import numpy
+import pyxdf
+from collections import OrderedDict
+from xml.etree.ElementTree import fromstring
+from pyxdf.pyxdf import open_xdf, StreamData, _read_varlen_int, _read_chunk3, _xml2dict, _scan_forward
+from utils import get
+
+logger = logging.getLogger(__name__)
+
+
+class XdfChunkReader():
+    """
+    Reads an XDF file one chunk at a time instead of loading the whole recording with pyxdf.load_xdf.
+    Chunks are decoded with pyxdf's own chunk parsers, so the values match what load_xdf would return
+    before clock synchronization and dejittering are applied.
+    Chunk layout according to https://github.com/sccn/xdf/wiki/Specifications
+    """
+    FILE_HEADER = 1
+    STREAM_HEADER = 2
+    SAMPLES = 3
+    CLOCK_OFFSET = 4
+    STREAM_FOOTER = 6
+
+    def __init__(self, path_to_xdf):
+        """
+        Initialize the class with the path of the XDF file to read.
+
+        :param path_to_xdf: Path to the XDF file (*.xdf or *.xdfz).
+        """
+        self.path_to_xdf = path_to_xdf #Store the XDF file path.
+        self.file_header = None #XDF file header, populated by ReadHeaders.
+        self.stream_headers = OrderedDict() #Stream headers indexed by stream id, populated by ReadHeaders.
+        self.header_xml = OrderedDict() #XML of the stream headers indexed by stream id, populated by ReadHeaders.
+        self.offset = None #Byte offset after the last complete chunk read by IterSamples.
+        self.last_stamps = {} #Last time stamp decoded per stream by IterSamples.
+        self.unknown_stream_ids = [] #Streams whose header was found by IterSamples but not by ReadHeaders.
+
+    def ReadHeaders(self):
+        """
+        Read the file header and every stream header without decoding any sample chunks.
+        Sample chunks are skipped with a seek, so this pass costs a few reads per chunk regardless of the channel count.
+
+        :return: An OrderedDict of stream headers indexed by stream id, formatted like the streams returned by pyxdf.
+        """
+        with open_xdf(self.path_to_xdf) as f:
+            for tag, stream_id, chunk_length in self.IterChunkHeaders(f):
+                if tag == self.FILE_HEADER:
+                    self.file_header = _xml2dict(fromstring(f.read(chunk_length - 2)))
+                elif tag == self.STREAM_HEADER:
+                    self.header_xml[stream_id] = f.read(chunk_length - 6).decode("utf-8", "replace")
+                    self.stream_headers[stream_id] = parse_stream_header(self.header_xml[stream_id], stream_id)
+                else:
+                    f.seek(chunk_length - (6 if stream_id is not None else 2), 1)
+        return self.stream_headers
+
+    def LoadHeaders(self, header_xml):
+        """
+        Restore the stream headers from the XML kept by an earlier ReadHeaders, without reading the file.
+
+        :param header_xml: A dictionary of stream header XML strings indexed by stream id.
+        :return: An OrderedDict of stream headers indexed by stream id, as returned by ReadHeaders.
+        """
+        self.header_xml = OrderedDict((int(stream_id), xml_string) for stream_id, xml_string in header_xml.items())
+        self.stream_headers = OrderedDict((stream_id, parse_stream_header(xml_string, stream_id))
+                                          for stream_id, xml_string in self.header_xml.items())
+        return self.stream_headers
+
+    def IterSamples(self, stream_ids = None, start_offset = None, last_stamps = None):
+        """
+        Decode the sample chunks of the selected streams one at a time.
+        Chunks belonging to other streams are skipped with a seek and never decoded.
+        Once a chunk has been yielded, self.offset holds the byte offset after it, so a later call can resume there.
+
+        :param stream_ids: Optional collection of stream ids to decode. All streams are decoded if None.
+        :param start_offset: Optional byte offset of the chunk to start from, e.g. self.offset of an earlier call.
+        :param last_stamps: Last time stamp decoded per stream before start_offset, from which time stamps left out
+        of the new chunks are deduced.
+        :return: A generator yielding (stream_id, time_stamps, time_series) for each sample chunk.
+        """
+        if not self.stream_headers:
+            self.ReadHeaders()
+        stream_data = {stream_id: StreamData(header) for stream_id, header in self.stream_headers.items()}
+        for stream_id, last_stamp in (last_stamps or {}).items():
+            stream_data[int(stream_id)].last_timestamp = last_stamp
+        self.unknown_stream_ids = []
+        with open_xdf(self.path_to_xdf) as f:
+            if start_offset:
+                f.seek(start_offset)
+            self.offset = f.tell()
+            for tag, stream_id, chunk_length in self.IterChunkHeaders(f):
+                if tag == self.STREAM_HEADER and stream_id not in self.stream_headers:
+                    self.unknown_stream_ids.append(stream_id)
+                if tag == self.SAMPLES and stream_id in stream_data and (stream_ids is None or stream_id in stream_ids):
+                    try:
+                        _, stamps, values = _read_chunk3(f, stream_data[stream_id])
+                    except Exception as e:
+                        #A chopped-off or corrupted chunk, scan forward to the next boundary chunk like pyxdf does.
+                        logger.warning("likely XDF file corruption (%s), scanning forward to next boundary chunk", e)
+                        _scan_forward(f)
+                        self.offset = f.tell()
+                        continue
+                    if not isinstance(values, numpy.ndarray):
+                        values = numpy.array(values, dtype=object)
+                    self.offset = f.tell()
+                    yield stream_id, stamps, values
+                else:
+                    f.seek(chunk_length - (6 if stream_id is not None else 2), 1)
+                    self.offset = f.tell()
+        self.last_stamps = {stream_id: data.last_timestamp for stream_id, data in stream_data.items()
+                            if stream_ids is None or stream_id in stream_ids}
+
+    def IterChunkHeaders(self, f):
+        """
+        Iterate over the chunks of an opened XDF file, leaving the file positioned at the start of each chunk's content.
+        The caller is responsible for reading or seeking past the remaining content of each chunk.
+        A chunk extending past the end of an uncompressed file, e.g. one a recorder is still writing, ends the
+        iteration with the file positioned at its start.
+
+        :param f: XDF file object returned by pyxdf.open_xdf.
+        :return: A generator yielding (tag, stream_id, chunk_length) for each chunk. stream_id is None for chunks without one.
+        """
+        file_size = None if isinstance(f, gzip.GzipFile) else os.fstat(f.fileno()).st_size
+        while True:
+            chunk_start = f.tell()
+            try:
+                chunk_length = _read_varlen_int(f)
+            except (EOFError, TypeError, RuntimeError, struct.error):
+                f.seek(chunk_start)
+                return
+            if file_size is not None and f.tell() + chunk_length > file_size:
+                f.seek(chunk_start)
+                return
+            tag = struct.unpack("<H", f.read(2))[0]
+            stream_id = None
+            if tag in [self.STREAM_HEADER, self.SAMPLES, self.CLOCK_OFFSET, self.STREAM_FOOTER]:
+                stream_id = struct.unpack("<I", f.read(4))[0]
+            yield tag, stream_id, chunk_length
+
+
+def parse_stream_header(xml_string, stream_id):
+    """
+    :return: The stream header in the XML of a stream header chunk, formatted like the streams returned by pyxdf.
+    """
+    header = _xml2dict(fromstring(xml_string))
+    header["info"]["stream_id"] = stream_id
+    return header
+
+
+def header_only_stream(stream_header, channel_count = None):
+    """
+    Create a pyxdf-style stream dictionary with empty time series from a stream header.
+    This allows the metadata converters to run before any sample has been decoded.
+
+    :param stream_header: A stream header as returned by XdfChunkReader.ReadHeaders.
+    :param channel_count: Optional channel count, read from the header if not given.
+    :return: A dictionary with "info", "time_series" and "time_stamps" keys.
+    """
+    if channel_count is None:
+        channel_count = int(stream_header["info"]["channel_count"][0])
+    stream = dict(stream_header)
+    stream["time_series"] = numpy.zeros((0, channel_count))
+    stream["time_stamps"] = numpy.zeros((0,))
+    return stream
+
+
+class XdfStreamSelection():
+    """
+    Selects the streams of an XDF file to convert and, optionally, a subset of the channels of its NIRS streams.
+    The selection is made from the stream headers alone, so unselected streams and channels are never decoded.
+    """
+    def __init__(self, nirs_patterns = None, aux_patterns = None, sources = None, detectors = None, wavelengths = None):
+        """
+        :param nirs_patterns: Regular expressions matched against the name and type of the NIRS streams. A stream is
+        selected if any pattern matches either in full. Every NIRS stream is selected if None.
+        :param aux_patterns: Regular expressions selecting the other (aux and marker) streams the same way. Every
+        stream is selected if None, none if empty.
+        :param sources: Optional labels of the sources whose channels are kept.
+        :param detectors: Optional labels of the detectors whose channels are kept.
+        :param wavelengths: Optional nominal wavelengths whose channels are kept.
+        """
+        self.nirs_patterns = nirs_patterns #Store the patterns of the NIRS streams.
+        self.aux_patterns = aux_patterns #Store the patterns of the other streams.
+        self.sources = set(sources) if sources else None #Store the labels of the kept sources.
+        self.detectors = set(detectors) if detectors else None #Store the labels of the kept detectors.
+        self.wavelengths = {float(wavelength) for wavelength in wavelengths} if wavelengths else None #Store the kept wavelengths.
+
+    def Matches(self, patterns, stream_header):
+        if patterns is None:
+            return True
+        fields = [str(get(stream_header, "info.name", report=False)), str(get(stream_header, "info.type", report=False))]
+        return any(re.fullmatch(pattern, field) for pattern in patterns for field in fields)
+
+    def StreamIds(self, stream_headers):
+        """
+        :param stream_headers: Stream headers indexed by stream id, as returned by XdfChunkReader.ReadHeaders.
+        :return: The ids of the selected streams, in file order.
+        """
+        return [stream_id for stream_id, header in stream_headers.items()
+                if self.Matches(self.nirs_patterns if get(header, "info.type", report=False) == "NIRS" else self.aux_patterns, header)]
+
+    def ChannelIndices(self, stream_header):
+        """
+        :param stream_header: The header of a stream.
+        :return: The 0-based indices of the kept channels of a NIRS stream, or None if every channel is kept.
+        """
+        if get(stream_header, "info.type", report=False) != "NIRS" or (self.sources is None and self.detectors is None and self.wavelengths is None):
+            return None
+        channels = get(stream_header, "info.desc.channels.channel") or []
+        if isinstance(channels, dict):
+            channels = [channels]
+        return numpy.asarray([i for i, channel in enumerate(channels)
+                              if (self.sources is None or str(get(channel, "source")) in self.sources)
+                              and (self.detectors is None or str(get(channel, "detector")) in self.detectors)
+                              and (self.wavelengths is None or get(channel, "wavelen") is not None and float(get(channel, "wavelen")) in self.wavelengths)],
+                             dtype=numpy.intp)
+
+    def SubsetHeader(self, stream, channel_indices):
+        """
+        :param stream: A stream or stream header.
+        :param channel_indices: The kept channels returned by ChannelIndices.
+        :return: A shallow copy of the stream whose desc() lists and channel_count only count the kept channels.
+        The original stream, e.g. the header the samples are decoded with, is left unchanged.
+        """
+        channels = get(stream, "info.desc.channels.channel") or []
+        if isinstance(channels, dict):
+            channels = [channels]
+        desc = dict(stream["info"]["desc"][0])
+        desc["channels"] = [{"channel": [channels[i] for i in channel_indices]}]
+        info = dict(stream["info"], channel_count=[str(len(channel_indices))], desc=[desc])
+        return dict(stream, info=info)
+
+
+def load_selected_xdf(path_to_xdf, selection: XdfStreamSelection, **load_kwargs):
+    """
+    Load the selected streams of an XDF file with pyxdf, after a header-only pass that picks them.
+    The unselected channels of each chunk are dropped as it is decoded, before the time series are concatenated.
+
+    :param path_to_xdf: Path to the XDF file.
+    :param selection: The XdfStreamSelection.
+    :param load_kwargs: Further keyword arguments of pyxdf.load_xdf, e.g. xdf_timing.XdfTimingOptions.LoadKwargs().
+    :return: The streams and file header, as returned by pyxdf.load_xdf.
+    """
+    stream_headers = XdfChunkReader(path_to_xdf).ReadHeaders()
+    stream_ids = selection.StreamIds(stream_headers)
+    if not stream_ids:
+        raise ValueError(f"no stream of {path_to_xdf} matches the selection")
+    channel_indices = {stream_id: selection.ChannelIndices(stream_headers[stream_id]) for stream_id in stream_ids}
+    channel_indices = {stream_id: indices for stream_id, indices in channel_indices.items() if indices is not None}
+
+    def on_chunk(values, stamps, stream_header, stream_id):
+        if stream_id in channel_indices:
+            values = values[:, channel_indices[stream_id]]
+        return values, stamps, stream_header
+
+    xdf_streams, xdf_file_header = pyxdf.load_xdf(path_to_xdf, select_streams=stream_ids, on_chunk=on_chunk if channel_indices else None,
+                                                     **load_kwargs)
+    xdf_streams = [selection.SubsetHeader(stream, channel_indices[stream["info"]["stream_id"]])
+                   if stream["info"]["stream_id"] in channel_indices else stream for stream in xdf_streams]
+    return xdf_streams, xdf_file_header
@@ -0,0 +1,197 @@
+"""
+Replays every stream of a recorded XDF file over LSL, for load testing acquisition pipelines.
+"""
+import json
+import argparse
+import threading
+import time
+import numpy
+import pylsl
+import pyxdf
+from utils import get
+from stream_snirf import ReplayStats
+
+
+def desc_to_xml(element: "pylsl.XMLElement", node):
+    """
+    Append a desc() dictionary, as read by pyxdf, to an LSL XML element.
+
+    :param element: The LSL XML element to append to, e.g. StreamInfo.desc().
+    :param node: A dictionary mapping child names to lists of children, each a nested dictionary or a text value.
+    """
+    for name, children in node.items():
+        for child in children:
+            if isinstance(child, dict):
+                desc_to_xml(element.append_child(name), child)
+            else:
+                element.append_child_value(name, child if child is not None else "")
+
+
+def stream_info_from_xdf(xdf_stream):
+    """
+    :param xdf_stream: A stream as returned by pyxdf.load_xdf.
+    :return: A pylsl.StreamInfo with the stream's header and desc() metadata.
+    """
+    stream_info = pylsl.StreamInfo(get(xdf_stream, "info.name", report=False) or "",
+                                   get(xdf_stream, "info.type", report=False) or "",
+                                   int(get(xdf_stream, "info.channel_count")),
+                                   float(get(xdf_stream, "info.nominal_srate", report=False) or pylsl.IRREGULAR_RATE),
+                                   get(xdf_stream, "info.channel_format"),
+                                   get(xdf_stream, "info.source_id", report=False) or "")
+    desc = xdf_stream["info"].get("desc", [None])[0]
+    if desc:
+        desc_to_xml(stream_info.desc(), desc)
+    return stream_info
+
+
+class ReplayClock():
+    """
+    The schedule shared by every stream of a replay: maps recorded time stamps onto pylsl.local_clock().
+    """
+    def __init__(self, first_stamp, speed = 1.0, lead_time = 1.0):
+        """
+        :param first_stamp: Earliest time stamp of every stream replayed, sent lead_time seconds from now.
+        :param speed: Replay speed multiplier. 0 sends as fast as possible, with time stamps at real time.
+        :param lead_time: Seconds left for consumers to resolve the outlets before the first sample is due.
+        """
+        self.first_stamp = first_stamp
+        self.speed = speed
+        self.start = pylsl.local_clock() + lead_time
+
+    def Due(self, stamps):
+        """
+        :return: The local_clock() time at which samples recorded at `stamps` are due.
+        """
+        return self.start + (numpy.asarray(stamps, dtype=numpy.float64) - self.first_stamp) / (self.speed if self.speed else 1.0)
+
+    def WaitUntil(self, due):
+        delay = due - pylsl.local_clock()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class XdfStreamReplayer():
+    """
+    Replays one XDF stream through its own LSL outlet on a background thread.
+    """
+    def __init__(self, xdf_stream, chunk_size = 32):
+        """
+        Initialize the class and create the outlet, so it can be resolved before the replay starts.
+
+        :param xdf_stream: A stream as returned by pyxdf.load_xdf.
+        :param chunk_size: Number of samples sent per push_chunk.
+        """
+        self.xdf_stream = xdf_stream #Store the XDF stream.
+        self.name = get(xdf_stream, "info.name", report=False) #Store the stream name, for the report.
+        self.chunk_size = chunk_size #Store the chunk size.
+        self.outlet = pylsl.StreamOutlet(stream_info_from_xdf(xdf_stream), chunk_size) #The outlet of the stream.
+        self.stats = None #ReplayStats of the replay, once finished.
+        self.error = None #Exception raised by the replay thread, if any.
+        self.thread = None
+
+    def Start(self, clock: ReplayClock):
+        self.thread = threading.Thread(target=self.Replay, args=(clock,), daemon=True)
+        self.thread.start()
+
+    def Join(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def Replay(self, clock: ReplayClock):
+        """
+        Push the samples in chunks, each sent when its last sample is due on the shared clock.
+        """
+        try:
+            stamps = numpy.asarray(self.xdf_stream["time_stamps"], dtype=numpy.float64)
+            time_series = self.xdf_stream["time_series"]
+            if isinstance(time_series, numpy.ndarray):
+                time_series = time_series.reshape(len(stamps), -1)
+            due = clock.Due(stamps)
+            lateness = []
+            clock.WaitUntil(clock.start)
+            start = pylsl.local_clock()
+            for i in range(0, len(stamps), self.chunk_size):
+                j = min(i + self.chunk_size, len(stamps))
+                if clock.speed:
+                    clock.WaitUntil(due[j - 1])
+                    lateness.append(pylsl.local_clock() - due[j - 1])
+                self.outlet.push_chunk(time_series[i:j], due[i:j])
+            elapsed = pylsl.local_clock() - start
+            duration = stamps[-1] - stamps[0] if len(stamps) else 0.0
+            self.stats = ReplayStats(len(stamps), duration, clock.speed, elapsed, lateness)
+        except Exception as e:
+            self.error = e
+
+
+class XdfReplay():
+    """
+    Replays the streams of an XDF file over LSL, one outlet and thread per stream, on a shared clock.
+    """
+    def __init__(self, path_to_xdf, speed = 1.0, chunk_size = 32, stream_names = None, lead_time = 1.0):
+        """
+        Initialize the class, load the XDF file and create an outlet per stream.
+
+        :param path_to_xdf: Path of the XDF file to replay.
+        :param speed: Replay speed multiplier, e.g. 1 for real time or 10 for ten times faster. 0 sends as fast as possible.
+        :param chunk_size: Number of samples sent per push_chunk.
+        :param stream_names: Optional names of the streams to replay. Every stream with samples is replayed if None.
+        :param lead_time: Seconds left for consumers to resolve the outlets before the first sample is due.
+        """
+        self.speed = speed #Store the replay speed.
+        self.lead_time = lead_time #Store the lead time.
+        xdf_streams, _ = pyxdf.load_xdf(path_to_xdf)
+        xdf_streams = [xdf_stream for xdf_stream in xdf_streams if len(xdf_stream["time_stamps"])
+                       and (stream_names is None or get(xdf_stream, "info.name", report=False) in stream_names)]
+        self.replayers = [XdfStreamReplayer(xdf_stream, chunk_size) for xdf_stream in xdf_streams] #One replayer per stream.
+
+    def Run(self):
+        """
+        Replay every stream and wait until all have been sent.
+
+        :return: A dictionary of the ReplayStats of each stream, indexed by stream name.
+        """
+        if not self.replayers:
+            return {}
+        first_stamp = min(replayer.xdf_stream["time_stamps"][0] for replayer in self.replayers)
+        clock = ReplayClock(first_stamp, self.speed, self.lead_time)
+        for replayer in self.replayers:
+            replayer.Start(clock)
+        for replayer in self.replayers:
+            replayer.Join()
+        return {replayer.name: replayer.stats for replayer in self.replayers}
+
+    def Report(self):
+        """
+        :return: A JSON serializable dictionary with the timing of every stream and the worst lateness of the replay.
+        """
+        streams = {replayer.name: {"samples": replayer.stats.samples, "elapsed": replayer.stats.elapsed,
+                                   "recorded_rate": replayer.stats.recorded_rate, "achieved_rate": replayer.stats.achieved_rate,
+                                   "jitter": replayer.stats.jitter, "max_lateness": replayer.stats.max_lateness}
+                   for replayer in self.replayers if replayer.stats is not None}
+        return {"speed": self.speed, "streams": streams,
+                "max_lateness": max((stream["max_lateness"] for stream in streams.values()), default=0.0)}
+
+
+if __name__ == "__main__":
+    """
+    Command-line interface for replaying an XDF file over LSL.
+    """
+    parser = argparse.ArgumentParser("XDF to LSL Replayer",
+    """This program replays every stream of an XDF file over LSL, keeping the recorded offsets between streams.""")
+    parser.add_argument("xdf_file_path", help="Path to the XDF file to replay.")
+    parser.add_argument("--speed", help="replay speed multiplier, 0 streams as fast as possible", type=float, default=1.0)
+    parser.add_argument("--chunk-size", help="number of samples sent per chunk", type=int, default=32)
+    parser.add_argument("--streams", help="names of the streams to replay, defaults to every stream", nargs="+")
+    parser.add_argument("--lead-time", help="seconds left for consumers to resolve the outlets before replaying", type=float, default=1.0)
+    parser.add_argument("--report", help="Path to write the JSON timing report to.")
+    args = parser.parse_args()
+
+    replay = XdfReplay(args.xdf_file_path, args.speed, args.chunk_size, args.streams, args.lead_time)
+    print(f"replaying {len(replay.replayers)} streams from {args.xdf_file_path}")
+    for name, stats in replay.Run().items():
+        print(f"{name}: {stats.Report()}")
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(replay.Report(), report_file, indent=2)
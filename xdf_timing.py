@@ -0,0 +1,126 @@
+"""
+Control of pyxdf's timing stages and diagnostics of the resulting time stamps.
+"""
+import numpy
+from utils import get
+
+MAX_REPORTED_GAPS = 20
+
+
+class XdfTimingOptions():
+    """
+    The settings of pyxdf's clock synchronization and dejittering, passed on to pyxdf.load_xdf.
+    The defaults are those of pyxdf.
+    """
+    def __init__(self, synchronize_clocks = True, handle_clock_resets = True, dejitter_timestamps = True,
+                 jitter_break_threshold_seconds = 1.0, jitter_break_threshold_samples = 500,
+                 clock_reset_threshold_seconds = 5.0, clock_reset_threshold_stds = 5.0,
+                 clock_reset_threshold_offset_seconds = 1.0, clock_reset_threshold_offset_stds = 10.0,
+                 winsor_threshold = 0.0001):
+        """
+        :param synchronize_clocks: Map the time stamps onto the recording computer's clock using the clock offsets.
+        :param handle_clock_resets: Detect clock resets (e.g. a device restarted mid-recording) and synchronize each part separately.
+        :param dejitter_timestamps: Replace the time stamps of regularly sampled streams by a linear fit per segment.
+        :param jitter_break_threshold_seconds: Gap in seconds that starts a new dejittering segment.
+        :param jitter_break_threshold_samples: Gap in samples that starts a new dejittering segment.
+        :param clock_reset_threshold_seconds: Time jump in seconds considered a clock reset.
+        :param clock_reset_threshold_stds: Time jump in standard deviations considered a clock reset.
+        :param clock_reset_threshold_offset_seconds: Offset jump in seconds considered a clock reset.
+        :param clock_reset_threshold_offset_stds: Offset jump in standard deviations considered a clock reset.
+        :param winsor_threshold: Error in seconds above which clock offsets are winsorized by the robust fit.
+        """
+        self.synchronize_clocks = synchronize_clocks
+        self.handle_clock_resets = handle_clock_resets
+        self.dejitter_timestamps = dejitter_timestamps
+        self.jitter_break_threshold_seconds = jitter_break_threshold_seconds
+        self.jitter_break_threshold_samples = jitter_break_threshold_samples
+        self.clock_reset_threshold_seconds = clock_reset_threshold_seconds
+        self.clock_reset_threshold_stds = clock_reset_threshold_stds
+        self.clock_reset_threshold_offset_seconds = clock_reset_threshold_offset_seconds
+        self.clock_reset_threshold_offset_stds = clock_reset_threshold_offset_stds
+        self.winsor_threshold = winsor_threshold
+
+    def LoadKwargs(self):
+        """
+        :return: The keyword arguments of pyxdf.load_xdf for these settings.
+        """
+        return dict(vars(self))
+
+    def GapThreshold(self, nominal_srate):
+        """
+        :return: The interval in seconds above which consecutive samples are in different segments, as in pyxdf's dejittering.
+        """
+        if not nominal_srate:
+            return self.jitter_break_threshold_seconds
+        return max(self.jitter_break_threshold_seconds, self.jitter_break_threshold_samples / nominal_srate)
+
+
+def clock_drift(clock_times, clock_values):
+    """
+    :param clock_times: Times of the clock offset measurements, on the stream's clock.
+    :param clock_values: The measured offsets in seconds.
+    :return: A dictionary with the number of offset measurements, their range and the drift of the offset
+    (the slope of a least squares line, in parts per million), None where there are too few measurements.
+    """
+    clock_times = numpy.asarray(clock_times, dtype=numpy.float64)
+    clock_values = numpy.asarray(clock_values, dtype=numpy.float64)
+    drift = None
+    if len(clock_times) >= 2 and numpy.ptp(clock_times) > 0:
+        centered = clock_times - clock_times.mean()
+        drift = float(centered @ (clock_values - clock_values.mean()) / (centered @ centered) * 1e6)
+    return {"offsets": len(clock_values),
+            "offset_range": float(numpy.ptp(clock_values)) if len(clock_values) else None,
+            "drift_ppm": drift}
+
+
+def stream_timing(xdf_stream, options: XdfTimingOptions = None):
+    """
+    Diagnose the time stamps of a loaded stream with vectorized NumPy.
+
+    :param xdf_stream: A stream as returned by pyxdf.load_xdf.
+    :param options: The XdfTimingOptions the stream was loaded with, for the gap threshold. pyxdf's defaults if None.
+    :return: A JSON serializable dictionary with the samples, duration, nominal and effective sample rates,
+    segments, gaps (the first MAX_REPORTED_GAPS), interval jitter, backward steps and clock offset drift of the stream.
+    """
+    options = options or XdfTimingOptions()
+    stamps = numpy.asarray(xdf_stream["time_stamps"], dtype=numpy.float64)
+    nominal_srate = float(get(xdf_stream, "info.nominal_srate", report=False) or 0)
+    timing = {"samples": len(stamps), "duration": float(stamps[-1] - stamps[0]) if len(stamps) else 0.0,
+              "nominal_srate": nominal_srate, "effective_srate": None, "segments": int(len(stamps) > 0), "gaps": [],
+              "interval_jitter": None, "backward_steps": 0}
+    timing.update(clock_drift(xdf_stream.get("clock_times", []), xdf_stream.get("clock_values", [])))
+    if len(stamps) < 2:
+        return timing
+
+    intervals = numpy.diff(stamps)
+    timing["backward_steps"] = int(numpy.count_nonzero(intervals < 0))
+    if not nominal_srate:
+        return timing
+
+    #Split the stream where the interval exceeds the threshold pyxdf's dejittering breaks segments at.
+    breaks = numpy.flatnonzero(numpy.abs(intervals) > options.GapThreshold(nominal_srate))
+    starts = numpy.concatenate(([0], breaks + 1))
+    ends = numpy.concatenate((breaks, [len(stamps) - 1]))
+    durations = stamps[ends] - stamps[starts]
+    timing["segments"] = len(starts)
+    timing["gaps"] = [{"start": float(stamps[i]), "seconds": float(intervals[i])} for i in breaks[:MAX_REPORTED_GAPS]]
+    if durations.sum() > 0:
+        timing["effective_srate"] = float((ends - starts).sum() / durations.sum())
+
+    #The spread of the intervals within segments, around the effective sampling interval.
+    in_segment = numpy.ones(len(intervals), dtype=bool)
+    in_segment[breaks] = False
+    if in_segment.any():
+        timing["interval_jitter"] = float(intervals[in_segment].std())
+    return timing
+
+
+def timing_report(xdf_streams, options: XdfTimingOptions = None):
+    """
+    :param xdf_streams: The streams as returned by pyxdf.load_xdf.
+    :param options: The XdfTimingOptions the streams were loaded with.
+    :return: A JSON serializable dictionary with the options and the stream_timing of every stream, indexed by stream name.
+    """
+    options = options or XdfTimingOptions()
+    return {"options": options.LoadKwargs(),
+            "streams": {str(get(xdf_stream, "info.name", report=False)): stream_timing(xdf_stream, options) for xdf_stream in xdf_streams}}